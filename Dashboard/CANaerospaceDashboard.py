@@ -1,17 +1,22 @@
 import argparse
+import os
 import struct
+import sys
 import threading
 import logging
-from dataclasses import dataclass, field
-from typing import Optional, Dict
+from typing import Dict
 
 import can
 from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
 
 from flaputils import get_flap_symbol, get_optimal_flap, get_empty_mass
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from signalcache import SignalCache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -37,42 +42,25 @@ CAN_IDS = {
 ID_MAP = {v: k for k, v in CAN_IDS.items()}
 
 
-@dataclass
 class FlightData:
-    lock: threading.Lock = field(default_factory=threading.Lock)
-    ias: Optional[float] = None
-    tas: Optional[float] = None
-    cas: Optional[float] = None
-    alt: Optional[float] = None
-    vario: Optional[float] = None
-    flap: Optional[int] = None
-    lat: Optional[float] = None
-    lon: Optional[float] = None
-    gs: Optional[float] = None
-    tt: Optional[float] = None
-    pilot_mass: float = 0
-    enl: Optional[int] = None
+    """
+    The latest values of the flight data, written by the CAN receiver thread without locks,
+    see :class:`signalcache.SignalCache`.
+    """
+    FIELDS = ('ias', 'tas', 'cas', 'alt', 'vario', 'flap', 'lat', 'lon', 'gs', 'tt', 'pilot_mass', 'enl')
+
+    def __init__(self):
+        self.signals = SignalCache(self.FIELDS, defaults={'pilot_mass': 0})
 
     def update(self, key: str, value: any):
-        with self.lock:
-            setattr(self, key, value)
+        self.signals.set(key, value)
+
+    @property
+    def version(self) -> int:
+        return self.signals.version
 
     def get_snapshot(self) -> Dict:
-        with self.lock:
-            return {
-                'ias': self.ias,
-                'tas': self.tas,
-                'cas': self.cas,
-                'alt': self.alt,
-                'vario': self.vario,
-                'flap': self.flap,
-                'lat': self.lat,
-                'lon': self.lon,
-                'gs': self.gs,
-                'tt': self.tt,
-                'pilot_mass': self.pilot_mass,
-                'enl': self.enl
-            }
+        return self.signals.snapshot()[1]
 
 
 class CANReceiver:
@@ -176,7 +164,8 @@ app.layout = html.Div([
             'color': 'blue'
         })
     ], style={'display': 'flex', 'alignItems': 'center', 'justifyContent': 'center'}),
-    dcc.Interval(id="timer", interval=500)
+    dcc.Interval(id="timer", interval=500),
+    dcc.Store(id="version")
 ])
 
 
@@ -184,11 +173,16 @@ app.layout = html.Div([
     [Output("gauge", "figure"),
      Output("flap-display", "children"),
      Output("optimal-flap-display", "children"),
-     Output("tas-display", "children")],
-    Input("timer", "n_intervals")
+     Output("tas-display", "children"),
+     Output("version", "data")],
+    Input("timer", "n_intervals"),
+    State("version", "data")
 )
-def update_dashboard(n):
-    data = flight_state.get_snapshot()
+def update_dashboard(n, version):
+    # redraw only when new CAN data arrived since the last redraw of this page
+    if version is not None and not flight_state.signals.changed(version):
+        raise PreventUpdate
+    version, data = flight_state.signals.snapshot()
     ias = data['ias']
     tas = data['tas']
     flap = data['flap']
@@ -218,7 +212,7 @@ def update_dashboard(n):
         if opt_flap:
             optimal_flap_text = f"Opt: {opt_flap}"
 
-    return fig, flap_text, optimal_flap_text, tas_display
+    return fig, flap_text, optimal_flap_text, tas_display, version
 
 
 if __name__ == '__main__':
@@ -8,6 +8,8 @@ import logging
 import helptext
 from canreader import CanbusPos
 from cansender import CanSender
+from replay import check_rate
+from transform import Pipeline
 
 logger = logging.getLogger("VideoAndCanPlayer2")
 
@@ -93,6 +95,24 @@ def main(argv=None) -> int:
         logger.info("No syncpoints for video")
 
     filter_out = canlog_cfg.get("filter_out", [])
+    try:
+        Pipeline(filter_out=filter_out)
+    except ValueError as e:
+        print(f"Invalid canlog.filter_out: {e}", file=sys.stderr)
+        return 2
+
+    try:
+        rate = check_rate(canlog_cfg.get("rate", 1.0))
+    except (TypeError, ValueError) as e:
+        print(f"Invalid canlog.rate: {e}", file=sys.stderr)
+        return 2
+
+    transforms = canlog_cfg.get("transforms")
+    try:
+        Pipeline(transforms or [])
+    except ValueError as e:
+        print(f"Invalid canlog.transforms: {e}", file=sys.stderr)
+        return 2
 
     description = config.get("description", videofilename)
 
@@ -103,6 +123,11 @@ def main(argv=None) -> int:
         canbus_cfg.get("interface"),
         with_internal_bus=True,
         filter_out=filter_out,
+        rate=rate,
+        prime=bool(canlog_cfg.get("prime", False)),
+        outputs=canbus_cfg.get("outputs"),
+        transforms=transforms,
+        internal_max_rate=canbus_cfg.get("internal_max_rate", 4.0),
         name="CanSender",
     )
 
@@ -1,60 +1,44 @@
 import argparse
 import sqlite3
 
+import summary
+
 '''
    Analyze canlog db in several ways...
+   The numbers come from the summary tables written by logfile2sqldb.py, for older dbs they
+   are computed once and stored, see summary.py.
 '''
 
 parser = argparse.ArgumentParser(
     description='Analyze canlog db in several ways. So far check for missing of "Message Code"')
 parser.add_argument('-dbfile', metavar='dbfile', type=str, help='Database file.')
+parser.add_argument('--rebuild', action='store_true', help='Compute the summary tables again.')
 args = parser.parse_args()
 
-msg_codes = {}
-msg_codes_stats = {}
-msg_ids_stats = {}
-canIds_stats = {}
-cnt = 0
-
-
-def codes_statistics(codes, node, code, codes_stats, id, ids_stats):
-    if node in codes:
-        i = 1
-        if codes[node] == 255:
-            codes[node] = 0
-            i = 0
-        if not codes[node] + i == code:
-            if node not in codes_stats:
-                codes_stats[node] = 1
-            else:
-                codes_stats[node] += 1
-            if id not in ids_stats:
-                ids_stats[id] = 1
-            else:
-                ids_stats[id] += 1
-    codes[node] = code
-
-
-def canid_statistics(ids, id):
-    if id not in ids:
-        ids[id] = 1
-    ids[id] += 1
-
-
 con = sqlite3.connect(args.dbfile)
-cur = con.cursor()
-cur.fetchall()
-cur.execute('SELECT * FROM messages')
-cnt = 0
-for msg in cur:
-    codes_statistics(msg_codes, msg[6][0], msg[6][3], msg_codes_stats, msg[1], msg_ids_stats)
-    canid_statistics(canIds_stats, msg[1])
-    cnt += 1
+if args.rebuild or not summary.has_summary(con):
+    print('Create summary of', args.dbfile)
+    summary.create_summary(con)
+
+info = summary.read_info(con)
+cnt = info['count']
+msg_codes_stats = con.execute('SELECT node, code_gaps FROM summary_nodes WHERE code_gaps > 0').fetchall()
+msg_ids_stats = con.execute('SELECT arbitration_id, code_gaps FROM summary_ids WHERE code_gaps > 0').fetchall()
+canIds_stats = con.execute('SELECT arbitration_id, count FROM summary_ids').fetchall()
 
 print("codes not in sync statistics of total ", cnt)
-print(sorted(msg_codes_stats.items(), key=lambda kv: kv[0]))
-print(sorted(msg_ids_stats.items(), key=lambda kv: kv[0]))
+print(sorted(msg_codes_stats, key=lambda kv: kv[0]))
+print(sorted(msg_ids_stats, key=lambda kv: kv[0]))
 
 print("canId statistics of total ", cnt)
-print(sorted(canIds_stats.items(), key=lambda kv: kv[0]))
-print(sorted(canIds_stats.items(), key=lambda kv: kv[1], reverse=True))
+print(sorted(canIds_stats, key=lambda kv: kv[0]))
+print(sorted(canIds_stats, key=lambda kv: kv[1], reverse=True))
+
+print("time range ", info['first_ts'], info['last_ts'])
+print("GPS bounds lat ", info['lat_min'], info['lat_max'], " lon ", info['lon_min'], info['lon_max'])
+print("gaps longer than {} s".format(info['gap_seconds']))
+print(con.execute('SELECT start_ts, end_ts, end_ts - start_ts FROM summary_gaps ORDER BY start_ts').fetchall())
+
+print("canId id, count, first ts, last ts, mean period, payload changes")
+for row in con.execute('SELECT arbitration_id, count, first_ts, last_ts, mean_period, changes FROM summary_ids'):
+    print(row)
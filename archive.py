@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Archive of many flights, partitioned by time, with a catalog db.
+
+An archive is a directory with one file per hour of log (UTC) and source log, and the catalog
+``catalog.db``::
+
+    <archive>/catalog.db
+    <archive>/2019/09/21/10-candump-2019-09-21_110938.canz
+    <archive>/2019/09/21/11-candump-2019-09-21_110938.canz
+
+The partition of an hour is written once per import. When the clock of a log jumps back into an
+hour whose partition is closed already, these frames go to a further partition of the hour,
+``10-candump-2019-09-21_110938-2.canz``, the reader merges them.
+
+The catalog has the time range, the number of frames, the CAN ids and the GPS bounding box of
+every partition, so the partitions of a time range or a region are found without opening them.
+The partitions are .canz block files (see blockstore.py) or sqlite3 dbs of schema version 2.
+The checkpoints of the bus state of a .canz partition (every :data:`CHECKPOINT_SECONDS` and at
+its end) are kept in the catalog, a db partition has them itself.
+
+:class:`ArchiveReader` reads a time range across partitions in timestamp order, it is returned
+by :class:`player2.LogReader2` for an archive directory, so ``canlog.filename`` in the config
+file can be an archive.
+
+Import logs and list the partitions with::
+
+    python archive.py import <archive> <can-logfile>...
+    python archive.py list <archive> [--start <time>] [--end <time>]
+"""
+
+import argparse
+import heapq
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from operator import attrgetter, itemgetter
+
+import blockstore
+import canaerospace
+import logrows
+import sqlite2
+
+CATALOG = 'catalog.db'
+
+PARTITION_SECONDS = 3600
+
+FORMATS = ('canz', 'db')
+
+# seconds between two checkpoints of a .canz partition in the catalog, see ArchiveReader.bus_state
+CHECKPOINT_SECONDS = 60.0
+
+INSERT_CHECKPOINT = "INSERT INTO partition_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+LAT_ID = canaerospace.SIGNAL_IDS['lat']
+LON_ID = canaerospace.SIGNAL_IDS['lon']
+
+
+def is_archive(path):
+    return os.path.isfile(os.path.join(path, CATALOG))
+
+
+def open_catalog(archive):
+    conn = sqlite3.connect(os.path.join(archive, CATALOG), check_same_thread=False)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS partitions
+        (
+          path TEXT PRIMARY KEY,
+          start REAL,
+          end REAL,
+          count INTEGER,
+          lat_min REAL,
+          lat_max REAL,
+          lon_min REAL,
+          lon_max REAL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS partition_ids
+        (
+          path TEXT,
+          arbitration_id INTEGER,
+          PRIMARY KEY (path, arbitration_id)
+        ) WITHOUT ROWID""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS partition_checkpoints
+        (
+          path TEXT,
+          cp INTEGER,
+          ts REAL,
+          arbitration_id INTEGER,
+          extended INTEGER,
+          remote INTEGER,
+          error INTEGER,
+          dlc INTEGER,
+          data BLOB
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS partitions_start_idx ON partitions (start)")
+    conn.execute("CREATE INDEX IF NOT EXISTS partition_checkpoints_idx ON partition_checkpoints (path, cp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS partition_ids_id_idx ON partition_ids (arbitration_id)")
+    conn.commit()
+    return conn
+
+
+def find_partitions(conn, start_time=None, end_time=None, can_ids=None, bbox=None):
+    """
+    :param bbox: optional (lat_min, lon_min, lat_max, lon_max), partitions with a position inside
+    :return: the relative paths and time ranges of the partitions with frames in
+             [`start_time`, `end_time`) of `can_ids`, ordered by start
+    """
+    conditions = []
+    params = []
+    if start_time is not None:
+        conditions.append("end >= ?")
+        params.append(start_time)
+    if end_time is not None:
+        conditions.append("start < ?")
+        params.append(end_time)
+    if can_ids:
+        can_ids = sorted(can_ids)
+        conditions.append("path IN (SELECT path FROM partition_ids WHERE arbitration_id IN ({}))".format(
+            ", ".join("?" * len(can_ids))))
+        params.extend(can_ids)
+    if bbox:
+        conditions.append("lat_max >= ? AND lon_max >= ? AND lat_min <= ? AND lon_min <= ?")
+        params.extend(bbox)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return conn.execute("SELECT path, start, end FROM partitions{} ORDER BY start".format(where), params).fetchall()
+
+
+class PartitionWriter:
+    """
+    Writes the rows of one partition and collects its catalog entry.
+    """
+
+    def __init__(self, archive, path, fmt='canz'):
+        self.path = path
+        # .canz: the last frame of every CAN id seen so far, written to the catalog every
+        # CHECKPOINT_SECONDS and at the end, like the checkpoints of a db partition
+        self.state = {}
+        self.catalog_checkpoints = []
+        self._next_cp = None
+        self._last_ts = None
+        # False once a row came before the latest one, the checkpoints are then built at the end
+        self.ordered = True
+        self.filename = os.path.join(archive, path)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.start = None
+        self.end = None
+        self.count = 0
+        self.ids = set()
+        self.bbox = [None, None, None, None]
+        if fmt == 'canz':
+            self.writer = blockstore.BlockWriter(self.filename)
+            self.conn = None
+        else:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            self.writer = None
+            self.conn = sqlite3.connect(self.filename)
+            sqlite2.create_messages_table(self.conn, 2)
+            logrows.begin_bulk_load(self.conn)
+            self.checkpoints = sqlite2.CheckpointBuilder(self.conn)
+            self.seq = 1
+
+    def add(self, rows):
+        if self.writer:
+            self.writer.add(rows)
+            self._checkpoint(rows)
+        else:
+            self.conn.executemany(sqlite2.INSERT_MESSAGE[2], sqlite2.v2_rows(rows, self.seq))
+            self.checkpoints.add(rows)
+            self.seq += len(rows)
+        ts = [row[0] for row in rows]
+        self.start = min(ts) if self.start is None else min(self.start, min(ts))
+        self.end = max(ts) if self.end is None else max(self.end, max(ts))
+        self.count += len(rows)
+        self.ids.update(row[1] for row in rows if not row[4])
+        for row in rows:
+            if row[1] == LAT_ID or row[1] == LON_ID:
+                self._position(row)
+
+    def _checkpoint(self, rows):
+        """
+        Collect the checkpoints of `rows` in timestamp order, see :class:`sqlite2.CheckpointBuilder`.
+        """
+        state = self.state
+        next_time = self._next_cp
+        last_ts = self._last_ts
+        for row in rows:
+            ts = row[0]
+            if next_time is None:
+                next_time = (ts // CHECKPOINT_SECONDS + 1) * CHECKPOINT_SECONDS
+            elif ts >= next_time:
+                cp = int(ts // CHECKPOINT_SECONDS)
+                self._snapshot(cp)
+                next_time = (cp + 1) * CHECKPOINT_SECONDS
+            elif ts < last_ts:
+                self.ordered = False
+            last_ts = ts
+            if not row[4]:
+                state[row[1]] = row
+        self._next_cp = next_time
+        self._last_ts = last_ts
+
+    def _rebuild_checkpoints(self):
+        """
+        The checkpoints of a partition whose rows were not in timestamp order, from its rows sorted.
+        """
+        reader = blockstore.BlockReader(self.filename)
+        try:
+            rows = [row for batch in reader.read_rows() for row in batch]
+        finally:
+            reader.stop()
+        rows.sort(key=itemgetter(0))
+        self.state = {}
+        self.catalog_checkpoints = []
+        self._next_cp = None
+        self._last_ts = None
+        self._checkpoint(rows)
+
+    def _snapshot(self, cp):
+        """
+        Checkpoint `cp`: the frames before ``cp * CHECKPOINT_SECONDS``.
+        """
+        self.catalog_checkpoints.extend((self.path, cp) + tuple(row[:6]) + (bytes(row[6]),)
+                                        for row in self.state.values())
+
+    def _position(self, row):
+        value = canaerospace.decode(row[1], row[6])
+        if value is None or row[4]:
+            return
+        i = 0 if row[1] == LAT_ID else 1
+        bbox = self.bbox
+        if bbox[i] is None or value < bbox[i]:
+            bbox[i] = value
+        if bbox[i + 2] is None or value > bbox[i + 2]:
+            bbox[i + 2] = value
+
+    def close(self, catalog):
+        if self.writer:
+            self.writer.close()
+            if not self.ordered:
+                self._rebuild_checkpoints()
+            if self.end is not None:
+                self._snapshot(int(self.end // CHECKPOINT_SECONDS) + 1)
+        else:
+            self.conn.commit()
+            sqlite2.create_messages_indexes(self.conn)
+            if self.checkpoints.ordered:
+                self.checkpoints.finish()
+            else:
+                sqlite2.create_checkpoints(self.conn)
+            logrows.end_bulk_load(self.conn)
+            self.conn.close()
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        catalog.execute("DELETE FROM partition_ids WHERE path = ?", (self.path,))
+        catalog.execute("DELETE FROM partition_checkpoints WHERE path = ?", (self.path,))
+        catalog.executemany(INSERT_CHECKPOINT, self.catalog_checkpoints)
+        catalog.execute("INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (self.path, self.start, self.end, self.count, lat_min, lat_max, lon_min, lon_max))
+        catalog.executemany("INSERT INTO partition_ids VALUES (?, ?)", ((self.path, i) for i in sorted(self.ids)))
+        catalog.commit()
+
+
+def partition_path(ts, source, fmt='canz', part=1):
+    """
+    :param int part: number of the partition of the same hour and source, see the module doc
+    :return: the path of the partition of `ts` for the log `source`, relative to the archive
+    """
+    t = datetime.fromtimestamp(ts, timezone.utc)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    if part > 1:
+        stem = '{}-{}'.format(stem, part)
+    return os.path.join(t.strftime('%Y'), t.strftime('%m'), t.strftime('%d'),
+                        '{}-{}.{}'.format(t.strftime('%H'), stem, fmt))
+
+
+def import_log(archive, infiles, source=None, fmt='canz', jobs=None):
+    """
+    Import the frames of `infiles` into `archive`, one partition per hour.
+
+    :param str source: name of the partitions, default the name of the first input file
+    :return: the number of frames and the paths of the partitions written
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown partition format {}'.format(fmt))
+    os.makedirs(archive, exist_ok=True)
+    catalog = open_catalog(archive)
+    source = source or infiles[0]
+    spool = None
+    if len(infiles) == 1:
+        batches = logrows.batched(logrows.file_rows(infiles[0]))
+    else:
+        spool = tempfile.TemporaryDirectory(prefix='archive-', dir=archive)
+        batches = logrows.parallel_batches(infiles, spool.name, jobs)
+    writers = {}
+    # the partitions closed by this import, they are never opened again
+    written = set()
+    paths = []
+    m = 0
+    try:
+        for batch in batches:
+            parts = {}
+            for row in batch:
+                parts.setdefault(int(row[0] // PARTITION_SECONDS), []).append(row)
+            for key, rows in parts.items():
+                writer = writers.get(key)
+                if writer is None:
+                    part = 1
+                    path = partition_path(rows[0][0], source, fmt)
+                    while path in written:
+                        part += 1
+                        path = partition_path(rows[0][0], source, fmt, part)
+                    if part > 1:
+                        print('Frames of {} after its partition was written, into {}'.format(
+                            datetime.fromtimestamp(rows[0][0], timezone.utc).isoformat(), path))
+                    writer = writers[key] = PartitionWriter(archive, path, fmt)
+                writer.add(rows)
+            # the input is (about) in timestamp order, an hour before the one of the last row is
+            # complete; after a jump back of the clock the hours after it stay open
+            current = int(batch[-1][0] // PARTITION_SECONDS)
+            for key in [k for k in writers if k < current - 1]:
+                writer = writers.pop(key)
+                writer.close(catalog)
+                written.add(writer.path)
+                paths.append(writer.filename)
+            m += len(batch)
+        for key in sorted(writers):
+            writer = writers.pop(key)
+            writer.close(catalog)
+            paths.append(writer.filename)
+    finally:
+        if spool:
+            spool.cleanup()
+        catalog.close()
+    return m, paths
+
+
+class ArchiveReader:
+    """
+    The frames of an archive as `can.Message`, across partitions in timestamp order.
+    Partitions with overlapping time ranges (e.g. logs of two loggers) are merged.
+    """
+
+    def __init__(self, archive, start_time=None, end_time=None, can_ids=None):
+        """
+        :param real start_time: time where to start reading (inclusive)
+        :param real end_time: time where to stop reading (exclusive), None reads to the end
+        :param can_ids: optional collection of arbitration ids to read, None reads all
+        """
+        self.archive = archive
+        self.start_time = start_time
+        self.end_time = end_time
+        self.can_ids = can_ids
+        self.catalog = open_catalog(archive)
+        self._readers = []
+
+    def _open(self, path):
+        filename = os.path.join(self.archive, path)
+        if filename.endswith(blockstore.SUFFIX):
+            reader = blockstore.BlockReader(filename)
+        else:
+            reader = sqlite2.SqliteReader2(filename, 'messages')
+        self._readers.append(reader)
+        return reader
+
+    def _close(self, reader):
+        reader.stop()
+        self._readers.remove(reader)
+
+    def _groups(self, partitions):
+        """
+        :return: the partitions in groups of overlapping time ranges
+        """
+        group = []
+        group_end = None
+        for partition in partitions:
+            if group and partition[1] > group_end:
+                yield group
+                group = []
+            group.append(partition)
+            group_end = partition[2] if len(group) == 1 else max(group_end, partition[2])
+        if group:
+            yield group
+
+    def read_range(self, start_time=None, end_time=None, can_ids=None):
+        """
+        Read the messages in the time window [`start_time`, `end_time`) in timestamp order.
+
+        :rtype: Generator[can.Message]
+        """
+        partitions = find_partitions(self.catalog, start_time, end_time, can_ids)
+        for group in self._groups(partitions):
+            readers = [self._open(path) for path, _, _ in group]
+            try:
+                ranges = [reader.read_range(start_time, end_time, can_ids) for reader in readers]
+                if len(ranges) == 1:
+                    yield from ranges[0]
+                else:
+                    yield from heapq.merge(*ranges, key=attrgetter('timestamp'))
+            finally:
+                for reader in readers:
+                    self._close(reader)
+
+    def bus_state(self, timestamp, can_ids=None):
+        """
+        The last frame of every CAN id before `timestamp`, from the partitions of the hour of
+        `timestamp` and the hour before. See :meth:`sqlite2.SqliteReader2.bus_state`, a db
+        partition has its checkpoints, the checkpoints of a .canz partition are in the catalog:
+        the last frames up to the checkpoint before `timestamp` and the frames since (at most
+        :data:`CHECKPOINT_SECONDS`). Partitions imported without checkpoints are read from
+        their start.
+
+        :return: the messages in timestamp order
+        """
+        state = {}
+        partitions = find_partitions(self.catalog, timestamp - 2 * PARTITION_SECONDS, timestamp, can_ids)
+        for path, start, end in reversed(partitions):
+            reader = self._open(path)
+            try:
+                if isinstance(reader, sqlite2.SqliteReader2):
+                    messages = reader.bus_state(timestamp, can_ids)
+                else:
+                    messages = self._canz_state(reader, path, start, timestamp, can_ids)
+                for message in messages:
+                    if not message.is_error_frame:
+                        known = state.get(message.arbitration_id)
+                        if known is None or known.timestamp <= message.timestamp:
+                            state[message.arbitration_id] = message
+            finally:
+                self._close(reader)
+        return sorted(state.values(), key=attrgetter('timestamp'))
+
+    def _canz_state(self, reader, path, start, timestamp, can_ids):
+        """
+        :return: the last frames of a .canz partition before `timestamp`, not ordered
+        """
+        messages = []
+        since = start
+        cp = self.catalog.execute("SELECT MAX(cp) FROM partition_checkpoints WHERE path = ? AND cp <= ?",
+                                  (path, int(timestamp // CHECKPOINT_SECONDS))).fetchone()[0]
+        if cp is not None:
+            since = cp * CHECKPOINT_SECONDS
+            rows = self.catalog.execute("SELECT ts, arbitration_id, extended, remote, error, dlc, data "
+                                        "FROM partition_checkpoints WHERE path = ? AND cp = ?", (path, cp))
+            messages.extend(sqlite2.assemble_message(row) for row in rows if not can_ids or row[1] in can_ids)
+        if since < timestamp:
+            messages.extend(reader.read_range(since, timestamp, can_ids))
+        return messages
+
+    def __iter__(self):
+        return self.read_range(self.start_time, self.end_time, self.can_ids)
+
+    def stop(self):
+        for reader in list(self._readers):
+            self._close(reader)
+        self.catalog.close()
+
+
+def _time(value):
+    """
+    :return: Epoch seconds of a number or an ISO date (UTC), for the command line
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "python archive.py",
+        description="Import can logs into a partitioned archive and list its partitions.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('import', help='Import can logs, one partition per hour.')
+    add.add_argument('archive', type=str, help='The archive directory, created if missing.')
+    add.add_argument('infile', metavar='input-file', type=str,
+                     help='The log to import, a directory or a glob pattern (quoted) imports several files '
+                          'merged into the same partitions. See logfile2sqldb.py for the formats.')
+    add.add_argument('--format', choices=FORMATS, default='canz',
+                     help='Partition files: canz (compressed, default) or db (sqlite3, with checkpoints).')
+    add.add_argument('--source', type=str, default=None,
+                     help='Name of the partitions, default is the name of the (first) input file.')
+    add.add_argument("-j", "--jobs", type=int, default=None,
+                     help='Number of processes parsing files in parallel, default is the number of cores.')
+
+    show = commands.add_parser('list', help='List the partitions of a time range.')
+    show.add_argument('archive', type=str, help='The archive directory.')
+    show.add_argument('--start', type=_time, default=None, help='Epoch time or ISO date (UTC).')
+    show.add_argument('--end', type=_time, default=None, help='Epoch time or ISO date (UTC).')
+    show.add_argument('--ids', type=int, nargs='+', default=None, help='Only partitions with these CAN ids.')
+    show.add_argument('--bbox', type=float, nargs=4, default=None,
+                      metavar=('LAT_MIN', 'LON_MIN', 'LAT_MAX', 'LON_MAX'),
+                      help='Only partitions with a position in this box.')
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        infiles = logrows.input_files(args.infile)
+        if not infiles:
+            print('No input files found for {}'.format(args.infile), file=sys.stderr)
+            raise SystemExit(1)
+        start = time.perf_counter()
+        rows, paths = import_log(args.archive, infiles, args.source, args.format, args.jobs)
+        for path in paths:
+            print(path)
+        print('Imported {} frames into {} partitions in {:.1f}s'.format(rows, len(paths),
+                                                                      time.perf_counter() - start))
+    else:
+        if not is_archive(args.archive):
+            print('No archive {}'.format(args.archive), file=sys.stderr)
+            raise SystemExit(1)
+        catalog = open_catalog(args.archive)
+        partitions = find_partitions(catalog, args.start, args.end, args.ids, args.bbox)
+        for path, start, end in partitions:
+            count, lat_min, lat_max, lon_min, lon_max = catalog.execute(
+                "SELECT count, lat_min, lat_max, lon_min, lon_max FROM partitions WHERE path = ?", (path,)).fetchone()
+            print('{}  {} - {}  {} frames  lat {} .. {}  lon {} .. {}'.format(
+                path, datetime.fromtimestamp(start, timezone.utc).isoformat(),
+                datetime.fromtimestamp(end, timezone.utc).isoformat(), count, lat_min, lat_max, lon_min, lon_max))
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
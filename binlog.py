@@ -0,0 +1,57 @@
+# coding: utf-8
+
+"""
+Reader for the .BIN files of the onboard loggers.
+
+The file is a sequence of packed 21 bytes records::
+
+    typedef struct __attribute__((packed))
+    {
+        double timestamp;   // 8 bytes
+        uint32_t id;        // 4 bytes
+        uint8_t len;        // 1 byte
+        uint8_t data[8];    // 8 bytes
+    } LogPacket;
+
+which is exactly :data:`candump.FRAME_DTYPE`. The file is memory-mapped, the records are
+used in place without reading or converting the file.
+"""
+import os
+
+import numpy as np
+
+from candump import FRAME_DTYPE
+
+CAN_SFF_MASK = 0x000007FF
+
+BLOCK_SIZE = 1 << 20
+
+
+def read_bin(filename):
+    """
+    :return: all records of `filename` as a read only, memory-mapped :data:`candump.FRAME_DTYPE`
+             array; an incomplete record at the end of the file is ignored
+    """
+    n = os.path.getsize(filename) // FRAME_DTYPE.itemsize
+    if n == 0:
+        return np.zeros(0, FRAME_DTYPE)
+    return np.memmap(filename, dtype=FRAME_DTYPE, mode='r', shape=(n,))
+
+
+def read_blocks(filename, block_size=BLOCK_SIZE):
+    """
+    :return: the records of `filename` in slices of `block_size` records
+    :rtype: Generator[numpy.ndarray]
+    """
+    records = read_bin(filename)
+    for i in range(0, len(records), block_size):
+        yield records[i:i + block_size]
+
+
+def is_extended(records):
+    """
+    The logger does not record the frame format, ids above the 11 bit range are extended.
+
+    :return: bool array
+    """
+    return records['arbitration_id'] > CAN_SFF_MASK
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Compressed block file of CAN frames (``.canz``), a compact alternative to the sqlite3 db for
+archiving and replaying logs.
+
+The frames are packed into blocks of :data:`BLOCK_SECONDS` of log time. Within a block the
+frames are stored column by column (timestamp deltas in microseconds, ids, flags, dlcs,
+payloads), which compresses far better than rows, and every block is compressed with zlib or
+lzma of the standard library. The file ends with the block index (time range, offset and size
+of every block), so a seek reads the index and decompresses only the blocks of the time range::
+
+    header   b'CANZ', version, codec
+    blocks   compressed columns
+    index    BLOCK_DTYPE array
+    footer   offset of the index, number of blocks, b'CANZ'
+
+Only classic CAN frames are stored, payloads longer than 8 bytes are cut.
+
+Write one with ``python logfile2sqldb.py <can-logfile> <file>.canz``, read it with
+:class:`BlockReader` or :class:`player2.LogReader2`.
+"""
+
+import argparse
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from sqlite2 import assemble_message
+
+SUFFIX = '.canz'
+
+MAGIC = b'CANZ'
+VERSION = 1
+
+BLOCK_SECONDS = 1.0
+
+CODECS = {
+    'zlib': (0, lambda b: zlib.compress(b, 6), zlib.decompress),
+    'lzma': (1, lambda b: lzma.compress(b, preset=6), lzma.decompress),
+}
+
+BLOCK_DTYPE = np.dtype([('start', '<f8'), ('end', '<f8'), ('offset', '<u8'), ('size', '<u4'), ('count', '<u4')])
+
+_HEADER = struct.Struct('<4sBB2x')
+_FOOTER = struct.Struct('<QI4s')
+
+# bits of the flags column
+EXTENDED = 1
+REMOTE = 2
+ERROR = 4
+
+
+def _pack(rows):
+    """
+    :param rows: rows of the ``messages`` table (ts, arbitration_id, extended, remote, error, dlc, data)
+    :return: the columns of the block as bytes
+    """
+    ts, ids, extended, remote, error, dlcs, data = zip(*rows)
+    micros = np.round(np.array(ts, np.float64) * 1000000).astype(np.int64)
+    deltas = np.diff(micros, prepend=0)
+    flags = (np.array(extended, np.uint8) * EXTENDED | np.array(remote, np.uint8) * REMOTE |
+             np.array(error, np.uint8) * ERROR)
+    payloads = b''.join(bytes(d or b'')[:8].ljust(8, b'\0') for d in data)
+    return b''.join((deltas.tobytes(), np.array(ids, '<u4').tobytes(), flags.tobytes(),
+                     np.minimum(np.array(dlcs), 8).astype(np.uint8).tobytes(), payloads))
+
+
+def _unpack(buf, n):
+    """
+    :return: the columns of a block: timestamps in seconds, ids, flags, dlcs and payloads (n, 8)
+    """
+    micros = np.cumsum(np.frombuffer(buf, '<i8', n, 0))
+    ids = np.frombuffer(buf, '<u4', n, 8 * n)
+    flags = np.frombuffer(buf, np.uint8, n, 12 * n)
+    dlcs = np.frombuffer(buf, np.uint8, n, 13 * n)
+    data = np.frombuffer(buf, np.uint8, 8 * n, 14 * n).reshape(n, 8)
+    return micros / 1000000.0, ids, flags, dlcs, data
+
+
+class BlockWriter:
+
+    def __init__(self, filename, codec='zlib', block_seconds=BLOCK_SECONDS):
+        """
+        :param str filename: the file to write, it is replaced when :meth:`close` is called
+        :param codec: 'zlib' (fast) or 'lzma' (smaller, slower to write)
+        :param float block_seconds: seconds of log time per block
+        """
+        if codec not in CODECS:
+            raise ValueError('unknown codec {}, use one of {}'.format(codec, ', '.join(CODECS)))
+        self.filename = filename
+        self.codec = codec
+        self.block_seconds = block_seconds
+        self._code, self._compress, _ = CODECS[codec]
+        self._tmp = filename + '.tmp'
+        self._file = open(self._tmp, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, self._code))
+        self._index = []
+        self._rows = []
+        self._block_end = None
+        self.count = 0
+
+    def add(self, rows):
+        """
+        :param rows: rows of the ``messages`` table, in timestamp order
+        """
+        block = self._rows
+        block_end = self._block_end
+        for row in rows:
+            if block_end is None:
+                block_end = (row[0] // self.block_seconds + 1) * self.block_seconds
+            elif row[0] >= block_end:
+                self._flush()
+                block = self._rows
+                block_end = (row[0] // self.block_seconds + 1) * self.block_seconds
+            block.append(row)
+        self._block_end = block_end
+
+    def _flush(self):
+        rows = self._rows
+        if not rows:
+            return
+        blob = self._compress(_pack(rows))
+        ts = [row[0] for row in rows]
+        self._index.append((min(ts), max(ts), self._file.tell(), len(blob), len(rows)))
+        self._file.write(blob)
+        self.count += len(rows)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._index, BLOCK_DTYPE).tobytes())
+        self._file.write(_FOOTER.pack(index_offset, len(self._index), MAGIC))
+        self._file.close()
+        os.replace(self._tmp, self.filename)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp)
+
+
+def read_index(f):
+    """
+    :param f: the file opened in binary mode
+    :return: the codec name and the block index
+    """
+    magic, version, code = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a {} file of version {}'.format(SUFFIX, VERSION))
+    f.seek(-_FOOTER.size, os.SEEK_END)
+    index_offset, n, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+    if magic != MAGIC:
+        raise ValueError('incomplete {} file'.format(SUFFIX))
+    f.seek(index_offset)
+    index = np.frombuffer(f.read(n * BLOCK_DTYPE.itemsize), BLOCK_DTYPE)
+    codec = next(name for name, (c, _, _) in CODECS.items() if c == code)
+    return codec, index
+
+
+class BlockReader:
+    """
+    The frames of a ``.canz`` file as `can.Message`, optionally of a time range and of some CAN ids.
+    """
+
+    def __init__(self, filename, start_time=None, end_time=None, can_ids=None):
+        """
+        :param real start_time: time where to start reading (inclusive)
+        :param real end_time: time where to stop reading (exclusive), None reads to the end
+        :param can_ids: optional collection of arbitration ids to read, None reads all
+        """
+        self.filename = filename
+        self.start_time = start_time
+        self.end_time = end_time
+        self.can_ids = can_ids
+        self._file = open(filename, 'rb')
+        self.codec, self.index = read_index(self._file)
+        self._decompress = CODECS[self.codec][2]
+        # the blocks of unsorted logs may overlap, search on the latest time seen so far and stop
+        # at the earliest time of the blocks still to come
+        self._ends = np.maximum.accumulate(self.index['end']) if len(self.index) else self.index['end']
+        self._starts = np.minimum.accumulate(self.index['start'][::-1])[::-1]
+
+    def __len__(self):
+        return int(self.index['count'].sum())
+
+    def read_rows(self, start_time=None, end_time=None, can_ids=None):
+        """
+        Read the rows (ts, arbitration_id, extended, remote, error, dlc, data) in the time
+        window [`start_time`, `end_time`), a list per block.
+
+        :rtype: Generator[list[tuple]]
+        """
+        index = self.index
+        i = 0 if start_time is None else int(np.searchsorted(self._ends, start_time, 'left'))
+        wanted = np.array(sorted(can_ids), np.uint32) if can_ids else None
+        for j in range(i, len(index)):
+            if end_time is not None and self._starts[j] >= end_time:
+                break
+            block = index[j]
+            if (end_time is not None and block['start'] >= end_time or
+                    start_time is not None and block['end'] < start_time):
+                continue
+            self._file.seek(int(block['offset']))
+            buf = self._decompress(self._file.read(int(block['size'])))
+            ts, ids, flags, dlcs, data = _unpack(buf, int(block['count']))
+            keep = np.ones(len(ts), bool)
+            if start_time is not None:
+                keep &= ts >= start_time
+            if end_time is not None:
+                keep &= ts < end_time
+            if wanted is not None:
+                keep &= np.isin(ids, wanted)
+            if not keep.all():
+                ts, ids, flags, dlcs, data = ts[keep], ids[keep], flags[keep], dlcs[keep], data[keep]
+            if not len(ts):
+                continue
+            payload = data.tobytes()
+            dlcs = dlcs.tolist()
+            yield list(zip(ts.tolist(), ids.tolist(), (flags & EXTENDED).tolist(), (flags & REMOTE).tolist(),
+                           (flags & ERROR).tolist(), dlcs,
+                           [payload[j:j + n] for j, n in zip(range(0, len(payload), 8), dlcs)]))
+
+    def read_batches(self, start_time=None, end_time=None, can_ids=None):
+        """
+        Read the messages in the time window [`start_time`, `end_time`), a list per block.
+
+        :rtype: Generator[list[can.Message]]
+        """
+        for rows in self.read_rows(start_time, end_time, can_ids):
+            yield list(map(assemble_message, rows))
+
+    def read_range(self, start_time=None, end_time=None, can_ids=None):
+        """
+        See :meth:`read_batches`.
+
+        :rtype: Generator[can.Message]
+        """
+        for batch in self.read_batches(start_time, end_time, can_ids):
+            yield from batch
+
+    def __iter__(self):
+        return self.read_range(self.start_time, self.end_time, self.can_ids)
+
+    def stop(self):
+        self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "python blockstore.py",
+        description="Show the blocks of a {} file, write one with logfile2sqldb.py.".format(SUFFIX))
+    parser.add_argument('file', metavar='canz-file', type=str, help='The {} file.'.format(SUFFIX))
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        codec, index = read_index(f)
+    size = os.path.getsize(args.file)
+    if len(index):
+        print('{} frames in {} {} blocks, {:.1f} MB, {} - {}'.format(
+            index['count'].sum(), len(index), codec, size / 1e6, index['start'].min(), index['end'].max()))
+    else:
+        print('empty')
+
+
+if __name__ == "__main__":
+    main()
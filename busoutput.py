@@ -0,0 +1,317 @@
+# coding: utf-8
+
+"""
+Output stage of the CAN replay, one queue and one worker thread per destination bus.
+
+The replay thread only appends the messages to the queue of every output, the send calls
+(which may block, e.g. on a full socketcan tx queue) run in the worker of the output. So a slow
+or missing bus neither delays the replay nor the other buses. When a queue is full messages are
+dropped and counted instead of waiting, unless the output has the policy ``"block"``. A replay at
+rate "max" has no timing which a bus could keep up with, it waits for room in the queues of all
+outputs (at most ``block_timeout`` seconds per batch), so it is paced by the slowest bus.
+
+The outputs are configured in the config file as list ``canbus.outputs``::
+
+    "canbus": {
+       "outputs": [
+          {"name": "can0", "interface": "socketcan", "channel": "can0"},
+          {"name": "udp", "interface": "udp_multicast", "channel": "239.0.0.1", "maxsize": 100}
+       ]
+    }
+
+``name`` (default the channel), ``maxsize``, ``policy``, ``timeout``, ``block_timeout``,
+``max_rate`` and ``max_rates`` are options of the :class:`BusOutput`, all other keys are passed to `can.Bus`.
+
+An output for a consumer which needs only a thinned stream, e.g. the map on the internal bus,
+is decimated with ``"max_rate": 4`` (frames per second and CAN id) or per id with
+``"max_rates": {"1036": 4, "1037": 4}`` (0 is no limit). A frame arriving earlier is held back
+and replaced by newer frames of its id, the latest one is sent when the interval has passed.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from can import Bus, CanError
+
+# what an output does with new messages when its queue is full
+DROP = 'drop'  # the new messages are dropped
+DROP_OLDEST = 'drop_oldest'  # the oldest queued messages are dropped
+BLOCK = 'block'  # the replay waits for room, the new messages are dropped after block_timeout
+
+POLICIES = (DROP, DROP_OLDEST, BLOCK)
+
+OUTPUT_OPTIONS = ('name', 'maxsize', 'policy', 'timeout', 'block_timeout', 'max_rate', 'max_rates')
+
+# messages the worker takes from the queue at once, a clear() discards all but the one being sent
+CHUNK_SIZE = 64
+
+
+def rate_interval(rate):
+    """
+    :param rate: frames per second, None or 0 for no limit
+    :return: the minimal interval between two frames in seconds, 0.0 for no limit
+    :raises ValueError: if `rate` is negative or no number
+    """
+    if rate is None:
+        return 0.0
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError):
+        raise ValueError('max_rate must be a number, not {!r}'.format(rate))
+    if not rate >= 0.0:
+        raise ValueError('max_rate must not be negative, not {}'.format(rate))
+    return 1.0 / rate if rate else 0.0
+
+
+class BusOutput(threading.Thread):
+
+    def __init__(self, bus, name, maxsize=1000, policy=DROP, timeout=0.1, max_rate=None, max_rates=None,
+                 block_timeout=1.0, *args, **kwargs):
+        """
+        :param bus: an open `can.BusABC`, shut down by :meth:`close`
+        :param str name: name of the output in log messages and statistics
+        :param int maxsize: number of messages queued at most
+        :param policy: :data:`DROP`, :data:`DROP_OLDEST` or :data:`BLOCK`
+        :param float timeout: timeout of a send call in seconds
+        :param float block_timeout: seconds :meth:`offer` waits for room at most, see :data:`BLOCK`
+        :param float max_rate: frames per second sent at most of every CAN id, None or 0 for all frames
+        :param dict max_rates: CAN id -> frames per second, overrides `max_rate` for these ids,
+                               0 sends all frames of the id
+        :raises ValueError: if an option is invalid, e.g. a negative rate
+        """
+        super().__init__(*args, name='BusOutput-{}'.format(name), **kwargs)
+        if policy not in POLICIES:
+            raise ValueError('unknown policy {}'.format(policy))
+        self.daemon = True
+        self.bus = bus
+        self.output_name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.timeout = timeout
+        self.block_timeout = block_timeout
+        # CAN id -> minimal interval between two frames in seconds, 0.0 for no limit
+        try:
+            self._intervals = {int(can_id): rate_interval(rate) for can_id, rate in (max_rates or {}).items()}
+        except (TypeError, ValueError) as e:
+            raise ValueError('invalid max_rates {!r}: {}'.format(max_rates, e))
+        self._interval = rate_interval(max_rate)
+        self.decimated = bool(self._intervals or self._interval)
+        # CAN id -> time (monotonic) the next frame may be sent, frames held back until then
+        self._next_send = {}
+        self._held = {}
+        # statistics
+        self.sent = 0
+        self.dropped = 0
+        self.thinned = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        # incremented by clear(), the worker does not send the rest of a chunk taken before
+        self._generation = 0
+
+    def offer(self, messages, block=False):
+        """
+        Queue `messages` for sending, called by the replay thread. Only blocks with the policy
+        :data:`BLOCK` or `block`: until the queue has room, at most :attr:`block_timeout` seconds.
+
+        :param bool block: wait for room whatever the policy, e.g. for a replay at rate "max"
+        """
+        with self._cond:
+            if self.decimated:
+                messages = self._decimate(messages, time.monotonic())
+            queue = self._queue
+            if block or self.policy == BLOCK:
+                self._put(messages)
+            elif self.policy == DROP:
+                room = max(self.maxsize - len(queue), 0)
+                if len(messages) > room:
+                    self.dropped += len(messages) - room
+                    messages = messages[:room]
+                queue.extend(messages)
+            else:
+                queue.extend(messages)
+                for _ in range(len(queue) - self.maxsize):
+                    queue.popleft()
+                    self.dropped += 1
+            if len(queue) > self.max_depth:
+                self.max_depth = len(queue)
+            self._cond.notify_all()
+
+    def _put(self, messages):
+        """
+        Queue `messages` as the worker makes room, drop the rest after :attr:`block_timeout`.
+        Called with the lock held.
+        """
+        queue = self._queue
+        deadline = None
+        while messages:
+            room = self.maxsize - len(queue)
+            if room > 0:
+                queue.extend(messages[:room])
+                messages = messages[room:]
+                if len(queue) > self.max_depth:
+                    self.max_depth = len(queue)
+                self._cond.notify_all()
+                continue
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.block_timeout
+            if self._closed or now >= deadline:
+                break
+            self._cond.wait(deadline - now)
+        self.dropped += len(messages)
+
+    def _decimate(self, messages, now):
+        """
+        :return: the messages which may be sent now, the others are held back (latest wins)
+        """
+        intervals = self._intervals
+        default = self._interval
+        next_send = self._next_send
+        held = self._held
+        result = []
+        for message in messages:
+            can_id = message.arbitration_id
+            interval = intervals.get(can_id, default)
+            if not interval:
+                result.append(message)
+            elif now >= next_send.get(can_id, 0.0):
+                next_send[can_id] = now + interval
+                if held.pop(can_id, None) is not None:
+                    self.thinned += 1
+                result.append(message)
+            else:
+                if held.get(can_id) is not None:
+                    self.thinned += 1
+                held[can_id] = message
+        return result
+
+    def _release(self, now):
+        """
+        Queue the held messages whose interval has passed.
+
+        :return: seconds until the next held message is due, None if none is held
+        """
+        wait = None
+        next_send = self._next_send
+        for can_id in list(self._held):
+            due = next_send[can_id]
+            if now >= due:
+                self._queue.append(self._held.pop(can_id))
+                next_send[can_id] = now + self._intervals.get(can_id, self._interval)
+            elif wait is None or due - now < wait:
+                wait = due - now
+        return wait
+
+    def _take(self):
+        """
+        :return: up to :data:`CHUNK_SIZE` messages and the generation they belong to, no
+                 messages when closed
+        """
+        with self._cond:
+            while True:
+                wait = self._release(time.monotonic()) if self._held else None
+                if self._queue or self._closed:
+                    break
+                self._cond.wait(wait)
+            queue = self._queue
+            batch = [queue.popleft() for _ in range(min(len(queue), CHUNK_SIZE))]
+            # room for an offer waiting with the policy BLOCK
+            self._cond.notify_all()
+            return batch, self._generation
+
+    def run(self):
+        failing = False
+        while True:
+            batch, generation = self._take()
+            if not batch:
+                break
+            for message in batch:
+                if generation != self._generation:
+                    # cleared while sending, the rest of the chunk is from the old position
+                    break
+                try:
+                    self.bus.send(message, timeout=self.timeout)
+                    self.sent += 1
+                    failing = False
+                except Exception as e:
+                    self.errors += 1
+                    # only the first error of a series, a disconnected bus fails every message
+                    if not failing:
+                        if isinstance(e, CanError):
+                            logging.warning('CAN output %s: send failed: %s', self.output_name, e)
+                        else:
+                            logging.exception('CAN output %s: send failed', self.output_name)
+                        failing = True
+
+    def clear(self):
+        """
+        Discard the queued messages, e.g. after a seek. A message being sent now still goes out.
+        """
+        with self._cond:
+            self._generation += 1
+            self._queue.clear()
+            self._held.clear()
+            self._next_send.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        :return: dict with the number of messages sent, dropped (queue full), thinned out
+                 (decimation) and failed (send error or timeout), and the queue depth now and at most
+        """
+        return {'name': self.output_name, 'sent': self.sent, 'dropped': self.dropped, 'thinned': self.thinned,
+                'errors': self.errors, 'depth': len(self._queue), 'max_depth': self.max_depth}
+
+    def close(self, timeout=1.0):
+        """
+        Send the queued messages (for at most `timeout` seconds), stop the worker and shut down the bus.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+        try:
+            self.bus.shutdown()
+        except Exception as e:
+            logging.warning('Error during CAN bus %s shutdown: %s', self.output_name, e)
+
+
+def open_output(config):
+    """
+    Open the bus of an output described by `config`, see the module doc.
+
+    :param dict config: e.g. ``{"interface": "socketcan", "channel": "can0"}``
+    :return: a started :class:`BusOutput`, None if the bus is not available
+    """
+    bus_config = {k: v for k, v in config.items() if k not in OUTPUT_OPTIONS}
+    options = {k: v for k, v in config.items() if k in OUTPUT_OPTIONS}
+    options.setdefault('name', str(bus_config.get('channel')))
+    try:
+        bus = Bus(**bus_config)
+    except Exception as e:
+        logging.warning('CAN output %s not connected: %s', options['name'], e)
+        return None
+    try:
+        output = BusOutput(bus, **options)
+    except (TypeError, ValueError) as e:
+        logging.error('CAN output %s not connected, invalid options: %s', options['name'], e)
+        bus.shutdown()
+        return None
+    output.start()
+    return output
+
+
+def log_stats(outputs):
+    """
+    Log the statistics of `outputs`, as warning if an output dropped or failed to send messages.
+    """
+    for output in outputs:
+        stats = output.stats()
+        level = logging.WARNING if stats['dropped'] or stats['errors'] else logging.INFO
+        logging.log(level, 'CAN output %(name)s: sent %(sent)d, dropped %(dropped)d, thinned %(thinned)d, '
+                           'errors %(errors)d, queue %(depth)d (max %(max_depth)d)', stats)
@@ -0,0 +1,136 @@
+# coding: utf-8
+
+"""
+The CANaerospace ids of the recorded signals and how to decode them.
+
+A CANaerospace frame carries node id, data type, service code and message code in bytes 0-3
+and the value big-endian in bytes 4-7.
+"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+Signal = namedtuple('Signal', 'name type scale')
+
+# data type -> (struct format, numpy dtype) of the value in bytes 4-7
+TYPES = {
+    'FLOAT': ('>f', '>f4'),
+    'LONG': ('>l', '>i4'),
+    'USHORT': ('>H', '>u2'),
+    'UCHAR': ('B', 'u1'),
+}
+
+SIGNALS = {
+    315: Signal('ias', 'FLOAT', None),
+    316: Signal('tas', 'FLOAT', None),
+    317: Signal('cas', 'FLOAT', None),
+    321: Signal('th', 'FLOAT', None),
+    322: Signal('alt', 'FLOAT', None),
+    334: Signal('wind_direction', 'FLOAT', None),
+    # the flap position sensor value in byte 4, 0-255 as in Dashboard/flapDescriptor.json
+    340: Signal('flap', 'UCHAR', None),
+    354: Signal('vario', 'FLOAT', None),
+    1036: Signal('lat', 'LONG', 1E-7),
+    1037: Signal('lon', 'LONG', 1E-7),
+    1039: Signal('gs', 'FLOAT', None),
+    1040: Signal('tt', 'FLOAT', None),
+    1316: Signal('pilot_mass', 'USHORT', None),
+    1506: Signal('enl', 'USHORT', None),
+}
+
+INSERT_SIGNAL = "INSERT INTO signals VALUES (?, ?, ?)"
+
+SIGNAL_IDS = {signal.name: can_id for can_id, signal in SIGNALS.items()}
+
+_STRUCTS = {name: struct.Struct(fmt) for name, (fmt, _) in TYPES.items()}
+
+
+def signal_id(name_or_id):
+    """
+    :return: the CAN id of a signal given by name or id
+    """
+    if isinstance(name_or_id, str):
+        return SIGNAL_IDS[name_or_id]
+    return name_or_id
+
+
+def decode(can_id, data):
+    """
+    :param data: the payload, bytes like
+    :return: the physical value of a frame of a known signal, None for other ids or short payloads
+    """
+    signal = SIGNALS.get(can_id)
+    if signal is None:
+        return None
+    s = _STRUCTS[signal.type]
+    if len(data) < 4 + s.size:
+        return None
+    value = s.unpack_from(data, 4)[0]
+    return value * signal.scale if signal.scale is not None else value
+
+
+def decode_values(can_id, data):
+    """
+    Decode all payloads of one signal at once.
+
+    :param data: uint8 array (n, 8) of payloads
+    :return: the physical values as array
+    """
+    signal = SIGNALS[can_id]
+    dtype = np.dtype(TYPES[signal.type][1])
+    values = np.ascontiguousarray(data[:, 4:4 + dtype.itemsize]).view(dtype).ravel()
+    if signal.scale is not None:
+        return values * signal.scale
+    return values.astype(dtype.newbyteorder('='))
+
+
+def signal_rows(rows):
+    """
+    :param rows: rows of the ``messages`` table
+    :return: the ``signals`` rows (ts, id, value) of the frames of known signals
+    """
+    for ts, can_id, _, _, error, _, data in rows:
+        if can_id in SIGNALS and not error:
+            value = decode(can_id, data)
+            if value is not None:
+                yield ts, can_id, value
+
+
+def create_signals_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS signals
+        (
+          ts REAL,
+          id INTEGER,
+          value REAL
+        )""")
+    conn.commit()
+
+
+def create_signals_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS signals_id_ts_idx ON signals (id, ts)")
+    conn.commit()
+
+
+def read_signal(conn, name_or_id, start_time=None, end_time=None):
+    """
+    Read the decoded values of a signal in [`start_time`, `end_time`) from the ``signals`` table.
+
+    :param conn: sqlite3 connection of a db imported with ``logfile2sqldb.py --signals``
+    :param name_or_id: signal name, e.g. 'ias', or CAN id
+    :return: timestamps and values as arrays
+    """
+    query = "SELECT ts, value FROM signals WHERE id = ?"
+    params = [signal_id(name_or_id)]
+    if start_time is not None:
+        query += " AND ts >= ?"
+        params.append(start_time)
+    if end_time is not None:
+        query += " AND ts < ?"
+        params.append(end_time)
+    rows = conn.execute(query + " ORDER BY ts", params).fetchall()
+    if not rows:
+        return np.zeros(0), np.zeros(0)
+    ts, values = np.array(rows, np.float64).T
+    return ts, values
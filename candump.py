@@ -0,0 +1,318 @@
+# coding: utf-8
+
+"""
+Fast parser for candump log files, lines like::
+
+    (1569048709.655053) can0 76C#0A0F0000696E6974
+
+The file is read in large chunks and every chunk is decoded at once with NumPy: the positions
+of the separators are located for all lines together, lines with the same layout are gathered
+into one matrix and its columns converted with vector arithmetic. No Python code runs per line.
+
+The decoded frames are returned as arrays of :data:`FRAME_DTYPE`, which is the same packed
+21 bytes record as the one of the binary logger files.
+
+Lines which are not plain data frames (remote or CAN FD frames, comments, garbage) are not
+decoded, they are reported in :attr:`Block.bad` so that the caller can handle them.
+"""
+import re
+from collections import namedtuple
+
+import numpy as np
+
+FRAME_DTYPE = np.dtype([('timestamp', '<f8'), ('arbitration_id', '<u4'), ('dlc', 'u1'), ('data', 'u1', (8,))])
+
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1FFFFFFF
+
+CHUNK_SIZE = 1 << 24
+
+LINE_RE = re.compile(r'^\((\d+\.\d+)\)\s+(\w+)\s+([0-9A-Fa-f]{1,8})#([0-9A-Fa-f]*)\s*$')
+
+_INVALID = 0xFF
+_PAD = 16
+
+
+class Block(namedtuple('Block', 'frames extended channels lines bad starts stops buf line0')):
+    """
+    The decoded lines of one chunk of a candump file.
+
+    :attr frames: :data:`FRAME_DTYPE` array of the data frames
+    :attr extended: bool array, True for frames written with an 8 digit (extended) id
+    :attr channels: bytes array with the channel name of the frames
+    :attr lines: index of the line of every frame within the block
+    :attr bad: index of the non empty lines which are not a data frame
+    :attr starts: offset in `buf` of every line of the block
+    :attr stops: offset in `buf` of the end of every line, without newline and trailing blanks
+    :attr buf: the chunk, ending with a newline
+    :attr line0: number of the first line of the block within the file, counted from 0
+    """
+    __slots__ = ()
+
+    def line(self, i):
+        """
+        :return: line `i` of the block as bytes, without newline
+        """
+        return self.buf[self.starts[i]:self.stops[i]]
+
+    def select(self, lines):
+        """
+        :param lines: bool mask or index of lines of the block
+        :return: the selected lines as bytes, every line terminated by a newline
+        """
+        a = np.frombuffer(self.buf, np.uint8)
+        keep = np.zeros(len(self.starts), bool)
+        keep[lines] = True
+        ends = np.empty_like(self.starts)
+        ends[:-1] = self.starts[1:]
+        ends[-1] = len(a)
+        return a[np.repeat(keep, ends - self.starts)].tobytes()
+
+
+def parse_line(line):
+    """
+    Parse a single candump line, for tools which work line by line.
+
+    :return: tuple of the strings (timestamp, channel, can id, data) or None if the line
+             is not a data frame
+    """
+    match = LINE_RE.match(line)
+    if not match or len(match.group(4)) % 2:
+        return None
+    return match.groups()
+
+
+def _first_after(positions, begin, limit):
+    """
+    :return: for every `begin` the first of the sorted `positions` >= `begin`, or `limit`
+    """
+    i = np.searchsorted(positions, begin)
+    found = np.append(positions, limit)[i]
+    return np.minimum(found, limit)
+
+
+def _skip(a, pos, stop, chars):
+    """
+    :return: `pos` moved forward over all `chars`, not beyond `stop`
+    """
+    is_char = np.zeros(256, bool)
+    is_char[np.frombuffer(chars, np.uint8)] = True
+    while True:
+        move = (pos < stop) & is_char[a[pos]]
+        if not move.any():
+            return pos
+        pos = pos + move
+
+
+def _number(digits, base):
+    """
+    :return: the value of every row of `digits`, most significant digit first
+    """
+    # float64 holds up to 15 decimal digits exactly and the product runs on BLAS
+    weights = float(base) ** np.arange(digits.shape[1] - 1, -1, -1)
+    return digits @ weights
+
+
+def _digits(m):
+    """
+    :return: the value of every hex or decimal digit character of `m`, 0xFF for other characters
+    """
+    dec = m - np.uint8(ord('0'))
+    alpha = (m | np.uint8(0x20)) - np.uint8(ord('a') - 10)
+    values = np.minimum(dec, alpha)
+    invalid = (dec >= 10) & (alpha - np.uint8(10) >= 6)
+    values |= invalid.view(np.uint8) * np.uint8(_INVALID)
+    return values
+
+
+def _decode(m, layout):
+    """
+    Decode lines which all have the same `layout`.
+
+    :param m: matrix with one line per row
+    :param layout: the offsets (dot, close, chan, chan_end, ident, sharp, stop) within the lines
+    :return: the frames, the channels and a bool array, False for rows with invalid digits
+    """
+    o_dot, o_close, o_chan, o_chan_end, o_ident, o_sharp, o_stop = layout
+    values = _digits(m)
+    limits = np.full(m.shape[1], _INVALID, np.uint8)
+    limits[1:o_dot] = limits[o_dot + 1:o_close] = 9
+    limits[o_ident:o_sharp] = limits[o_sharp + 1:o_stop] = 15
+    ok = ~(values > limits).any(1)
+    sec = values[:, 1:o_dot]
+    frac = values[:, o_dot + 1:o_close]
+    ids = values[:, o_ident:o_sharp]
+    data = values[:, o_sharp + 1:o_stop]
+    dlc = data.shape[1] // 2
+    frames = np.zeros(len(m), FRAME_DTYPE)
+    frames['timestamp'] = _number(sec, 10) + _number(frac, 10) / 10.0 ** frac.shape[1]
+    frames['arbitration_id'] = _number(ids, 16)
+    frames['dlc'] = dlc
+    frames['data'][:, :dlc] = (data[:, 0::2] << 4) | data[:, 1::2]
+    channels = np.ascontiguousarray(m[:, o_chan:o_chan_end]).view('S{}'.format(o_chan_end - o_chan)).ravel()
+    return frames, channels, ok
+
+
+def _uniform_layout(buf, a):
+    """
+    Most logs have lines of one single layout, e.g. all standard ids with 8 data bytes.
+
+    :return: the layout and the matrix of the lines, if all lines of `buf` have the same layout
+             as the first one, else None
+    """
+    length = buf.find(b'\n') + 1
+    n = len(buf) // length
+    if length < 2 or n * length != len(buf):
+        return None
+    m = a[:len(buf)].reshape(n, length)
+    if not (m[:, -1] == ord('\n')).all():
+        return None
+    first = _locate(a[:length + _PAD], np.zeros(1, np.int32), np.full(1, length - 1, np.int32))
+    if first is None:
+        return None
+    layout = first[:, 0]
+    o_dot, o_close, o_chan, o_chan_end, o_ident, o_sharp, o_stop = layout
+    if o_stop != length - 1:
+        return None
+    blank = m[:, o_chan_end:o_ident]
+    if not ((m[:, 0] == ord('(')).all() and (m[:, o_dot] == ord('.')).all() and
+            (m[:, o_close] == ord(')')).all() and (m[:, o_sharp] == ord('#')).all() and
+            (m[:, o_close + 1:o_chan] == ord(' ')).all() and (blank == ord(' ')).all() and
+            (m[:, o_chan:o_chan_end] > ord(' ')).all()):
+        return None
+    return layout, m
+
+
+def _locate(a, begin, stop):
+    """
+    Find the separators of the lines [`begin`, `stop`).
+
+    :return: the offsets (dot, close, chan, chan_end, ident, sharp, stop) relative to `begin`,
+             one column per line, or None if no line has the structure of a data frame
+    """
+    close = _first_after(np.flatnonzero(a == ord(')')), begin, stop)
+    dot = _first_after(np.flatnonzero(a == ord('.')), begin, close)
+    chan = _skip(a, close + 1, stop, b' \t')
+    chan_end = _first_after(np.flatnonzero((a == ord(' ')) | (a == ord('\t'))), chan, stop)
+    ident = _skip(a, chan_end, stop, b' \t')
+    sharp = _first_after(np.flatnonzero(a == ord('#')), ident, stop)
+    ok = (a[begin] == ord('(')) & (close < stop) & (dot > begin + 1) & (dot < close - 1)
+    ok &= (chan_end > chan) & (ident > chan_end) & (chan_end - chan <= 16)
+    ok &= (sharp > ident) & (sharp - ident <= 8) & (sharp < stop) & (stop - sharp <= 17) & ((stop - sharp) % 2 == 1)
+    ok &= (dot - begin <= 13) & (close - dot <= 10)
+    if not ok.any():
+        return None
+    offsets = np.stack([dot, close, chan, chan_end, ident, sharp, stop]) - begin
+    offsets[:, ~ok] = -1
+    return offsets
+
+
+def parse(buf, line0=0):
+    """
+    Decode all lines of `buf`.
+
+    :param bytes buf: complete lines of a candump file, ending with a newline
+    :param int line0: number of the first line in `buf` within the file
+    :rtype: Block
+    """
+    a = np.frombuffer(buf + bytes(_PAD), np.uint8)
+
+    uniform = _uniform_layout(buf, a)
+    if uniform:
+        layout, m = uniform
+        starts = np.arange(0, len(buf), m.shape[1], dtype=np.int32)
+        stops = starts + layout[-1]
+        frames, channels, ok = _decode(m, layout)
+        lines = np.flatnonzero(ok)
+        bad = np.flatnonzero(~ok)
+        if ok.all():
+            return Block(frames=frames,
+                         extended=np.full(len(frames), layout[5] - layout[4] > 3),
+                         channels=channels,
+                         lines=lines,
+                         bad=bad,
+                         starts=starts,
+                         stops=stops,
+                         buf=buf,
+                         line0=line0)
+
+    newlines = np.flatnonzero(a == ord('\n')).astype(np.int32)
+    starts = np.empty_like(newlines)
+    starts[:1] = 0
+    starts[1:] = newlines[:-1] + 1
+    stops = newlines.copy()
+    # strip trailing blanks and '\r'
+    blank = np.zeros(256, bool)
+    blank[np.frombuffer(b' \t\r', np.uint8)] = True
+    while True:
+        strip = (stops > starts) & blank[a[stops - 1]]
+        if not strip.any():
+            break
+        stops = stops - strip
+
+    # lines with the same layout are decoded together by slicing columns
+    frames = np.zeros(len(starts), FRAME_DTYPE)
+    channels = np.zeros(len(starts), 'S16')
+    extended = np.zeros(len(starts), bool)
+    ok = np.zeros(len(starts), bool)
+    cand = np.flatnonzero(stops > starts)
+    offsets = _locate(a, starts[cand], stops[cand])
+    if offsets is not None:
+        keys = np.zeros(len(cand), np.int64)
+        for off in offsets:
+            keys = (keys << 8) | (off & 0xFF)
+        keys[offsets[0] < 0] = -1
+        layouts, groups = np.unique(keys, return_inverse=True)
+        for g, key in enumerate(layouts):
+            if key < 0:
+                continue
+            rows = np.flatnonzero(groups == g)
+            layout = offsets[:, rows[0]]
+            lines = cand[rows]
+            m = a[starts[lines][:, None] + np.arange(layout[-1], dtype=np.int32)]
+            frames[lines], channels[lines], ok[lines] = _decode(m, layout)
+            extended[lines] = layout[5] - layout[4] > 3
+
+    bad = np.flatnonzero(~ok & (stops > starts))
+    return Block(frames=frames[ok],
+                 extended=extended[ok],
+                 channels=channels[ok],
+                 lines=np.flatnonzero(ok),
+                 bad=bad,
+                 starts=starts,
+                 stops=stops,
+                 buf=buf,
+                 line0=line0)
+
+
+def read_blocks(filename, chunk_size=CHUNK_SIZE):
+    """
+    Read and decode a candump file in chunks of about `chunk_size` bytes.
+
+    :rtype: Generator[Block]
+    """
+    line0 = 0
+    rest = b''
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if rest:
+                chunk = rest + chunk
+            cut = chunk.rfind(b'\n') + 1
+            rest = chunk[cut:]
+            if cut:
+                block = parse(chunk[:cut], line0)
+                line0 += len(block.starts)
+                yield block
+    if rest:
+        yield parse(rest + b'\n', line0)
+
+
+def read_frames(filename, chunk_size=CHUNK_SIZE):
+    """
+    :return: all data frames of a candump file as one :data:`FRAME_DTYPE` array
+    """
+    frames = [block.frames for block in read_blocks(filename, chunk_size)]
+    return np.concatenate(frames) if frames else np.zeros(0, FRAME_DTYPE)
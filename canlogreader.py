@@ -1,9 +1,11 @@
+import logging
 import threading
+from collections import deque
 from datetime import datetime
 from time import sleep
 
-from can import MessageSync
 from player2 import LogReader2
+from replay import ReplayScheduler
 
 
 class CallbackList(list):
@@ -12,49 +14,182 @@ class CallbackList(list):
             listener(*args, **kwargs)
 
 
+# what a subscription does with new messages when its queue is full
+BLOCK = 'block'  # the reader waits, the replay timing suffers
+DROP = 'drop'  # the new messages are dropped and counted
+LATEST = 'latest'  # only the latest message of every CAN id is kept, one per id, maxsize does not apply
+
+
+class Subscription(threading.Thread):
+    """
+    Delivers the messages of some CAN ids to a listener in its own thread, so a slow listener
+    does not delay the replay. The listener is called with a list of messages, all messages
+    queued since its last call.
+    """
+
+    def __init__(self, listener, can_ids=None, policy=LATEST, maxsize=1000, *args, **kwargs):
+        """
+        :param listener: callable, gets a list of `can.Message`
+        :param can_ids: collection of arbitration ids, None for all
+        :param policy: :data:`BLOCK`, :data:`DROP` or :data:`LATEST`
+        :param int maxsize: size of the queue for the policies :data:`BLOCK` and :data:`DROP`;
+                            ignored by :data:`LATEST`, it holds one message per CAN id, so at
+                            most as many as there are ids in `can_ids` (or on the bus)
+        """
+        super().__init__(*args, **kwargs)
+        if policy not in (BLOCK, DROP, LATEST):
+            raise ValueError('unknown policy {}'.format(policy))
+        self.daemon = True
+        self.listener = listener
+        self.can_ids = frozenset(can_ids) if can_ids is not None else None
+        self.policy = policy
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = deque()
+        self._latest = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def offer(self, messages):
+        """
+        Queue `messages`, called by the reader thread.
+        """
+        with self._cond:
+            if self.policy == LATEST:
+                latest = self._latest
+                for message in messages:
+                    latest.pop(message.arbitration_id, None)
+                    latest[message.arbitration_id] = message
+            elif self.policy == DROP:
+                room = self.maxsize - len(self._queue)
+                if len(messages) > room:
+                    self.dropped += len(messages) - max(room, 0)
+                    messages = messages[:max(room, 0)]
+                self._queue.extend(messages)
+            else:
+                for message in messages:
+                    while len(self._queue) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    self._queue.append(message)
+                    self._cond.notify_all()
+            self._cond.notify_all()
+
+    def _take(self):
+        with self._cond:
+            while not (self._queue or self._latest or self._closed):
+                self._cond.wait()
+            if self._latest:
+                batch = list(self._latest.values())
+                self._latest.clear()
+            else:
+                batch = list(self._queue)
+                self._queue.clear()
+            self._cond.notify_all()
+            return batch
+
+    def run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                break
+            try:
+                self.listener(batch)
+            except Exception:
+                logging.exception('Error in CAN listener %s', self.listener)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
 class CanlogReader(threading.Thread):
     def __init__(self, infile, start_time, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._stop = threading.Event()
+        self._stop_event = threading.Event()
         self.infile = infile
         self.start_time = start_time
         self.reader = None
         self.running = False
         self.callback_list = CallbackList()
+        self.subscriptions = []
+        # arbitration id -> subscriptions of that id
+        self._by_id = {}
+        self._all_ids = []
 
-    # function using _stop function
+    # function using _stop_event function
     def stop(self):
         self.running = False
         if self.reader:
             self.callback_list.clear()
             self.reader.stop()
-        self._stop.set()
+        for subscription in self.subscriptions:
+            subscription.close()
+        self._stop_event.set()
 
     def stopped(self):
-        return self._stop.isSet()
+        return self._stop_event.is_set()
 
     def run(self):
         if not self.reader:
             self.reader = LogReader2(self.infile, self.start_time)
-        in_sync = MessageSync(self.reader, timestamps=True)
+        scheduler = ReplayScheduler(self.reader, running=lambda: self.running)
         sleep(0.5)
         print('Can LogReader (Started on {})'.format(datetime.now()))
         self.running = True
         try:
-            for message in in_sync:
-                if not self.running:
-                    break
-                if message.is_error_frame:
-                    continue
-                self.callback_list.fire(message)
+            for batch in scheduler:
+                batch = [message for message in batch if not message.is_error_frame]
+                for message in batch:
+                    self.callback_list.fire(message)
+                if self.subscriptions:
+                    self.dispatch(batch)
         except KeyboardInterrupt:
             pass
         finally:
             self.reader.stop()
 
     def addCallback(self, calback):
+        """
+        The callback is called for every message in the reader thread, see :meth:`subscribe`
+        for listeners which must not delay the replay.
+        """
         self.callback_list.append(calback)
 
+    def subscribe(self, listener, can_ids=None, policy=LATEST, maxsize=1000):
+        """
+        Deliver the messages of `can_ids` in batches to `listener`, in a thread of its own.
+        See :class:`Subscription` for the parameters.
+
+        :rtype: Subscription
+        """
+        subscription = Subscription(listener, can_ids, policy, maxsize, name='CanlogReader-subscription')
+        if subscription.can_ids is None:
+            self._all_ids = self._all_ids + [subscription]
+        else:
+            by_id = dict(self._by_id)
+            for can_id in subscription.can_ids:
+                by_id[can_id] = by_id.get(can_id, ()) + (subscription,)
+            self._by_id = by_id
+        self.subscriptions.append(subscription)
+        subscription.start()
+        return subscription
+
+    def dispatch(self, batch):
+        """
+        Hand the messages of `batch` to the subscriptions of their CAN ids.
+        """
+        by_id = self._by_id
+        if by_id:
+            selected = {}
+            for message in batch:
+                for subscription in by_id.get(message.arbitration_id, ()):
+                    selected.setdefault(subscription, []).append(message)
+            for subscription, messages in selected.items():
+                subscription.offer(messages)
+        for subscription in self._all_ids:
+            subscription.offer(batch)
+
 
 if __name__ == '__main__':
     def print_msg(msg):
@@ -66,4 +201,5 @@ if __name__ == '__main__':
     reader = CanlogReader('data/candump-2019-09-21_110938-gps.db', 1569062280.0)
     reader.addCallback(print_msg)
     reader.addCallback(print_msg_ts)
+    reader.subscribe(lambda messages: print('position', messages), can_ids=[1036, 1037])
     reader.start()
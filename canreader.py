@@ -3,35 +3,83 @@ import struct
 import threading
 import logging
 import can
-from can import MessageSync
 
+import canaerospace
+import columns
 from player2 import LogReader2
+from replay import ReplayScheduler
+from signalcache import SignalCache
 
+CAN_SFF_MASK = 0x000007FF
 
-def getDoubleL(data):
-    return struct.unpack('>l', data[4:8])[0] / 1E7
+_UTC = struct.Struct('4b')
 
 
-def getFloat(data):
-    return struct.unpack('>f', data[4:8])[0]
+def toDeg(val):
+    return val + 360.0 if val < 0.0 else val
+
+
+def getUtcDate(data):
+    return bytes(data)
+
+
+def signal_decoder(name, convert=None):
+    """
+    A `DECODERS` entry of a signal of :data:`canaerospace.SIGNALS`, decoded as declared there.
+
+    :param convert: optional function applied to the decoded value, e.g. :func:`toDeg`
+    :return: (CAN id, (name, decoder of the payload))
+    """
+    can_id = canaerospace.SIGNAL_IDS[name]
+
+    def decode_data(data):
+        value = canaerospace.decode(can_id, data)
+        return convert(value) if convert is not None and value is not None else value
+
+    return can_id, (name, decode_data)
+
+
+def decode(signals, decoders, message):
+    """
+    Store the value of `message` in the signal its CAN id is registered for in `decoders`.
+
+    :param SignalCache signals: the signals
+    """
+    decoder = decoders.get(message.arbitration_id)
+    if decoder is not None:
+        name, decode_data = decoder
+        value = decode_data(message.data)
+        if value is not None:
+            signals.set(name, value, message.timestamp)
 
 
-def getInt(data: int):
-    return struct.unpack('>i', data[4:8])[0]
+def acceptance_filters(can_ids):
+    """
+    :return: `can.BusABC.set_filters` filters for standard ids, frames of other ids are dropped
+             by the CAN controller or the kernel (or by python-can for virtual buses)
+    """
+    return [{"can_id": can_id, "can_mask": CAN_SFF_MASK, "extended": False} for can_id in sorted(can_ids)]
+
 
 class CanlogPos(threading.Thread):
+    # arbitration id -> (signal, decoder of the payload)
+    DECODERS = dict([
+        signal_decoder('lat'),
+        signal_decoder('lon'),
+        signal_decoder('th', toDeg),
+        signal_decoder('flap'),
+    ])
+
     def __init__(self, infile, start_time=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._stop = threading.Event()
+        self._stop_event = threading.Event()
         self.infile = infile
         self.start_time = start_time
         self.reader = None
         self.running = False
-        self.lat = None
-        self.lon = None
-        self.th = None
+        self.signals = SignalCache(name for name, _ in self.DECODERS.values())
 
-    # function using _stop function
+    # function using _stop_event function
     def stop(self):
         self.running = False
         if self.reader:
@@ -39,90 +87,74 @@ class CanlogPos(threading.Thread):
                 self.reader.stop()
             except Exception as e:
                 logging.warning("Error stopping CanlogPos reader: %s", e)
-        self._stop.set()
+        self._stop_event.set()
 
     def stopped(self):
-        return self._stop.is_set()
+        return self._stop_event.is_set()
 
     def run(self):
-        self.reader = LogReader2(self.infile, self.start_time)
-        in_sync = MessageSync(self.reader, timestamps=True)
-        print('Can LogReader (Started on {})'.format(datetime.datetime.now()))
+        decoders = self.DECODERS
+        # a db with a current columnar sidecar is read from it, a .db reader selects the ids in
+        # the query, other logs are filtered in decode()
+        if self.infile.endswith('.db') and columns.is_current(self.infile):
+            store = columns.ColumnStore(columns.default_path(self.infile))
+            self.reader = columns.ColumnReader(store, self.start_time, can_ids=decoders.keys())
+        else:
+            self.reader = LogReader2(self.infile, self.start_time, can_ids=decoders.keys())
         self.running = True
+        scheduler = ReplayScheduler(self.reader, running=lambda: self.running)
+        print('Can LogReader (Started on {})'.format(datetime.datetime.now()))
         try:
-            for message in in_sync:
-                if not self.running:
-                    break
-                if message.is_error_frame:
-                    continue
-                if message.arbitration_id == 1036:
-                    self.lat = getDoubleL(message.data)
-                elif message.arbitration_id == 1037:
-                    self.lon = getDoubleL(message.data)
-                elif message.arbitration_id == 321:
-                    th = getFloat(message.data)
-                    if th < 0.0:
-                        self.th = th + 360.0
-                    else:
-                        self.th = th
-                elif message.arbitration_id == 340:  # flap pos
-                    fp = getInt(message.data)
-                    print('fp = {}'.format(fp))
-
-
+            for batch in scheduler:
+                for message in batch:
+                    if not message.is_error_frame:
+                        decode(self.signals, decoders, message)
         except KeyboardInterrupt:
             pass
         finally:
             self.reader.stop()
 
     def getLocation(self):
-        return self.lat, self.lon
+        return self.signals.get('lat'), self.signals.get('lon')
 
     def getTh(self):
-        return self.th
-
-
-def toDeg(val):
-    return val + 360.0 if val < 0.0 else val
+        return self.signals.get('th')
 
 
 class CanbusPos(threading.Thread):
+    # arbitration id -> (signal, decoder of the payload); UTC time (1200) needs the date
+    # and is decoded in run()
+    DECODERS = dict([
+        (1206, ('utc_date_data', getUtcDate)),
+        signal_decoder('lat'),
+        signal_decoder('lon'),
+        signal_decoder('th', toDeg),
+        signal_decoder('tt'),
+        signal_decoder('wind_direction', toDeg),
+    ])
+    UTC_ID = 1200
+
     def __init__(self, channel, bustype, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.daemon = True
         self.bus = can.interface.Bus(channel=channel, bustype=bustype)
-        self.utc = None
-        self.utc_date_data = None
-        self.lat = None
-        self.lon = None
-        self.th = None
-        self.wind_direction = None
+        self.bus.set_filters(acceptance_filters(set(self.DECODERS) | {self.UTC_ID}))
+        self.signals = SignalCache(['utc'] + [name for name, _ in self.DECODERS.values()])
 
     def run(self):
+        decoders = self.DECODERS
+        signals = self.signals
         try:
             for message in self.bus:
-                if message.arbitration_id == 1200:  # UTC time
-                    if self.utc_date_data:
-                        ud = struct.unpack('4b', self.utc_date_data[4:])
-                        ut = struct.unpack('4b', message.data[4:])
-                        self.utc = datetime.datetime((ud[2] * 100) + ud[3], ud[1], ud[0], ut[0], ut[1], ut[2],
-                                                     ut[3]).timestamp()
-                elif message.arbitration_id == 1206:  # UTC date
-                    self.utc_date_data = message.data
-                elif message.arbitration_id == 1036:
-                    self.lat = getDoubleL(message.data)
-                elif message.arbitration_id == 1037:
-                    self.lon = getDoubleL(message.data)
-                elif message.arbitration_id == 321:
-                    self.th = toDeg(getFloat(message.data))
-                elif message.arbitration_id == 1040:
-                    self.tt = getFloat(message.data)
-                elif message.arbitration_id == 334:
-                    self.wind_direction = toDeg(getFloat(message.data))
-                    # if self.tt and self.th and self.wind_direction:
-                    #     print('TT={:3.1f} TH={:3.1f} Diff={:3.1f} Wind_dir={:3.1f}'.format(self.tt, self.th,
-                    #                                                                        self.tt - self.th,
-                    #                                                                        self.wind_direction))
+                if message.arbitration_id == self.UTC_ID:
+                    utc_date_data = signals.get('utc_date_data')
+                    if utc_date_data:
+                        ud = _UTC.unpack_from(utc_date_data, 4)
+                        ut = _UTC.unpack_from(message.data, 4)
+                        signals.set('utc', datetime.datetime((ud[2] * 100) + ud[3], ud[1], ud[0], ut[0], ut[1], ut[2],
+                                                             ut[3]).timestamp(), message.timestamp)
+                else:
+                    decode(signals, decoders, message)
         except Exception as e:
             print(e)
 
@@ -130,10 +162,10 @@ class CanbusPos(threading.Thread):
         self.bus.shutdown()
 
     def getLocation(self):
-        return self.lat, self.lon
+        return self.signals.get('lat'), self.signals.get('lon')
 
     def getTh(self):
-        return self.th
+        return self.signals.get('th')
 
     def getUtc(self):
-        return self.utc
+        return self.signals.get('utc')
@@ -2,118 +2,183 @@ import threading
 from threading import Thread
 from time import sleep
 import logging
-import struct
-
-from can import Bus, MessageSync
 
+import sqlite2
+import timeindex
+from busoutput import open_output, log_stats
 from player2 import LogReader2
+from replay import FASTEST, ReplayScheduler, check_rate
+from transform import Pipeline, DEFAULT_TRANSFORMS
 
 
 class CanSender(Thread):
-    def __init__(self, infile, channel, interface, start_time=0.0, with_internal_bus=False, filter_out=[], *args,
-                 **kwargs):
+    def __init__(self, infile, channel, interface, start_time=0.0, with_internal_bus=False, filter_out=[], rate=1.0,
+                 prime=False, outputs=None, transforms=None, internal_max_rate=None, *args, **kwargs):
+        """
+        :param filter_out: CAN ids not sent
+        :param outputs: configs of the destination buses, see :mod:`busoutput`; default is the
+                        bus given by `channel` and `interface`
+        :param transforms: rules applied to the frames before sending, see :mod:`transform`;
+                           default is :data:`transform.DEFAULT_TRANSFORMS`
+        :param internal_max_rate: frames per second and CAN id sent at most to the internal bus,
+                                  its consumers (the map) need only a thinned stream; None for all
+        :raises ValueError: if a transform rule is invalid
+        """
         super().__init__(*args, **kwargs)
         self.daemon = True
         self.infile = infile
         self.start_time = start_time
-        self.filter_out = filter_out
-        self.bus_internal = None
-        try:
-            self.config = {'single_handle': True}
-            self.config['interface'] = interface
-            self.bus = Bus(channel, **self.config)
-        except Exception as e:
-            self.bus = None
-            logging.warning('CAN channel %s not connected: %s', channel, e)
+        self.rate = check_rate(rate)
+        # send the last frame of every CAN id before the start position first (db or archive)
+        self.prime = prime
+        self.transform = Pipeline(DEFAULT_TRANSFORMS if transforms is None else transforms, filter_out)
+        if outputs is None:
+            outputs = [{'channel': channel, 'interface': interface, 'single_handle': True}]
         if with_internal_bus:
-            try:
-                self.bus_internal = Bus(channel='internal', bustype='virtual')
-            except Exception as e:
-                self.bus_internal = None
-                logging.warning('Internal CAN bus not available: %s', e)
+            outputs = list(outputs) + [{'name': 'internal', 'channel': 'internal', 'interface': 'virtual',
+                                        'max_rate': internal_max_rate}]
+        # every bus is sent to by a worker of its own, a slow bus does not delay the replay
+        # (except at rate "max", see send_batch)
+        self.outputs = [output for output in map(open_output, outputs) if output]
         self.runevent = threading.Event()
         self.runevent.clear()
         self.killevent = threading.Event()
         self.killevent.set()
         self.doneevent = threading.Event()
         self.reader = None
+        self.scheduler = None
+        # slow preparations of the log, e.g. building indexes, run before the first replay
+        # and not in the replay thread, so stop() is not blocked by them
+        self.prepared = threading.Event()
+        threading.Thread(target=self.prepare, name='CanSender-prepare', daemon=True).start()
+
+    def prepare(self):
+        try:
+            if self.prime and self.infile.endswith('.db'):
+                sqlite2.prepare(self.infile)
+            elif timeindex.has_index(self.infile):
+                timeindex.open_index(self.infile)
+        except Exception:
+            logging.exception("Preparing %s failed", self.infile)
+        finally:
+            self.prepared.set()
 
     def run(self):
-        while True:
-            self.killevent.wait()
+        while self.killevent.is_set():
             self.runevent.wait()
-            self.reader = LogReader2(self.infile, self.start_time)
-            self.in_sync = MessageSync(self.reader, timestamps=True)
+            if not self.killevent.is_set():
+                break
+            while not self.prepared.wait(0.1) and self.running():
+                pass
+            if not self.running():
+                self.doneevent.set()
+                continue
+            messages = self.read_from(self.start_time)
+            self.scheduler = ReplayScheduler(messages, running=self.running, rate=self.rate)
             try:
-                for message in self.in_sync:
-                    if message.arbitration_id in self.filter_out:
-                        logging.info('Filter out CAN id %d', message.arbitration_id)
-                    else:
-                        ## TODO -- TEMPORARY: set fix value!!!
-                        if message.arbitration_id == 1515:
-                            logging.info('Set fix value for CAN id %d', message.arbitration_id)
-                            # ID 1515: dry_and_ballast_mass (Hg -> kg * 10)
-                            mass_data = bytearray(8)
-                            struct.pack_into(">H", mass_data, 4, int(461.0 * 10))
-                            message.data = mass_data
-                        if self.bus:
-                            self.bus.send(message, timeout=0.1)
-                        if self.bus_internal:
-                            self.bus_internal.send(message)
-                        if not self.runevent.is_set():
-                            break
+                if self.prime and hasattr(self.reader, 'bus_state'):
+                    self.send_batch(list(self.reader.bus_state(self.start_time)))
+                for batch in self.scheduler:
+                    self.send_batch(batch)
+                    if not self.running():
+                        break
             except Exception:
                 logging.exception("CAN send error")
-            finally:
-                pass
 
-            if self.reader:
-                self.stop_reader()
+            log_stats(self.outputs)
             self.runevent.clear()
             self.doneevent.set()
-            if not self.killevent.is_set():
-                break
+        if self.reader:
+            self.stop_reader()
+
+    def send_batch(self, batch):
+        """
+        Hand the messages of `batch` to all outputs, returns without waiting for the buses; at
+        rate "max" it waits for room in their queues, the buses set the pace.
+        """
+        batch = self.transform(batch)
+        if batch:
+            block = self.rate == FASTEST
+            for output in self.outputs:
+                output.offer(batch, block)
+
+    def running(self):
+        return self.runevent.is_set() and self.killevent.is_set()
+
+    def read_from(self, start_time):
+        """
+        The messages from `start_time` on. A sqlite db, a .canz file or an archive stays open
+        between replays, a seek is only a new query on the same connection (sqlite reuses the
+        prepared statement) or a lookup in the block index; other log files are opened again.
+        """
+        if hasattr(self.reader, 'read_range'):
+            return self.reader.read_range(start_time)
+        if self.reader:
+            self.stop_reader()
+        self.reader = LogReader2(self.infile, start_time)
+        if hasattr(self.reader, 'read_range'):
+            return self.reader.read_range(start_time)
+        return self.reader
 
     def stop_reader(self):
         try:
             self.reader.stop()
-            sleep(0.2)
         finally:
             self.reader = None
 
+    def set_rate(self, rate):
+        """
+        Set the replay rate, see :func:`replay.check_rate`, it also applies to a running replay.
+        """
+        self.rate = check_rate(rate)
+        scheduler = self.scheduler
+        if scheduler:
+            scheduler.set_rate(self.rate)
+
+    def position(self):
+        """
+        :return: the log time of the running replay, None if not replaying
+        """
+        scheduler = self.scheduler
+        if scheduler and self.runevent.is_set():
+            return scheduler.position()
+        return None
+
     def resume(self, start_time):
         self.start_time = start_time
         self.runevent.set()
 
     def stop(self):
         if self.runevent.is_set():
-            self.runevent.clear()
             self.doneevent.clear()
-            self.doneevent.wait()
+            self.runevent.clear()
+            scheduler = self.scheduler
+            if scheduler:
+                scheduler.wake()
+            # the queued messages are from the old position, a clear also ends the wait of a
+            # replay at rate "max" for room in a queue
+            for output in self.outputs:
+                output.clear()
+            if not self.doneevent.wait(timeout=2.0):
+                logging.warning('CAN replay did not stop')
+            for output in self.outputs:
+                output.clear()
 
     def exit(self):
         # Request thread to terminate and unblock waits
         self.killevent.clear()
         self.runevent.set()
-        sleep(0.1)
-        if self.reader:
-            self.stop_reader()
-        if self.bus:
-            try:
-                self.bus.shutdown()
-            except Exception as e:
-                logging.warning('Error during CAN bus shutdown: %s', e)
-        if self.bus_internal:
-            try:
-                self.bus_internal.shutdown()
-            except Exception as e:
-                logging.warning('Error during internal CAN bus shutdown: %s', e)
-        # Give the thread a moment to finish
+        scheduler = self.scheduler
+        if scheduler:
+            scheduler.wake()
         try:
             self.join(timeout=2.0)
         except RuntimeError:
             # join called from within the same thread; ignore
             pass
+        for output in self.outputs:
+            output.close()
+        log_stats(self.outputs)
 
 
 if __name__ == '__main__':
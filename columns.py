@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Columnar sidecar of a can-bus sqlite3 db, for plots and map tracks.
+
+For every CAN id the timestamps and the payloads are stored as .npy files in the directory
+``<db-file>.cols``::
+
+    ts_<id>.npy     float64, sorted
+    data_<id>.npy   uint8 (n, 8), payload padded with zeros
+
+The files are memory-mapped, a time range is found with a binary search and the CANaerospace
+value (bytes 4-7, big-endian) of all frames is converted with one numpy view.
+:class:`ColumnReader` reads the frames of some ids in timestamp order, the map
+(:class:`canreader.CanlogPos`) replays a db from its sidecar if it has a current one.
+The sidecar is rebuilt when the messages table changed (number of rows or time range).
+
+Build the sidecar with::
+
+    python columns.py <db-file>
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from urllib.request import pathname2url
+
+import numpy as np
+
+import canaerospace
+from sqlite2 import TS_SECONDS, assemble_message, schema_version
+
+FETCH_SIZE = 100_000
+
+META_FILE = 'meta.json'
+
+
+def default_path(db_file):
+    return db_file + '.cols'
+
+
+def _db_stamp(conn):
+    """
+    :return: what the sidecar was built from: schema version, number of rows and time range of
+             the messages table; unlike the mtime of the file it does not change when other
+             tables are written or the WAL is checkpointed
+    """
+    return {
+        'version': schema_version(conn),
+        'count': conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+        # separate queries, MIN and MAX alone are index lookups
+        'first': conn.execute("SELECT MIN(ts) FROM messages").fetchone()[0],
+        'last': conn.execute("SELECT MAX(ts) FROM messages").fetchone()[0],
+    }
+
+
+def _read_id(conn, can_id):
+    """
+    :return: the timestamps and the zero padded payloads of `can_id`, in timestamp order
+    """
+    seconds = TS_SECONDS[schema_version(conn)].format('ts')
+    cursor = conn.execute("SELECT {}, data FROM messages WHERE arbitration_id = ? AND error = 0 ORDER BY ts".format(
+        seconds), (can_id,))
+    ts = []
+    data = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        ts.append(np.fromiter((row[0] for row in rows), np.float64, len(rows)))
+        payload = b''.join(bytes(row[1] or b'').ljust(8, b'\0')[:8] for row in rows)
+        data.append(np.frombuffer(payload, np.uint8).reshape(len(rows), 8))
+    if not ts:
+        return np.zeros(0, np.float64), np.zeros((0, 8), np.uint8)
+    return np.concatenate(ts), np.concatenate(data)
+
+
+def build(db_file, path=None):
+    """
+    Write the columnar sidecar of `db_file`, one query per CAN id on the (arbitration_id, ts) index.
+
+    :param str db_file: sqlite3 db with a ``messages`` table
+    :param str path: sidecar directory, default ``<db-file>.cols``
+    :return: the number of CAN ids written
+    """
+    path = path or default_path(db_file)
+    os.makedirs(path, exist_ok=True)
+    meta_file = os.path.join(path, META_FILE)
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_id_ts_idx ON messages (arbitration_id, ts)")
+        ids = [row[0] for row in conn.execute("SELECT DISTINCT arbitration_id FROM messages WHERE error = 0")]
+        counts = {}
+        for can_id in ids:
+            ts, data = _read_id(conn, can_id)
+            np.save(os.path.join(path, 'ts_{}.npy'.format(can_id)), ts)
+            np.save(os.path.join(path, 'data_{}.npy'.format(can_id)), data)
+            counts[can_id] = len(ts)
+        stamp = _db_stamp(conn)
+    finally:
+        conn.close()
+    # written last, a sidecar without meta.json is incomplete
+    with open(meta_file, 'w') as f:
+        json.dump({'db': stamp, 'counts': {str(k): v for k, v in counts.items()}}, f)
+    return len(ids)
+
+
+def is_current(db_file, path=None):
+    """
+    :return: True if the sidecar of `db_file` exists and was built from the messages as they are now
+    """
+    try:
+        with open(os.path.join(path or default_path(db_file), META_FILE)) as f:
+            stamp = json.load(f)['db']
+        conn = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_file))), uri=True)
+        try:
+            return stamp == _db_stamp(conn)
+        finally:
+            conn.close()
+    except (OSError, ValueError, KeyError, sqlite3.Error):
+        return False
+
+
+class ColumnStore:
+
+    def __init__(self, path):
+        """
+        :param str path: sidecar directory written by :func:`build`
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.counts = {int(k): v for k, v in json.load(f)['counts'].items()}
+        self._ts = {}
+        self._data = {}
+
+    @classmethod
+    def open(cls, db_file, path=None, rebuild=True):
+        """
+        Open the sidecar of `db_file`, it is (re)built first if missing or older than the db.
+        """
+        path = path or default_path(db_file)
+        if rebuild and not is_current(db_file, path):
+            build(db_file, path)
+        return cls(path)
+
+    def ids(self):
+        return sorted(self.counts)
+
+    def _load(self, cache, name, can_id):
+        if can_id not in cache:
+            if can_id not in self.counts:
+                raise KeyError('CAN id {} not in {}'.format(can_id, self.path))
+            cache[can_id] = np.load(os.path.join(self.path, '{}_{}.npy'.format(name, can_id)), mmap_mode='r')
+        return cache[can_id]
+
+    def timestamps(self, can_id):
+        return self._load(self._ts, 'ts', can_id)
+
+    def data(self, can_id):
+        return self._load(self._data, 'data', can_id)
+
+    def _slice(self, can_id, start_time, end_time):
+        ts = self.timestamps(can_id)
+        i = 0 if start_time is None else np.searchsorted(ts, start_time, 'left')
+        j = len(ts) if end_time is None else np.searchsorted(ts, end_time, 'left')
+        return slice(i, j)
+
+    def frames(self, can_id, start_time=None, end_time=None):
+        """
+        :return: timestamps and payloads (n, 8) of `can_id` in [`start_time`, `end_time`)
+        """
+        s = self._slice(can_id, start_time, end_time)
+        return self.timestamps(can_id)[s], self.data(can_id)[s]
+
+    def series(self, can_id, start_time=None, end_time=None, dtype='>f4', scale=None):
+        """
+        The CANaerospace values of `can_id` in [`start_time`, `end_time`).
+
+        :param dtype: numpy type of the value in bytes 4-7, e.g. '>f4' (float), '>i4' (long), '>u2' (ushort)
+        :param scale: optional factor applied to the values
+        :return: timestamps and values as arrays
+        """
+        ts, data = self.frames(can_id, start_time, end_time)
+        dtype = np.dtype(dtype)
+        values = np.ascontiguousarray(data[:, 4:4 + dtype.itemsize]).view(dtype).ravel()
+        if scale is not None:
+            values = values * scale
+        else:
+            values = values.astype(dtype.newbyteorder('='))
+        return ts, values
+
+    def signal(self, name_or_id, start_time=None, end_time=None):
+        """
+        The physical values of a known CANaerospace signal in [`start_time`, `end_time`).
+
+        :param name_or_id: signal name, e.g. 'ias', or CAN id, see :data:`canaerospace.SIGNALS`
+        :return: timestamps and values as arrays
+        """
+        can_id = canaerospace.signal_id(name_or_id)
+        ts, data = self.frames(can_id, start_time, end_time)
+        return ts, canaerospace.decode_values(can_id, data)
+
+    def track(self, start_time=None, end_time=None):
+        """
+        The positions in [`start_time`, `end_time`), every latitude with the last longitude
+        received before it.
+
+        :return: timestamps, latitudes and longitudes in degrees
+        """
+        ts, lat = self.signal('lat', start_time, end_time)
+        lon_ts, lon = self.signal('lon', None, end_time)
+        i = np.searchsorted(lon_ts, ts, 'right') - 1
+        ok = i >= 0
+        return ts[ok], lat[ok], lon[i[ok]]
+
+
+class ColumnReader:
+    """
+    The frames of some CAN ids from the sidecar as `can.Message` in timestamp order, read like
+    a :class:`sqlite2.SqliteReader2` of the db. The payloads are the 8 bytes of the sidecar,
+    shorter payloads are padded with zeros.
+    """
+
+    def __init__(self, store, start_time=None, end_time=None, can_ids=None):
+        """
+        :param ColumnStore store: the sidecar
+        :param can_ids: arbitration ids to read, None reads all
+        """
+        self.store = store
+        self.start_time = start_time
+        self.end_time = end_time
+        self.can_ids = can_ids
+
+    def read_range(self, start_time=None, end_time=None, can_ids=None):
+        """
+        :rtype: Generator[can.Message]
+        """
+        ids = [can_id for can_id in sorted(can_ids or self.store.ids()) if can_id in self.store.counts]
+        columns = [self.store.frames(can_id, start_time, end_time) for can_id in ids]
+        if not columns:
+            return
+        ts = np.concatenate([c[0] for c in columns])
+        data = np.concatenate([c[1] for c in columns])
+        id_column = np.repeat(np.array(ids, np.int64), [len(c[0]) for c in columns])
+        order = np.argsort(ts, kind='stable')
+        payload = data[order].tobytes()
+        for i, (timestamp, can_id) in enumerate(zip(ts[order].tolist(), id_column[order].tolist())):
+            yield assemble_message((timestamp, can_id, False, False, False, 8, payload[8 * i:8 * i + 8]))
+
+    def __iter__(self):
+        return self.read_range(self.start_time, self.end_time, self.can_ids)
+
+    def stop(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "python columns.py",
+        description="Build the columnar per CAN id sidecar of a can-bus sqlite3 db.")
+    parser.add_argument('dbfile', metavar='db-file', type=str, help='The db, created with logfile2sqldb.py.')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='The sidecar directory, default is <db-file>.cols.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dbfile):
+        print('No such file {}'.format(args.dbfile), file=sys.stderr)
+        raise SystemExit(1)
+    start = time.perf_counter()
+    n = build(args.dbfile, args.output)
+    print('Wrote {} CAN ids to {} in {:.1f}s'.format(n, args.output or default_path(args.dbfile),
+                                                     time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
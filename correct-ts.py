@@ -1,11 +1,12 @@
 import argparse
 import datetime
 import os
-import re
-import struct
 from statistics import mean, variance, stdev
 
-from contextlib import contextmanager
+import numpy as np
+
+import binlog
+import candump
 
 '''
    Adjust timestamps of a CAN dump file according to GPS time (UTC).
@@ -14,58 +15,52 @@ from contextlib import contextmanager
 '''
 
 
-## todo -- user rather Log Reader then our  complicated parsing code !!!
-
-
-# (1564994147.496590) can0 78A#0A0C1CE5F7990000
-def getCanData(line):
-    parts = (" ".join(line.split()).split())
-    ts = float(parts[0][1:-1])
-    canDevStr = parts[1]
-    parts2 = parts[2].split("#")
-
-    canIdStr = parts2[0]
-    dataFullStr = parts2[1]
-    nodeIdStr = parts2[1][0:2]
-    dataStr = parts2[1][8:40]
-    return ts, canDevStr, canIdStr, dataStr, nodeIdStr, dataFullStr
-
-
 def statistics(ids, id_):
     ids[id_] = ids.get(id_, 0) + 1
 
 
-def check(line: str) -> bool:
-    pattern = r'^\(\d+\.\d+\)\s+(?:can|vcan)\d*\s+[0-9A-Fa-f]+#[0-9A-Fa-f]+$'
-    return bool(re.match(pattern, line))
-
-
-@contextmanager
-def read_bin_file(filename):
-    # Binary Log Packet structure (fixed 21 bytes)
-    # typedef struct __attribute__((packed))
-    # {
-    #     double timestamp;   // 8 bytes
-    #     uint32_t id;        // 4 bytes
-    #     uint8_t len;        // 1 byte
-    #     uint8_t data[8];    // 8 bytes
-    # } LogPacket;
-    struct_format = '<dIB8B'
-    f = open(filename, 'rb')
-    try:
-        def generator():
-            while True:
-                chunk = f.read(21)
-                if not chunk or len(chunk) < 21:
-                    break
-                timestamp, can_id, length, *data = struct.unpack(struct_format, chunk)
-                data_hex = "".join("{:02X}".format(b) for b in data[:length])
-                # Format: (timestamp) can0 ID#DATA
-                yield "({:f}) can0 {:X}#{:s}\n".format(timestamp, can_id, data_hex)
+def frame_columns(frames):
+    """
+    :return: timestamps, CAN ids and payloads of a :data:`candump.FRAME_DTYPE` array as lists
+    """
+    # the len byte of a .BIN record may be corrupt, never read beyond the 8 data bytes
+    dlcs = np.minimum(frames['dlc'], 8).tolist()
+    data = frames['data'].tobytes()
+    payloads = [data[i:i + n] for i, n in zip(range(0, len(data), 8), dlcs)]
+    return frames['timestamp'].tolist(), frames['arbitration_id'].tolist(), payloads
+
+
+def read_frames(filename):
+    """
+    Read the CAN frames of a candump text log or of a .BIN binary log, without converting
+    between the two formats.
+
+    :return: generator of (cnt, ts, channel, can_id, frame, data); cnt is the line number of
+             text logs and the record number of .BIN logs, frame is the ID#DATA text of the
+             frame as written to the new log: as in the line of text logs, like candump writes
+             it for .BIN logs. Invalid lines are reported and skipped.
+    """
+    if filename.upper().endswith(".BIN"):
+        cnt = 0
+        for records in binlog.read_blocks(filename):
+            for ts, can_id, data in zip(*frame_columns(records)):
+                yield cnt, ts, "can0", can_id, "{:X}#{}".format(can_id, data.hex().upper()), data
+                cnt += 1
+        return
 
-        yield generator()
-    finally:
-        f.close()
+    for block in candump.read_blocks(filename):
+        bad = iter([i for i in block.bad.tolist() if not block.line(i).startswith(b"*")])
+        error = next(bad, None)
+        for i, ts, can_id, data, channel in zip(block.lines.tolist(), *frame_columns(block.frames),
+                                                block.channels.tolist()):
+            while error is not None and error < i:
+                print("ERROR, line={:d} >>>{:s}<<<".format(block.line0 + error,
+                                                           block.line(error).decode(errors="replace")))
+                error = next(bad, None)
+            yield block.line0 + i, ts, channel.decode(), can_id, block.line(i).split()[2].decode(), data
+        while error is not None:
+            print("ERROR, line={:d} >>>{:s}<<<".format(block.line0 + error, block.line(error).decode(errors="replace")))
+            error = next(bad, None)
 
 
 def close_logfile(ts_log):
@@ -106,8 +101,9 @@ def sync_with_gps(log_file_name: str, diff):
 
 def main(argv=None):
     parser = argparse.ArgumentParser(
-        description='Correct time stamps according to the logger time sync (canId 0x1FFFFFF0) and optional GPS time (UTC). '
-                    'Supports text logs and .BIN binary logs. Only useful for CANaerospace format!')
+        description='Correct time stamps according to the logger time sync (canId 0x1FFFFFF0) '
+                    'and optional GPS time (UTC). Supports text logs and .BIN binary logs. '
+                    'Only useful for CANaerospace format!')
     parser.add_argument('-input', metavar='input', type=str, required=True, help='Input logfile (text or .BIN binary).')
     parser.add_argument('-gps', action='store_true', help='Sync with GPS time (canIDs 1200 and 1206.')
 
@@ -122,98 +118,81 @@ def main(argv=None):
     mmm = []
     new_cnt = 0
 
-    if inputFile.upper().endswith(".BIN"):
-        context_manager = read_bin_file(inputFile)
-    else:
-        context_manager = open(inputFile)
-
-    with context_manager as inf:
-        canIds = {}
-        nodeIds = {}
-        dataUtcStr = None
-        dataDateStr = None
-        ts_log_last = None
-        ts_log_first = None
-        log_file_nr = 0
-        diff = None
-        ts_log_diff = None
-        ts_first = None
-        ts_prev = None
-        ts_gps_first = None
-
-        for cnt, line in enumerate(inf):
-            if new_log is None:
-                log_file_nr = log_file_nr + 1
-                new_log = open("data/newlog_{}.log".format(log_file_nr), "w+")
-            if not line.startswith("*"):
-                if not check(line):
-                    print("ERROR, line={:d} >>>{:s}<<<".format(cnt, line.replace("\n", "")))
-                else:
-                    ts, canDevStr, canIdStr, dataStr, nodeIdStr, dataFullStr = getCanData(line)
-                    diff = 0.0
-                    canId = int(canIdStr, 16)
-                    if ts_first is None:
-                        ts_first = ts
-                    if ts_prev is None:
-                        ts_prev = ts
-                    else:
-                        if ts - ts_prev > 1.1:
-                            print("ERROR, gap between ts {:f} and {:f}, {:.3f}s \n".format(ts_prev, ts, ts - ts_prev))
-                        ts_prev = ts
-
-                    if canId == 0x1FFFFFF0:  # Time sync
-                        # CANaerospace Time sync format: YY MM DD HH MM SS (Bytes 0-5)
-                        ts_log = datetime.datetime((int(dataFullStr[0:2], 16) + 2000), int(dataFullStr[2:4], 16),
-                                                   int(dataFullStr[4:6], 16), int(dataFullStr[6:8], 16),
-                                                   int(dataFullStr[8:10], 16), int(dataFullStr[10:12], 16)).timestamp()
-                        diff = ts_log - ts
-                        if ts_log_last is None:
-                            ts_log_last = ts_log
-                        ts_log_diff = ts_log - ts_log_last
-                        ts_log_last = ts_log
-                        if ts_log_first is None:
-                            ts_log_first = ts_log
-                        line = None
-
-                    elif canId == 1200:  # UTC
-                        if not dataDateStr is None:
-                            ts_gps = datetime.datetime((int(dataDateStr[4:6], 16) * 100) + int(dataDateStr[6:8], 16),
-                                                       int(dataDateStr[2:4], 16),
-                                                       int(dataDateStr[0:2], 16), int(dataStr[0:2], 16),
-                                                       int(dataStr[2:4], 16),
-                                                       int(dataStr[4:6], 16)).timestamp()
-                            if ts_gps_first is None:
-                                ts_gps_first = ts_gps
-                            mmm.append((ts + diff) - ts_gps)
-                        dataUtcStr = dataStr
-
-                    elif canId == 1206:  # Date
-                        dataDateStr = dataStr
-
-                    if line is not None:
-                        parts = (" ".join(line.split()).split())
-                        new_log.write("({:f}) {} {}\n".format(ts + diff, parts[1], parts[2]))
-                        new_cnt = new_cnt + 1
-
-                    if ts_log_first is not None and (ts_log_diff is not None) and ts_log_diff > 1.0:
-                        close_logfile(ts_log_first)
-                        print_gps_diff_statistics()
-                        if syncwithgps and mmm:
-                            sync_with_gps(new_log_file_name, mean(mmm))
-                        mmm = []
-                        new_log = None
-                        ts_log_first = None
-
-                    statistics(canIds, canId)
-                    statistics(nodeIds, int(nodeIdStr, 16))
-
-        if ts_log_first is None:
-            ts_log_first = ts_gps_first
-
-        close_logfile(ts_log_first)
-        print_gps_diff_statistics()
-        if syncwithgps and mmm:
-            sync_with_gps(new_log_file_name, mean(mmm))
+    canIds = {}
+    nodeIds = {}
+    dataDate = None
+    ts_log_last = None
+    ts_log_first = None
+    log_file_nr = 0
+    diff = None
+    ts_log_diff = None
+    ts_first = None
+    ts_prev = None
+    ts_gps_first = None
+
+    for cnt, ts, channel, canId, frame, data in read_frames(inputFile):
+        if new_log is None:
+            log_file_nr = log_file_nr + 1
+            new_log = open("data/newlog_{}.log".format(log_file_nr), "w+")
+        write = True
+        diff = 0.0
+        if ts_first is None:
+            ts_first = ts
+        if ts_prev is None:
+            ts_prev = ts
+        else:
+            if ts - ts_prev > 1.1:
+                print("ERROR, gap between ts {:f} and {:f}, {:.3f}s \n".format(ts_prev, ts, ts - ts_prev))
+            ts_prev = ts
+
+        if canId == 0x1FFFFFF0:  # Time sync
+            # CANaerospace Time sync format: YY MM DD HH MM SS (Bytes 0-5)
+            ts_log = datetime.datetime(data[0] + 2000, data[1], data[2], data[3], data[4], data[5]).timestamp()
+            diff = ts_log - ts
+            if ts_log_last is None:
+                ts_log_last = ts_log
+            ts_log_diff = ts_log - ts_log_last
+            ts_log_last = ts_log
+            if ts_log_first is None:
+                ts_log_first = ts_log
+            write = False
+
+        elif canId == 1200:  # UTC, HH MM SS (Bytes 4-6)
+            if dataDate is not None:
+                # Date, DD MM YY(century) YY (Bytes 4-7)
+                ts_gps = datetime.datetime((dataDate[6] * 100) + dataDate[7], dataDate[5], dataDate[4],
+                                           data[4], data[5], data[6]).timestamp()
+                if ts_gps_first is None:
+                    ts_gps_first = ts_gps
+                mmm.append((ts + diff) - ts_gps)
+
+        elif canId == 1206:  # Date
+            dataDate = data
+
+        if write:
+            new_log.write("({:f}) {} {}\n".format(ts + diff, channel, frame))
+            new_cnt = new_cnt + 1
+
+        if ts_log_first is not None and (ts_log_diff is not None) and ts_log_diff > 1.0:
+            close_logfile(ts_log_first)
+            print_gps_diff_statistics()
+            if syncwithgps and mmm:
+                sync_with_gps(new_log_file_name, mean(mmm))
+            mmm = []
+            new_log = None
+            ts_log_first = None
+
+        statistics(canIds, canId)
+        if data:
+            statistics(nodeIds, data[0])
+
+    if ts_log_first is None:
+        ts_log_first = ts_gps_first
+
+    close_logfile(ts_log_first)
+    print_gps_diff_statistics()
+    if syncwithgps and mmm:
+        sync_with_gps(new_log_file_name, mean(mmm))
 
     print("canId statistics")
     print(sorted(canIds.items(), key=lambda kv: kv[0], reverse=True))
@@ -7,7 +7,8 @@ for example:
    },
    "canlog": {
       "date": "2019-10-21",
-      "filename": "data/candump-2019-09-21_110938-gps.db"
+      "filename": "data/candump-2019-09-21_110938-gps.db",
+      "rate": 1.0
    },
    "description": "Flug vom 2019-10-21",
    "video": {
@@ -28,4 +29,23 @@ for example:
          "7253": 1569069060.0
       }
    }
-}'''
\ No newline at end of file
+}
+canlog.filename is a log file, a .db or .canz file or an archive directory (see archive.py).
+canlog.rate is optional, the replay rate 0.25 .. 16 or "max" (as fast as possible), default 1.0.
+canlog.prime is optional, true sends the last frame of every CAN id before the start position
+first, so receivers have a complete state at once after a seek (.db files and archives), default false.
+canbus.outputs is optional, a list of buses the replay is sent to instead of canbus.channel and
+canbus.interface, e.g. [{"interface": "socketcan", "channel": "can0"}, {"interface": "udp_multicast",
+"channel": "239.0.0.1", "maxsize": 100}]. Every bus has a send queue of its own (maxsize, default 1000),
+when it is full new messages are dropped (policy "drop") or the oldest ones ("drop_oldest"), or
+the replay waits for room ("block", at most "block_timeout" seconds, default 1). A replay at rate
+"max" always waits, the slowest bus sets the pace.
+An output sends at most "max_rate" frames per second of every CAN id (or "max_rates": {"<id>": rate}),
+the latest frame of an id wins; 0 is no limit.
+canbus.internal_max_rate is optional, the same limit for the internal bus of the map, default 4.
+canlog.filter_out is optional, a list of CAN ids not sent.
+canlog.transforms is optional, a list of rules applied to the frames before sending, e.g.
+[{"id": 1515, "action": "set", "type": "USHORT", "value": 4610}, {"id": 315, "action": "scale",
+"type": "FLOAT", "factor": 1.1}, {"id": 1036, "action": "remap", "to": 1100}, {"id": 1506,
+"action": "rate_limit", "max_rate": 4}, {"id": 1200, "action": "drop"}], see transform.py.
+Default is the first rule of the example.'''
\ No newline at end of file
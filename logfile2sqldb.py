@@ -3,24 +3,134 @@
 
 """
 Import a can-bus logfile into sqlite3 db.
-Note: don't forget to add an index to ts field:
-   sqlite3 -line log-data.db 'CREATE unique INDEX ts_idx ON messages (ts);'
+The rows are loaded in WAL mode with synchronous=OFF, afterwards the indexes on (ts) and
+(arbitration_id, ts) are created, so the db is ready for replay. While importing the state of
+the bus is written to the checkpoints table every 5 s, see sqlite2.CheckpointBuilder, and the
+summary tables of the flight are computed for reports, see summary.py.
+With --columns the columnar sidecar for plots and map tracks is built too, with --signals
+the values of the known CANaerospace signals are decoded into the signals (ts, id, value) table.
+With --schema 2 the messages table has integer microsecond timestamps and is clustered by time,
+see sqlite2.py. An output file ending with .canz is written as compressed block file instead of
+a db, see blockstore.py.
+The input can also be a directory or a glob pattern, the files are then parsed in parallel
+and merged into one db ordered by timestamp.
+candump .log files are parsed with the vectorized parser of candump.py, .BIN files of the
+onboard loggers are memory-mapped with binlog.py, all other formats are read with can.LogReader.
 """
 
 from __future__ import absolute_import, print_function
 
 import argparse
+import os
+import queue
 import sqlite3
 import sys
+import tempfile
+import threading
+import time
 from datetime import datetime
 
 import can
-from can import LogReader, MessageSync
 
+import blockstore
+import canaerospace
+import columns
+import summary
 
-def my_logger(conn, messages):
-    conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", messages)
-    conn.commit()
+from logrows import (batched, begin_bulk_load, end_bulk_load, file_rows, input_files,
+                     parallel_batches)
+from sqlite2 import (CheckpointBuilder, INSERT_MESSAGE, create_checkpoints, create_messages_indexes,
+                     create_messages_table, drop_checkpoints, has_table, next_seq, schema_version, v2_rows)
+
+
+def produce_in_thread(batches, maxsize=4):
+    """
+    Run the `batches` generator in a producer thread, so parsing and inserting overlap.
+    Exceptions of the producer are re-raised in the consumer.
+    """
+    done = object()
+    q = queue.Queue(maxsize=maxsize)
+    error = []
+
+    def producer():
+        try:
+            for batch in batches:
+                q.put(batch)
+        except Exception as e:
+            error.append(e)
+        finally:
+            q.put(done)
+
+    threading.Thread(target=producer, name='logfile2sqldb-producer', daemon=True).start()
+    while True:
+        batch = q.get()
+        if batch is done:
+            break
+        yield batch
+    if error:
+        raise error[0]
+
+
+def import_batches(conn, batches, signals=False, checkpoints=None, version=1, summary_builder=None):
+    """
+    Insert all `batches` with one prepared statement, one transaction per batch.
+
+    :param bool signals: also insert the decoded values of the known CANaerospace signals
+                         into the ``signals`` table
+    :param sqlite2.CheckpointBuilder checkpoints: optional, gets all rows in the order of `batches`
+    :param summary.SummaryBuilder summary_builder: optional, gets all rows
+    :param int version: schema version of the ``messages`` table, see sqlite2.py
+    :return: the number of rows inserted
+    """
+    m = 0
+    start = time.perf_counter()
+    insert = INSERT_MESSAGE[version]
+    seq = next_seq(conn) if version == 2 else None
+    for batch in batches:
+        if version == 2:
+            conn.executemany(insert, v2_rows(batch, seq))
+            seq += len(batch)
+        else:
+            conn.executemany(insert, batch)
+        if signals:
+            conn.executemany(canaerospace.INSERT_SIGNAL, canaerospace.signal_rows(batch))
+        conn.commit()
+        m += len(batch)
+        # the builders only get rows which are in the db, an interrupted batch is rolled back
+        if checkpoints:
+            checkpoints.add(batch)
+            conn.commit()
+        if summary_builder:
+            summary_builder.add(batch)
+        print('Commits {} ({:.0f} rows/s)'.format(m, m / max(time.perf_counter() - start, 1e-9)))
+    return m
+
+
+def write_blocks(outfile, batches, codec='zlib'):
+    """
+    Write all `batches` to the compressed block file `outfile`, see blockstore.py.
+
+    :return: the number of rows written
+    """
+    writer = blockstore.BlockWriter(outfile, codec)
+    start = time.perf_counter()
+    try:
+        for batch in batches:
+            writer.add(batch)
+            print('Blocks {} ({:.0f} rows/s)'.format(writer.count,
+                                                     writer.count / max(time.perf_counter() - start, 1e-9)))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.count
+
+
+def print_throughput(rows, infiles, elapsed):
+    size = sum(os.path.getsize(f) for f in infiles)
+    elapsed = max(elapsed, 1e-9)
+    print('Imported {} rows from {:.1f} MB in {:.1f}s ({:.0f} rows/s, {:.1f} MB/s)'.format(
+        rows, size / 1e6, elapsed, rows / elapsed, size / 1e6 / elapsed))
 
 
 def main():
@@ -29,15 +139,43 @@ def main():
         description="Import can-bus logfile into sqlite3 db.")
 
     parser.add_argument('infile', metavar='input-file', type=str,
-                        help='The file to read. For supported types see can.LogReader.')
+                        help='The file to read. For supported types see can.LogReader, '
+                             '.BIN logger files are supported too. '
+                             'A directory or a glob pattern (quoted) imports several files.')
 
     parser.add_argument('outfile', metavar='output-file', type=str,
-                        help='The file to write. For supported types see can.LogReader.')
+                        help='The sqlite3 db to write, or a compressed block file if it ends with .canz.')
 
     parser.add_argument("-v", action="count", dest="verbosity",
                         help='''How much information do you want to see at the command line?
                         You can add several of these e.g., -vv is DEBUG''', default=2)
 
+    parser.add_argument("--thread", action="store_true",
+                        help='Parse the input file in a separate thread while inserting.')
+
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help='Number of processes parsing files in parallel, default is the number of cores.')
+
+    parser.add_argument("--no-index", action="store_true",
+                        help='Do not create the (ts) and (arbitration_id, ts) indexes and the checkpoints, '
+                             'the checkpoints of an existing db are dropped.')
+
+    parser.add_argument("--no-summary", action="store_true",
+                        help='Do not compute the summary tables for reports (see summary.py and analyze_db.py).')
+
+    parser.add_argument("--signals", action="store_true",
+                        help='Also decode the known CANaerospace signals (see canaerospace.py) into the signals table.')
+
+    parser.add_argument("--schema", type=int, choices=(1, 2), default=None,
+                        help='Version of the messages table: 1 with ts REAL in seconds, 2 with integer microseconds '
+                             'clustered by time, see sqlite2.py. An existing db keeps its version.')
+
+    parser.add_argument("--codec", choices=sorted(blockstore.CODECS), default='zlib',
+                        help='Compression of a .canz output file: zlib (default) or lzma (smaller, slower to write).')
+
+    parser.add_argument("--columns", action="store_true",
+                        help='Also build the columnar per CAN id sidecar <output-file>.cols, see columns.py.')
+
     # print help message when no arguments were given
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -46,56 +184,96 @@ def main():
 
     results = parser.parse_args()
 
+    if results.outfile.endswith(blockstore.SUFFIX):
+        db_options = [option for option, given in (('--columns', results.columns), ('--signals', results.signals),
+                                                   ('--schema', results.schema is not None),
+                                                   ('--no-index', results.no_index)) if given]
+        if db_options:
+            parser.error('{} only for a db, not for a {} output file'.format(', '.join(db_options),
+                                                                             blockstore.SUFFIX))
+
     verbosity = results.verbosity
 
     logging_level_name = ['critical', 'error', 'warning', 'info', 'debug', 'subdebug'][min(5, verbosity)]
     can.set_logging_level(logging_level_name)
 
-    reader = LogReader(results.infile)
-    in_nosync = MessageSync(reader, timestamps=False, skip=3600)
+    infiles = input_files(results.infile)
+    if not infiles:
+        print('No input files found for {}'.format(results.infile), file=sys.stderr)
+        raise SystemExit(1)
+
     print('Can LogReader (Started on {})'.format(datetime.now()))
+    start = time.perf_counter()
+
+    spool = None
+    rows = 0
+    if len(infiles) == 1:
+        # straight from the file, no MessageSync: a bulk conversion needs no replay timing
+        batches = batched(file_rows(infiles[0], verbosity))
+    else:
+        spool = tempfile.TemporaryDirectory(prefix='logfile2sqldb-',
+                                            dir=os.path.dirname(os.path.abspath(results.outfile)))
+        batches = parallel_batches(infiles, spool.name, results.jobs)
+    if results.thread:
+        batches = produce_in_thread(batches)
+
+    if results.outfile.endswith(blockstore.SUFFIX):
+        try:
+            rows = write_blocks(results.outfile, batches, results.codec)
+        finally:
+            if spool:
+                spool.cleanup()
+        print_throughput(rows, infiles, time.perf_counter() - start)
+        return
 
     conn = sqlite3.connect(results.outfile)
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS messages
-        (
-          ts REAL,
-          arbitration_id INTEGER,
-          extended INTEGER,
-          remote INTEGER,
-          error INTEGER,
-          dlc INTEGER,
-          data BLOB
-        )""")
-    conn.commit()
-
-    messages = []
-    m = 0
+    existing = has_table(conn, 'messages') and conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone() is not None
+    version = schema_version(conn) if has_table(conn, 'messages') else results.schema or 1
+    if results.schema and version != results.schema:
+        print('{} has schema version {}, import with it'.format(results.outfile, version))
+    create_messages_table(conn, version)
+    if results.signals:
+        canaerospace.create_signals_table(conn)
+    begin_bulk_load(conn)
+
+    # the checkpoints and the summary of an existing db are built anew from all rows afterwards
+    checkpoints = None if results.no_index or existing else CheckpointBuilder(conn)
+    summary_builder = None if results.no_summary or existing else summary.SummaryBuilder(conn)
     try:
-        for msg in in_nosync:
-            if verbosity >= 3:
-                print(msg)
-            messages.append((
-                msg.timestamp,
-                msg.arbitration_id,
-                msg.is_extended_id,
-                msg.is_remote_frame,
-                msg.is_error_frame,
-                msg.dlc,
-                memoryview(msg.data)))
-            if len(messages) >= 100_000:
-                my_logger(conn, messages)
-                m += len(messages)
-                print('Commits', m)
-                messages = []
-
-    except KeyboardInterrupt:
-        pass
+        try:
+            rows = import_batches(conn, batches, results.signals, checkpoints, version, summary_builder)
+        except KeyboardInterrupt:
+            # keep the batches committed so far
+            conn.rollback()
+        # not after other errors, the db is left as it is
+        if not results.no_index:
+            print('Create indexes')
+            create_messages_indexes(conn)
+            if results.signals:
+                canaerospace.create_signals_index(conn)
+            if checkpoints and checkpoints.ordered:
+                checkpoints.finish()
+            else:
+                # rows not in timestamp order are sorted by the query
+                print('Create checkpoints')
+                create_checkpoints(conn)
+        else:
+            # the checkpoints of an existing db do not know the new rows
+            drop_checkpoints(conn)
+        if summary_builder:
+            summary_builder.finish()
+        elif existing and not results.no_summary:
+            print('Create summary')
+            summary.create_summary(conn)
     finally:
-        reader.stop()
-        if len(messages) > 0:
-            my_logger(conn, messages)
+        if spool:
+            spool.cleanup()
+        end_bulk_load(conn)
         conn.close()
+    print_throughput(rows, infiles, time.perf_counter() - start)
+    if results.columns:
+        print('Build columns')
+        columns.build(results.outfile)
 
 
 if __name__ == "__main__":
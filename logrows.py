@@ -0,0 +1,197 @@
+# coding: utf-8
+
+"""
+The rows of the ``messages`` table (ts, arbitration_id, extended, remote, error, dlc, data) from
+can log files, for the importers logfile2sqldb.py and archive.py.
+
+candump .log files are parsed with the vectorized parser of candump.py, .BIN files of the
+onboard loggers are memory-mapped with binlog.py, all other formats are read with can.LogReader.
+Several files are parsed in parallel processes into runs sorted by timestamp, which are merged.
+"""
+
+import glob
+import heapq
+import io
+import os
+import pathlib
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+
+import numpy as np
+from can import LogReader
+from can.io.canutils import CanutilsLogReader
+
+import binlog
+import candump
+
+BATCH_SIZE = 100_000
+
+
+def begin_bulk_load(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+
+
+def end_bulk_load(conn):
+    # back to a single file db, WAL does not work on network file systems
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("PRAGMA journal_mode=DELETE")
+
+
+def input_files(infile):
+    """
+    :param str infile: a logfile, a directory with logfiles or a glob pattern
+    :return: the sorted list of logfiles
+    """
+    if os.path.isdir(infile):
+        suffixes = set(LogReader.message_readers) - {'.db'} | {'.bin'}
+        return sorted(str(p) for p in pathlib.Path(infile).iterdir()
+                      if p.is_file() and p.suffix.lower() in suffixes)
+    if glob.has_magic(infile):
+        return sorted(glob.glob(infile))
+    return [infile]
+
+
+def message_rows(messages, verbosity=0):
+    for msg in messages:
+        if verbosity >= 3:
+            print(msg)
+        yield (msg.timestamp,
+               msg.arbitration_id,
+               msg.is_extended_id,
+               msg.is_remote_frame,
+               msg.is_error_frame,
+               msg.dlc,
+               memoryview(msg.data))
+
+
+CAN_ERR_BUSERROR = 0x00000080
+
+
+def frame_rows(frames, extended):
+    """
+    :param frames: :data:`candump.FRAME_DTYPE` array
+    :param extended: bool array, True for extended ids
+    :return: the rows of `frames`, error frames like `can.io.canutils.CanutilsLogReader` does
+    """
+    ids = frames['arbitration_id']
+    # the len byte of a .BIN record may be corrupt, never read beyond the 8 data bytes
+    dlcs = np.minimum(frames['dlc'], 8).tolist()
+    data = frames['data'].tobytes()
+    rows = list(zip(frames['timestamp'].tolist(),
+                    (ids & candump.CAN_EFF_MASK).tolist(),
+                    extended.tolist(),
+                    repeat(False),
+                    repeat(False),
+                    dlcs,
+                    [data[i:i + n] for i, n in zip(range(0, len(data), 8), dlcs)]))
+    for i in np.flatnonzero((ids & candump.CAN_ERR_FLAG != 0) & (ids & CAN_ERR_BUSERROR != 0)).tolist():
+        rows[i] = (rows[i][0], 0, True, False, True, 0, b'')
+    return rows
+
+
+def candump_rows(infile):
+    """
+    Rows of a candump file, lines which are no data frames (e.g. remote frames) go through
+    `can.io.canutils.CanutilsLogReader`.
+    """
+    for block in candump.read_blocks(infile):
+        rows = frame_rows(block.frames, block.extended)
+        if len(block.bad):
+            lines = block.lines.tolist()
+            for i in block.bad.tolist():
+                line = block.line(i).decode('ascii', 'replace')
+                try:
+                    for msg in CanutilsLogReader(io.StringIO(line)):
+                        rows.extend(message_rows([msg]))
+                        lines.append(i)
+                except ValueError:
+                    print('Skip line {}: {}'.format(block.line0 + i + 1, line))
+            rows = [rows[i] for i in np.argsort(lines, kind='stable')]
+        yield from rows
+
+
+def bin_rows(infile):
+    for records in binlog.read_blocks(infile):
+        yield from frame_rows(records, binlog.is_extended(records))
+
+
+def file_rows(infile, verbosity=0):
+    if infile.lower().endswith('.bin'):
+        yield from bin_rows(infile)
+    elif infile.lower().endswith('.log') and verbosity < 3:
+        yield from candump_rows(infile)
+    else:
+        reader = LogReader(infile)
+        try:
+            yield from message_rows(reader, verbosity)
+        finally:
+            reader.stop()
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def spool_sorted_runs(infile, spool_dir, batch_size=BATCH_SIZE):
+    """
+    Parse `infile` into runs of rows sorted by timestamp, written as pickled batches to files
+    in `spool_dir`. Runs in a worker process.
+
+    :return: the list of run files and the number of rows
+    """
+    runs = []
+    run = None
+    last_ts = None
+    m = 0
+    try:
+        for batch in batched(file_rows(infile), batch_size):
+            batch = [row[:6] + (bytes(row[6]),) for row in batch]
+            batch.sort(key=itemgetter(0))
+            if run is None or batch[0][0] < last_ts:
+                if run:
+                    run.close()
+                fd, name = tempfile.mkstemp(suffix='.run', dir=spool_dir)
+                run = os.fdopen(fd, 'wb')
+                runs.append(name)
+            pickle.dump(batch, run, pickle.HIGHEST_PROTOCOL)
+            last_ts = batch[-1][0]
+            m += len(batch)
+    finally:
+        if run:
+            run.close()
+    return runs, m
+
+
+def read_run(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                break
+            yield from batch
+
+
+def parallel_batches(infiles, spool_dir, jobs=None):
+    """
+    Parse `infiles` in a process pool and merge the sorted runs of all files by timestamp.
+    """
+    runs = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for infile, (file_runs, m) in zip(infiles,
+                                          executor.map(spool_sorted_runs, infiles,
+                                                       [spool_dir] * len(infiles))):
+            print('Parsed {} ({} rows)'.format(infile, m))
+            runs.extend(file_runs)
+    return batched(heapq.merge(*(read_run(run) for run in runs), key=itemgetter(0)))
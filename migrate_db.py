@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Convert the messages table of a can-bus sqlite3 db to schema version 2: integer microsecond
+timestamps in a WITHOUT ROWID table clustered on (ts, seq), see sqlite2.py.
+The db is converted in place, the other tables (signals, checkpoints) are kept.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+from sqlite2 import SCHEMA_VERSION, migrate, schema_version
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "python migrate_db.py",
+        description="Convert a can-bus sqlite3 db to schema version {}.".format(SCHEMA_VERSION))
+    parser.add_argument('dbfile', metavar='db-file', type=str, help='The db, created with logfile2sqldb.py.')
+    parser.add_argument('--no-vacuum', action='store_true',
+                        help='Do not rebuild the db file afterwards, the space of the old table is not freed.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dbfile):
+        print('No such file {}'.format(args.dbfile), file=sys.stderr)
+        raise SystemExit(1)
+    conn = sqlite3.connect(args.dbfile)
+    try:
+        version = schema_version(conn)
+        if version == SCHEMA_VERSION:
+            print('{} has schema version {} already'.format(args.dbfile, version))
+            return
+        start = time.perf_counter()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        rows = migrate(conn)
+        print('Converted {} rows in {:.1f}s'.format(rows, time.perf_counter() - start))
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA journal_mode=DELETE")
+        if not args.no_vacuum:
+            print('Vacuum')
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
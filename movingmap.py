@@ -23,6 +23,7 @@ class MapViewApp(App):
     def __init__(self, pos, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.pos = pos
+        self.signals_version = None
 
     def build(self):
         self.lat = 47.0
@@ -35,6 +36,10 @@ class MapViewApp(App):
         return self.mapview
 
     def clock_callback(self, dt):
+        # redraw only when the CAN thread stored new values
+        if not self.pos.signals.changed(self.signals_version):
+            return
+        self.signals_version = self.pos.signals.version
         lat2, lon2 = self.pos.getLocation()
         if lat2 is not None and lon2 is not None:
             self.lat = lat2
@@ -6,18 +6,35 @@ well as :class:`MessageSync` which plays back messages
 in the recorded order an time intervals.
 """
 
+import os
+
 from can import LogReader
+from archive import ArchiveReader, is_archive
+from blockstore import BlockReader
 from sqlite2 import SqliteReader2
+from timeindex import SeekReader, reader_options
 
 class LogReader2(LogReader):
 
     @staticmethod
-    def __new__(cls, filename, start_time=None, *args, **kwargs):
+    def __new__(cls, filename, start_time=None, *args, end_time=None, can_ids=None, **kwargs):
         """
-        :param str filename: the filename/path the file to read from
-        :param real start_time: the time where to start in log, in Epoch time format
+        :param str filename: the filename/path the file to read from, or an archive directory (see archive.py)
+        :param real start_time: the time where to start in log, in Epoch time format; .log and .asc
+                                files are seeked with their time index, see :mod:`timeindex`
+                                (the timestamps of .asc files are absolute too)
+        :param real end_time: the time where to stop in log (exclusive), only for .db, .canz files and archives
+        :param can_ids: arbitration ids to read, only for .db, .canz files and archives
         """
-        if filename.endswith(".db") and start_time is not None:
-            return SqliteReader2(filename, "messages", start_time, *args, **kwargs)
+        if os.path.isdir(filename) and is_archive(filename):
+            return ArchiveReader(filename, start_time, end_time, can_ids)
+        elif filename.endswith(".db"):
+            return SqliteReader2(filename, "messages", start_time, end_time, can_ids, *args, **kwargs)
+        elif filename.endswith(".canz"):
+            return BlockReader(filename, start_time, end_time, can_ids)
+        elif start_time:
+            return SeekReader(filename, start_time, **kwargs)
         else:
-            return super().__new__(cls, filename, *args, **kwargs)
+            options = reader_options(filename)
+            options.update(kwargs)
+            return super().__new__(cls, filename, *args, **options)
@@ -0,0 +1,265 @@
+# coding: utf-8
+
+"""
+Replay scheduler, sends logged CAN messages at the time given by their timestamps.
+
+Unlike `can.MessageSync`, which sleeps from one message to the next and so adds up the
+oversleep of every message, the send time of every message is computed from one anchor
+(wall clock, log time) on the monotonic `time.perf_counter` clock. A late message does not
+delay the following ones. The scheduler sleeps until a message is due, all messages due within
+a small window are handed out as one batch. Busy waiting for the last fraction of a
+millisecond is opt-in (`spin`), it holds the GIL and competes with the UI and the bus threads.
+
+The replay can run slower or faster than real time, see :attr:`ReplayScheduler.rate`.
+
+How late the messages go out is recorded in a histogram per second.
+"""
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the lateness histogram buckets in seconds, the last bucket is open
+LATENESS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.1)
+
+MIN_RATE = 0.25
+MAX_RATE = 16.0
+# no waiting at all, the messages are sent as fast as possible
+FASTEST = float('inf')
+
+# messages per batch at most at rate FASTEST, where all messages are due at once
+FASTEST_BATCH = 1000
+
+RATES = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, FASTEST)
+
+SecondStats = namedtuple('SecondStats', 'second count max_lateness histogram')
+
+
+def check_rate(rate):
+    """
+    :param rate: replay rate, a number between :data:`MIN_RATE` and :data:`MAX_RATE`, or
+                 :data:`FASTEST`; the string 'max' (as used in the config file) is :data:`FASTEST`
+    :return: the rate as float
+    :raises ValueError: if the rate is not supported
+    """
+    if rate == 'max':
+        return FASTEST
+    rate = float(rate)
+    if rate != FASTEST and not MIN_RATE <= rate <= MAX_RATE:
+        raise ValueError('replay rate must be between {} and {} or max, not {}'.format(MIN_RATE, MAX_RATE, rate))
+    return rate
+
+
+def format_rate(rate):
+    return 'max' if rate == FASTEST else '{:g}x'.format(rate)
+
+
+class LatenessStats:
+
+    def __init__(self, buckets=LATENESS_BUCKETS, history=60, warn_lateness=0.001):
+        """
+        :param buckets: upper bounds of the histogram buckets in seconds
+        :param int history: number of seconds kept in :attr:`history`
+        :param float warn_lateness: a second with a message later than this is logged as warning
+        """
+        self.buckets = buckets
+        self.history = deque(maxlen=history)
+        self.warn_lateness = warn_lateness
+        self.total = 0
+        self.max_lateness = 0.0
+        self._second = None
+        self._reset()
+
+    def _reset(self):
+        self._count = 0
+        self._max = 0.0
+        self._histogram = [0] * (len(self.buckets) + 1)
+
+    def record(self, lateness, now):
+        """
+        :param float lateness: seconds between the due time and the actual send time, < 0 if early
+        :param float now: the monotonic clock, in seconds
+        """
+        second = int(now)
+        if second != self._second:
+            self.flush()
+            self._second = second
+        lateness = max(lateness, 0.0)
+        i = 0
+        for bound in self.buckets:
+            if lateness <= bound:
+                break
+            i += 1
+        self._histogram[i] += 1
+        self._count += 1
+        if lateness > self._max:
+            self._max = lateness
+
+    def flush(self):
+        """
+        Close the current second and report it.
+        """
+        if not self._count:
+            return
+        stats = SecondStats(self._second, self._count, self._max, tuple(self._histogram))
+        self.history.append(stats)
+        self.total += self._count
+        self.max_lateness = max(self.max_lateness, self._max)
+        level = logging.WARNING if self._max > self.warn_lateness else logging.DEBUG
+        logger.log(level, 'replay lateness: %d messages, max %.3f ms, histogram %s',
+                   stats.count, stats.max_lateness * 1000.0, self.format_histogram(stats.histogram))
+        self._reset()
+
+    def format_histogram(self, histogram):
+        labels = ['<={:g}ms'.format(b * 1000.0) for b in self.buckets] + ['>{:g}ms'.format(self.buckets[-1] * 1000.0)]
+        return ' '.join('{}:{}'.format(label, n) for label, n in zip(labels, histogram) if n)
+
+
+class ReplayScheduler:
+
+    def __init__(self, messages, running=None, rate=1.0, window=0.0002, spin=0.0, skip=60.0, resync=0.5,
+                 stats=None, clock=time.perf_counter):
+        """
+        :param messages: iterable of `can.Message` in timestamp order
+        :param running: optional callable, the replay ends as soon as it returns False
+        :param float rate: log seconds replayed per wall clock second, see :func:`check_rate`
+        :param float window: messages due within `window` seconds are returned together
+        :param float spin: the last `spin` seconds before a message is due are busy waited, for
+                           sub-millisecond timing at the cost of a CPU; 0 (default) only sleeps
+        :param float skip: gaps in the log longer than this (in log time) are skipped, like `can.MessageSync`
+        :param float resync: when the replay is behind by more than this (e.g. the process was
+                             suspended) the schedule is anchored anew instead of bursting
+        :param LatenessStats stats: lateness statistics, a new one by default
+        :param clock: monotonic clock in seconds
+        """
+        self.messages = messages
+        self.running = running or (lambda: True)
+        self.window = window
+        self.spin = spin
+        self.skip = skip
+        self.resync = resync
+        self.stats = stats or LatenessStats()
+        self.clock = clock
+        # (wall clock, log time, rate), replaced as a whole, set_rate() runs in another thread
+        self._anchor = (None, None, check_rate(rate))
+        self._last_ts = None
+        self._wakeup = threading.Event()
+
+    @property
+    def rate(self):
+        return self._anchor[2]
+
+    def anchor(self, timestamp, wall=None):
+        """
+        Send the message with `timestamp` at `wall` (default now), all others relative to it.
+        """
+        self._anchor = (self.clock() if wall is None else wall, timestamp, self._anchor[2])
+
+    def set_rate(self, rate):
+        """
+        Change the replay rate, the replay continues from the current position.
+        """
+        rate = check_rate(rate)
+        wall, ts, _ = self._anchor
+        if wall is None:
+            self._anchor = (None, None, rate)
+        else:
+            now = self.clock()
+            self._anchor = (now, self.position(now), rate)
+
+    def position(self, now=None):
+        """
+        :return: the log time of the replay now, None before the first message
+        """
+        wall, ts, rate = self._anchor
+        if wall is None:
+            return None
+        if rate == FASTEST:
+            return self._last_ts
+        return ts + ((self.clock() if now is None else now) - wall) * rate
+
+    def due(self, timestamp):
+        """
+        :return: the wall clock time when the message with `timestamp` is due
+        """
+        wall, ts, rate = self._anchor
+        return wall + (timestamp - ts) / rate
+
+    def wake(self):
+        """
+        Interrupt the wait for the next message, to check :attr:`running` at once.
+        """
+        self._wakeup.set()
+
+    def _wait_until(self, timestamp):
+        """
+        Wait until the message with `timestamp` is due, the rate may change while waiting.
+
+        :return: the due time, None if the replay was stopped while waiting
+        """
+        clock = self.clock
+        while True:
+            due = self.due(timestamp)
+            remaining = due - clock() - self.spin
+            if remaining <= 0:
+                break
+            if self._wakeup.wait(min(remaining, 0.05)):
+                self._wakeup.clear()
+            if not self.running():
+                return None
+        if self.spin:
+            while clock() < due:
+                pass
+        return due
+
+    def __iter__(self):
+        """
+        :return: generator of lists of the messages due at the same time
+        """
+        clock = self.clock
+        stats = self.stats
+        it = iter(self.messages)
+        pending = next(it, None)
+        prev_ts = None
+        try:
+            while pending is not None and self.running():
+                ts = pending.timestamp
+                if self._anchor[0] is None or (prev_ts is not None and ts - prev_ts > self.skip):
+                    self.anchor(ts)
+                fastest = self.rate == FASTEST
+                due = self.due(ts) if fastest else self._wait_until(ts)
+                if due is None:
+                    break
+                now = clock()
+                if not fastest and now - due > self.resync:
+                    logger.warning('replay behind by %.3f s, resync', now - due)
+                    self.anchor(ts, now)
+                    due = now
+                horizon = now + self.window
+                batch = [pending]
+                if not fastest:
+                    stats.record(now - due, now)
+                prev_ts = ts
+                pending = next(it, None)
+                while pending is not None:
+                    ts = pending.timestamp
+                    if ts - prev_ts > self.skip or fastest and len(batch) >= FASTEST_BATCH:
+                        break
+                    due = self.due(ts)
+                    if due > horizon:
+                        break
+                    batch.append(pending)
+                    if not fastest:
+                        stats.record(now - due, now)
+                    prev_ts = ts
+                    pending = next(it, None)
+                self._last_ts = prev_ts
+                yield batch
+        finally:
+            # e.g. releases the cursor of a SqliteReader2 query
+            close = getattr(it, 'close', None)
+            if close:
+                close()
+            stats.flush()
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+"""
+Latest value store for signals, written by the CAN threads and read by the UI.
+
+Every signal has a fixed slot with its value, the timestamp of the value and a sequence
+counter. A writer makes the counter odd, stores value and timestamp and makes it even again,
+a reader retries while the counter is odd or changed during its read (seqlock). So neither
+side takes a lock and a reader always gets value and timestamp of the same update.
+
+Every slot has one writer thread. :attr:`SignalCache.version` changes with every update, the
+UI compares it with the version of its last redraw and skips the redraw if nothing changed.
+"""
+import itertools
+
+
+class SignalCache:
+
+    def __init__(self, names, defaults=None):
+        """
+        :param names: the names of the signals
+        :param dict defaults: optional initial values, else None
+        """
+        self.names = tuple(names)
+        self.slots = {name: i for i, name in enumerate(self.names)}
+        defaults = defaults or {}
+        self._values = [defaults.get(name) for name in self.names]
+        self._stamps = [None] * len(self.names)
+        self._seqs = [0] * len(self.names)
+        self._counter = itertools.count(1)
+        self.version = 0
+
+    def set(self, name, value, timestamp=None):
+        """
+        Store the latest `value` of signal `name`, called by the one writer of the signal.
+        """
+        i = self.slots[name]
+        seqs = self._seqs
+        seqs[i] += 1
+        self._values[i] = value
+        self._stamps[i] = timestamp
+        seqs[i] += 1
+        # next() of itertools.count is atomic, `version += 1` is not
+        self.version = next(self._counter)
+
+    def read(self, name):
+        """
+        :return: the latest value and its timestamp of signal `name`
+        """
+        i = self.slots[name]
+        seqs = self._seqs
+        while True:
+            seq = seqs[i]
+            if seq & 1:
+                continue
+            value = self._values[i]
+            timestamp = self._stamps[i]
+            if seqs[i] == seq:
+                return value, timestamp
+
+    def get(self, name):
+        """
+        :return: the latest value of signal `name`
+        """
+        return self.read(name)[0]
+
+    def snapshot(self):
+        """
+        :return: the version and a dict with the latest value of every signal; the version
+                 was read first, if it differs from the current one the values may be newer
+        """
+        version = self.version
+        return version, {name: self.read(name)[0] for name in self.names}
+
+    def changed(self, version):
+        """
+        :return: True if a signal was updated since `version`
+        """
+        return self.version != version
@@ -4,33 +4,468 @@
 Implements an SQL database writer and reader for storing CAN messages.
 
 .. note:: The database schema is given in the documentation of the loggers.
+
+Two versions of the ``messages`` table exist, the version is stored as ``PRAGMA user_version``:
+
+1. ``ts REAL`` in seconds, a rowid table with separate indexes on (ts) and (arbitration_id, ts)
+   (user_version 0, the format of the loggers).
+2. ``ts INTEGER`` in microseconds and a sequence number ``seq``, a ``WITHOUT ROWID`` table
+   clustered on (ts, seq), so a time range is read from consecutive pages of the table itself,
+   and an index on (arbitration_id, ts).
+
+The reader returns timestamps in seconds for both versions. Convert a db with ``migrate_db.py``.
 """
+import logging
 import sqlite3
+from operator import itemgetter
+
+from can import Message, SqliteReader
+
+DEFAULT_BATCH_SIZE = 2000
+
+# seconds between two checkpoints of the bus state
+CHECKPOINT_INTERVAL = 5.0
+
+INSERT_CHECKPOINT = "INSERT INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+SCHEMA_VERSION = 2
+
+INSERT_MESSAGE = {
+    1: "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+    2: "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+# `ts` in seconds, per schema version, e.g. TS_SECONDS[2].format('MAX(ts)')
+TS_SECONDS = {1: "{}", 2: "{} / 1000000.0"}
+
+# a row of the messages table as the reader returns it, the columns of schema version 1
+MESSAGE_COLUMNS = "{}, arbitration_id, extended, remote, error, dlc, data"
+
+# for reading large dbs: memory-mapped I/O and a 64 MB page cache
+READ_PRAGMAS = (
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+)
+
+_new_message = Message.__new__
+
+
+def assemble_message(frame_data):
+    """
+    Build a :class:`can.Message` from a ``messages`` row without going through ``Message.__init__``.
+
+    The BLOB is used as ``data`` as returned by sqlite (immutable ``bytes``), it is not copied
+    into a ``bytearray``. Code which wants to modify the payload has to assign a new ``data``.
+    """
+    timestamp, can_id, is_extended, is_remote, is_error, dlc, data = frame_data
+    msg = _new_message(Message)
+    msg.timestamp = timestamp
+    msg.arbitration_id = can_id
+    msg.is_extended_id = bool(is_extended)
+    msg.is_remote_frame = bool(is_remote)
+    msg.is_error_frame = bool(is_error)
+    msg.channel = None
+    msg.dlc = dlc
+    msg.data = b'' if data is None or is_remote else data
+    msg.is_fd = False
+    msg.is_rx = True
+    msg.bitrate_switch = False
+    msg.error_state_indicator = False
+    return msg
+
+
+def schema_version(conn):
+    """
+    :return: the version of the ``messages`` table, see the module doc
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0] or 1
+
+
+def to_micros(ts):
+    """
+    :return: the timestamp `ts` in seconds as integer microseconds, as stored by schema version 2
+    """
+    return round(ts * 1000000)
+
+
+# CREATE TABLE of the messages table per schema version, formatted with the table name
+CREATE_MESSAGES = {
+    1: """
+        CREATE TABLE IF NOT EXISTS {}
+        (
+          ts REAL,
+          arbitration_id INTEGER,
+          extended INTEGER,
+          remote INTEGER,
+          error INTEGER,
+          dlc INTEGER,
+          data BLOB
+        )""",
+    2: """
+        CREATE TABLE IF NOT EXISTS {}
+        (
+          ts INTEGER,
+          seq INTEGER,
+          arbitration_id INTEGER,
+          extended INTEGER,
+          remote INTEGER,
+          error INTEGER,
+          dlc INTEGER,
+          data BLOB,
+          PRIMARY KEY (ts, seq)
+        ) WITHOUT ROWID""",
+}
+
+
+CREATE_ID_TS_INDEX = "CREATE INDEX IF NOT EXISTS messages_id_ts_idx ON messages (arbitration_id, ts)"
+
+
+def create_messages_table(conn, version=1):
+    if version not in CREATE_MESSAGES:
+        raise ValueError('unknown schema version {}'.format(version))
+    conn.execute(CREATE_MESSAGES[version].format('messages'))
+    if version == 2:
+        conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+
+
+def create_messages_indexes(conn):
+    """
+    Create the indexes for time range and per CAN id queries, version 2 needs no ts index.
+    """
+    create_ts_index(conn, 'messages')
+    conn.execute(CREATE_ID_TS_INDEX)
+    conn.commit()
+
+
+def v2_rows(rows, seq):
+    """
+    :param rows: rows of schema version 1, ts in seconds
+    :param int seq: sequence number of the first row
+    :return: the rows for schema version 2
+    """
+    return [(round(row[0] * 1000000), i) + tuple(row[1:]) for i, row in enumerate(rows, seq)]
+
+
+def next_seq(conn):
+    """
+    :return: the sequence number of the next row of a version 2 ``messages`` table
+    """
+    return (conn.execute("SELECT MAX(seq) FROM messages").fetchone()[0] or 0) + 1
+
+
+def migrate(conn, batch_size=100_000):
+    """
+    Convert the ``messages`` table of a version 1 db to version 2, in place. The rows are
+    copied in timestamp order, ``seq`` keeps the order of rows with the same timestamp.
+
+    The rows are copied into a new table which replaces ``messages`` only when all are copied,
+    everything in one transaction: if the migration fails or is interrupted, the db is left
+    as it was, with schema version 1.
+
+    :return: the number of rows copied
+    """
+    if schema_version(conn) != 1:
+        raise ValueError('db has schema version {} already'.format(schema_version(conn)))
+    conn.commit()
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DROP TABLE IF EXISTS messages_v2")
+        conn.execute(CREATE_MESSAGES[2].format('messages_v2'))
+        m = 0
+        cursor = conn.execute("SELECT ts, arbitration_id, extended, remote, error, dlc, data FROM messages "
+                              "ORDER BY ts, rowid")
+        insert = INSERT_MESSAGE[2].replace('messages', 'messages_v2')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            conn.executemany(insert, v2_rows(rows, m + 1))
+            m += len(rows)
+        conn.execute("DROP TABLE messages")
+        conn.execute("ALTER TABLE messages_v2 RENAME TO messages")
+        conn.execute(CREATE_ID_TS_INDEX)
+        # last, the db is version 2 only together with the new table
+        conn.execute("PRAGMA user_version = 2")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return m
+
 
-from can import SqliteReader
+def has_ts_index(conn, table_name):
+    """
+    :return: True if `table_name` has an index whose leading column is ``ts``
+    """
+    for index in conn.execute("PRAGMA index_list({})".format(table_name)).fetchall():
+        columns = conn.execute("PRAGMA index_info({})".format(index[1])).fetchall()
+        if columns and columns[0][2] == 'ts':
+            return True
+    return False
+
+
+def create_ts_index(conn, table_name):
+    """
+    Create the index on ``ts`` needed for time range queries, unless one exists already.
+
+    :return: True if a new index was created
+    """
+    if has_ts_index(conn, table_name):
+        return False
+    conn.execute("CREATE INDEX IF NOT EXISTS {0}_ts_idx ON {0} (ts)".format(table_name))
+    conn.commit()
+    return True
+
+
+def has_table(conn, table_name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table_name,)).fetchone() is not None
+
+
+class CheckpointBuilder:
+    """
+    Write the ``checkpoints`` table: every `interval` seconds the last frame of every CAN id
+    seen so far, i.e. the complete state of the bus. Checkpoint ``cp`` holds the frames before
+    ``cp * interval``; during gaps in the log no checkpoints are written.
+
+    The rows are fed with :meth:`add` in timestamp order, e.g. while importing them. A log
+    whose clock jumps back does not meet this, :attr:`ordered` is then False and the
+    checkpoints are wrong: build them with :func:`create_checkpoints` after the import instead
+    of calling :meth:`finish`.
+    """
+
+    def __init__(self, conn, interval=CHECKPOINT_INTERVAL):
+        self.conn = conn
+        self.interval = interval
+        self.state = {}
+        self.next_time = None
+        self.last_ts = None
+        # False once a row came before the latest one
+        self.ordered = True
+        conn.execute("DROP TABLE IF EXISTS checkpoints")
+        conn.execute("""
+            CREATE TABLE checkpoints
+            (
+              cp INTEGER,
+              ts REAL,
+              arbitration_id INTEGER,
+              extended INTEGER,
+              remote INTEGER,
+              error INTEGER,
+              dlc INTEGER,
+              data BLOB
+            )""")
+        conn.execute("CREATE TABLE IF NOT EXISTS checkpoints_info (interval REAL)")
+        conn.execute("DELETE FROM checkpoints_info")
+        conn.execute("INSERT INTO checkpoints_info VALUES (?)", (interval,))
+
+    def add(self, rows):
+        """
+        :param rows: rows of the ``messages`` table
+        """
+        state = self.state
+        next_time = self.next_time
+        last_ts = self.last_ts
+        for row in rows:
+            ts = row[0]
+            if next_time is None:
+                next_time = (ts // self.interval + 1) * self.interval
+            elif ts >= next_time:
+                cp = int(ts // self.interval)
+                self.conn.executemany(INSERT_CHECKPOINT, ((cp,) + r for r in state.values()))
+                next_time = (cp + 1) * self.interval
+            elif ts < last_ts:
+                self.ordered = False
+            last_ts = ts
+            if not row[4]:
+                state[row[1]] = row
+        self.next_time = next_time
+        self.last_ts = last_ts
+
+    def finish(self):
+        self.conn.execute("CREATE INDEX IF NOT EXISTS checkpoints_cp_idx ON checkpoints (cp)")
+        self.conn.commit()
+
+
+def create_checkpoints(conn, table_name='messages', interval=CHECKPOINT_INTERVAL):
+    """
+    Create the ``checkpoints`` table of an existing db, in one pass over `table_name`.
+    """
+    builder = CheckpointBuilder(conn, interval)
+    columns = MESSAGE_COLUMNS.format(TS_SECONDS[schema_version(conn)].format('ts'))
+    cursor = conn.execute("SELECT {} FROM {} ORDER BY ts".format(columns, table_name))
+    while True:
+        rows = cursor.fetchmany(DEFAULT_BATCH_SIZE)
+        if not rows:
+            break
+        builder.add(rows)
+    builder.finish()
+
+
+def drop_checkpoints(conn):
+    conn.execute("DROP TABLE IF EXISTS checkpoints")
+    conn.execute("DROP TABLE IF EXISTS checkpoints_info")
+    conn.commit()
+
+
+def prepare(file, table_name='messages', checkpoints=True):
+    """
+    Create what a replay of the db `file` needs and a db of the loggers has not: the ts index
+    and, with `checkpoints`, the ``checkpoints`` table for :meth:`SqliteReader2.bus_state`.
+    This reads the whole table once, run it before the replay, not in the replay thread.
+    """
+    conn = sqlite3.connect(file)
+    try:
+        if create_ts_index(conn, table_name):
+            logging.info('Created ts index on %s in %s', table_name, file)
+        if checkpoints and not has_table(conn, 'checkpoints'):
+            logging.info('Create checkpoints of %s, this takes a while once', file)
+            create_checkpoints(conn, table_name)
+    except sqlite3.OperationalError as e:
+        logging.warning('Cannot prepare %s for replay: %s', file, e)
+    finally:
+        conn.close()
 
 
 class SqliteReader2(SqliteReader):
 
-    def __init__(self, file, table_name, start_time):
+    def __init__(self, file, table_name, start_time=None, end_time=None, can_ids=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
         """
         :param file: a `str` or since Python 3.7 a path like object that points
                      to the database file to use
         :param str table_name: the name of the table to look for the messages
-        :param real start_time: time where to start reading
+        :param real start_time: time where to start reading (inclusive)
+        :param real end_time: time where to stop reading (exclusive), None reads to the end
+        :param can_ids: optional collection of arbitration ids to read, None reads all
+        :param int batch_size: number of rows fetched from sqlite at once
         """
         super(SqliteReader, self).__init__(file=None)
         self._conn = sqlite3.connect(file, check_same_thread=False)
+        for pragma in READ_PRAGMAS:
+            self._conn.execute(pragma)
         self._cursor = self._conn.cursor()
+        self.version = schema_version(self._conn)
+        self._seconds = TS_SECONDS[self.version]
+        self._columns = MESSAGE_COLUMNS.format(self._seconds.format('ts'))
         self.table_name = table_name
         self.start_time = start_time
+        self.end_time = end_time
+        self.can_ids = can_ids
+        self.batch_size = batch_size
+        try:
+            if create_ts_index(self._conn, table_name):
+                logging.info('Created ts index on %s in %s', table_name, file)
+        except sqlite3.OperationalError as e:
+            logging.warning('No ts index on %s in %s, time range queries will scan the table: %s',
+                            table_name, file, e)
+
+    def _where(self, start_time, end_time, can_ids):
+        conditions = []
+        params = []
+        if start_time is not None:
+            conditions.append("ts >= ?")
+            params.append(to_micros(start_time) if self.version == 2 else start_time)
+        if end_time is not None:
+            conditions.append("ts < ?")
+            params.append(to_micros(end_time) if self.version == 2 else end_time)
+        if can_ids:
+            can_ids = sorted(can_ids)
+            conditions.append("arbitration_id IN ({})".format(", ".join("?" * len(can_ids))))
+            params.extend(can_ids)
+        if not conditions:
+            return "", params
+        return " WHERE " + " AND ".join(conditions), params
+
+    def _select(self, start_time, end_time, can_ids):
+        where, params = self._where(start_time, end_time, can_ids)
+        return "SELECT {} FROM {}{} ORDER BY ts".format(self._columns, self.table_name, where), params
+
+    def read_batches(self, start_time=None, end_time=None, can_ids=None):
+        """
+        Read the messages in the time window [`start_time`, `end_time`) in timestamp order,
+        in lists of up to :attr:`batch_size` messages.
+
+        :param real start_time: first timestamp, None reads from the beginning
+        :param real end_time: end of the window (exclusive), None reads to the end
+        :param can_ids: optional collection of arbitration ids to read, None reads all
+        :rtype: Generator[list[can.Message]]
+        """
+        query, params = self._select(start_time, end_time, can_ids)
+        cursor = self._conn.execute(query, params)
+        fetchmany = cursor.fetchmany
+        batch_size = self.batch_size
+        try:
+            while True:
+                rows = fetchmany(batch_size)
+                if not rows:
+                    break
+                yield list(map(assemble_message, rows))
+        finally:
+            cursor.close()
+
+    def read_range(self, start_time=None, end_time=None, can_ids=None):
+        """
+        Read the messages in the time window [`start_time`, `end_time`) in timestamp order.
+
+        See :meth:`read_batches` for the parameters.
+
+        :rtype: Generator[can.Message]
+        """
+        for batch in self.read_batches(start_time, end_time, can_ids):
+            yield from batch
+
+    def bus_state(self, timestamp, can_ids=None):
+        """
+        The state of the bus at `timestamp`: the last frame of every CAN id before it, from
+        the checkpoint before `timestamp` and the frames since. A db without ``checkpoints``
+        table (see :func:`prepare`) has no state, it is not built here, that would take as
+        long as reading the whole table.
+
+        :param real timestamp: e.g. the seek position
+        :param can_ids: optional collection of arbitration ids, None for all
+        :return: the messages in timestamp order
+        """
+        conn = self._conn
+        if not has_table(conn, 'checkpoints'):
+            logging.warning('No checkpoints in the db, the bus state is not sent')
+            return []
+        interval = conn.execute("SELECT interval FROM checkpoints_info").fetchone()[0]
+        cp = conn.execute("SELECT MAX(cp) FROM checkpoints WHERE cp <= ?",
+                          (int(timestamp // interval),)).fetchone()[0]
+        rows = {}
+        # a lower bound of ts, else sqlite scans the (arbitration_id, ts) index for the GROUP BY
+        since = conn.execute("SELECT {} FROM {}".format(self._seconds.format('MIN(ts)'),
+                                                        self.table_name)).fetchone()[0]
+        if cp is not None:
+            since = cp * interval
+            for row in conn.execute("SELECT ts, arbitration_id, extended, remote, error, dlc, data "
+                                    "FROM checkpoints WHERE cp = ?", (cp,)):
+                rows[row[1]] = row
+        # the frames since the checkpoint
+        where, params = self._where(since, timestamp, can_ids)
+        query = "SELECT {} FROM {}{} AND error = 0 GROUP BY arbitration_id".format(
+            MESSAGE_COLUMNS.format(self._seconds.format('MAX(ts)')), self.table_name, where)
+        for row in conn.execute(query, params):
+            rows[row[1]] = row
+        if can_ids:
+            rows = {can_id: row for can_id, row in rows.items() if can_id in can_ids}
+        return [assemble_message(row) for row in sorted(rows.values(), key=itemgetter(0))]
+
+    def explain(self, start_time=None, end_time=None, can_ids=None):
+        """
+        :return: the sqlite query plan of a :meth:`read_range` query, one detail string per step
+        """
+        query, params = self._select(start_time, end_time, can_ids)
+        return [row[-1] for row in self._conn.execute("EXPLAIN QUERY PLAN " + query, params)]
 
     def __iter__(self):
-        for frame_data in self._cursor.execute(
-                "SELECT * FROM {} where ts >= {:f}".format(self.table_name, self.start_time)):
-            yield SqliteReader2._assemble_message(frame_data)
+        return self.read_range(self.start_time, self.end_time, self.can_ids)
 
     def __len__(self):
         # this might not run in constant time
-        result = self._cursor.execute("SELECT COUNT(*) FROM {} where ts >= {:f}".format(self.table_name, self.start_time))
+        where, params = self._where(self.start_time, self.end_time, self.can_ids)
+        result = self._cursor.execute("SELECT COUNT(*) FROM {}{}".format(self.table_name, where), params)
         return int(result.fetchone()[0])
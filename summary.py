@@ -0,0 +1,160 @@
+# coding: utf-8
+
+"""
+Summary of a flight db, computed once while importing and stored in the db, so reports like
+``analyze_db.py`` are a lookup instead of a scan of the ``messages`` table.
+
+Tables::
+
+    summary_ids    per CAN id: count, first and last ts, mean period, payload changes and
+                   CANaerospace message code gaps
+    summary_nodes  per CANaerospace node id (byte 0): message code gaps
+    summary_gaps   time gaps without any frame longer than :data:`GAP_SECONDS`
+    summary_info   key/value: count, first_ts, last_ts, gap_seconds, GPS bounds (lat_min, ...)
+
+A message code gap is a frame whose message code (byte 3) is not the one after the last
+frame of the same node, 255 is followed by 0.
+"""
+import canaerospace
+from sqlite2 import MESSAGE_COLUMNS, TS_SECONDS, has_table, schema_version
+
+# a pause of the bus longer than this is recorded in summary_gaps
+GAP_SECONDS = 1.0
+
+LAT_ID = canaerospace.SIGNAL_IDS['lat']
+LON_ID = canaerospace.SIGNAL_IDS['lon']
+
+FETCH_SIZE = 100_000
+
+
+def has_summary(conn):
+    return has_table(conn, 'summary_info')
+
+
+class SummaryBuilder:
+    """
+    Collects the summary of the rows fed with :meth:`add` in timestamp order, e.g. while
+    importing them, :meth:`finish` writes the summary tables.
+    """
+
+    def __init__(self, conn, gap_seconds=GAP_SECONDS):
+        self.conn = conn
+        self.gap_seconds = gap_seconds
+        # CAN id -> [count, first ts, last ts, payload changes, code gaps]
+        self.ids = {}
+        self.payloads = {}
+        # node -> last message code
+        self.codes = {}
+        self.node_gaps = {}
+        self.gaps = []
+        self.last_ts = None
+        self.bounds = {LAT_ID: [None, None], LON_ID: [None, None]}
+
+    def add(self, rows):
+        """
+        :param rows: rows of the ``messages`` table, ts in seconds
+        """
+        ids = self.ids
+        payloads = self.payloads
+        codes = self.codes
+        node_gaps = self.node_gaps
+        bounds = self.bounds
+        gap_seconds = self.gap_seconds
+        last_ts = self.last_ts
+        for ts, can_id, _, _, error, _, data in rows:
+            if last_ts is not None and ts - last_ts > gap_seconds:
+                self.gaps.append((last_ts, ts))
+            if last_ts is None or ts > last_ts:
+                last_ts = ts
+            stats = ids.get(can_id)
+            if stats is None:
+                stats = ids[can_id] = [0, ts, ts, 0, 0]
+            stats[0] += 1
+            if ts < stats[1]:
+                stats[1] = ts
+            elif ts > stats[2]:
+                stats[2] = ts
+            if error:
+                continue
+            data = bytes(data)
+            previous = payloads.get(can_id)
+            if previous is not None and previous != data:
+                stats[3] += 1
+            payloads[can_id] = data
+            if len(data) >= 4:
+                node = data[0]
+                code = data[3]
+                last = codes.get(node)
+                if last is not None and code != (0 if last == 255 else last + 1):
+                    node_gaps[node] = node_gaps.get(node, 0) + 1
+                    stats[4] += 1
+                codes[node] = code
+                if can_id in bounds:
+                    value = canaerospace.decode(can_id, data)
+                    if value is not None:
+                        bound = bounds[can_id]
+                        if bound[0] is None or value < bound[0]:
+                            bound[0] = value
+                        if bound[1] is None or value > bound[1]:
+                            bound[1] = value
+        self.last_ts = last_ts
+
+    def finish(self):
+        conn = self.conn
+        for table in ('summary_ids', 'summary_nodes', 'summary_gaps', 'summary_info'):
+            conn.execute("DROP TABLE IF EXISTS {}".format(table))
+        conn.execute("""
+            CREATE TABLE summary_ids
+            (
+              arbitration_id INTEGER PRIMARY KEY,
+              count INTEGER,
+              first_ts REAL,
+              last_ts REAL,
+              mean_period REAL,
+              changes INTEGER,
+              code_gaps INTEGER
+            )""")
+        conn.execute("CREATE TABLE summary_nodes (node INTEGER PRIMARY KEY, code_gaps INTEGER)")
+        conn.execute("CREATE TABLE summary_gaps (start_ts REAL, end_ts REAL)")
+        conn.execute("CREATE TABLE summary_info (key TEXT PRIMARY KEY, value)")
+        conn.executemany("INSERT INTO summary_ids VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         ((can_id, count, first, last, (last - first) / (count - 1) if count > 1 else None,
+                           changes, code_gaps)
+                          for can_id, (count, first, last, changes, code_gaps) in sorted(self.ids.items())))
+        conn.executemany("INSERT INTO summary_nodes VALUES (?, ?)", sorted(self.node_gaps.items()))
+        conn.executemany("INSERT INTO summary_gaps VALUES (?, ?)", self.gaps)
+        stats = list(self.ids.values())
+        info = {
+            'count': sum(s[0] for s in stats),
+            'first_ts': min((s[1] for s in stats), default=None),
+            'last_ts': max((s[2] for s in stats), default=None),
+            'gap_seconds': self.gap_seconds,
+            'lat_min': self.bounds[LAT_ID][0],
+            'lat_max': self.bounds[LAT_ID][1],
+            'lon_min': self.bounds[LON_ID][0],
+            'lon_max': self.bounds[LON_ID][1],
+        }
+        conn.executemany("INSERT INTO summary_info VALUES (?, ?)", sorted(info.items()))
+        conn.commit()
+
+
+def create_summary(conn, table_name='messages', gap_seconds=GAP_SECONDS):
+    """
+    Create the summary tables of an existing db, in one pass over `table_name`.
+    """
+    builder = SummaryBuilder(conn, gap_seconds)
+    columns = MESSAGE_COLUMNS.format(TS_SECONDS[schema_version(conn)].format('ts'))
+    cursor = conn.execute("SELECT {} FROM {} ORDER BY ts".format(columns, table_name))
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        builder.add(rows)
+    builder.finish()
+
+
+def read_info(conn):
+    """
+    :return: dict of the ``summary_info`` table
+    """
+    return dict(conn.execute("SELECT key, value FROM summary_info"))
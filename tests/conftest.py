@@ -0,0 +1,78 @@
+# coding: utf-8
+
+import os
+import sys
+
+import pytest
+
+# the modules of the replayer are plain scripts in the top directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logrows  # noqa: E402
+
+# 2019-09-21 10:00:00 UTC, the start of a partition of the archive
+T0 = 1569060000.0
+
+
+def candump_line(ts, can_id, data, channel='can0'):
+    return '({:.6f}) {} {}#{}\n'.format(ts, channel, can_id, data)
+
+
+def message_row(msg):
+    """
+    :return: `msg` as row of the ``messages`` table, the timestamp rounded to microseconds
+    """
+    return (round(msg.timestamp, 6), msg.arbitration_id, msg.is_extended_id, msg.is_remote_frame, msg.is_error_frame,
+            msg.dlc, bytes(msg.data))
+
+
+def log_rows(path):
+    """
+    :return: the rows of a log like :func:`message_row`
+    """
+    return [(round(row[0], 6),) + row[1:6] + (bytes(row[6]),) for row in logrows.file_rows(path)]
+
+
+def last_frames(rows, timestamp):
+    """
+    :return: the bus state at `timestamp` of `rows` in any order, sorted
+    """
+    state = {}
+    for row in sorted(rows, key=lambda row: row[0]):
+        if row[0] < timestamp and not row[4]:
+            state[row[1]] = row
+    return sorted(state.values())
+
+
+@pytest.fixture
+def candump_log(tmp_path):
+    """
+    A candump log of 3 CAN ids over 20 s, in timestamp order.
+    """
+    path = tmp_path / 'flight.log'
+    with open(path, 'w') as f:
+        for i in range(2000):
+            ts = T0 + i * 0.01
+            f.write(candump_line(ts, '100', '{:04X}'.format(i)))
+            if i % 10 == 0:
+                f.write(candump_line(ts + 0.001, '12345678', '{:016X}'.format(i)))
+            if i % 100 == 0:
+                f.write(candump_line(ts + 0.002, '7FF', ''))
+    return str(path)
+
+
+@pytest.fixture
+def jump_log(tmp_path):
+    """
+    A candump log whose clock jumps back: 600 s of frames, then again from 100.5 s to 400.5 s
+    with other payloads and an id of its own.
+    """
+    path = tmp_path / 'jump.log'
+    with open(path, 'w') as f:
+        for i in range(600):
+            f.write(candump_line(T0 + i, '100', '{:04X}'.format(i)))
+            f.write(candump_line(T0 + i + 0.25, '200', '{:04X}'.format(i)))
+        for i in range(100, 400):
+            f.write(candump_line(T0 + i + 0.5, '100', 'FF{:04X}'.format(i)))
+            f.write(candump_line(T0 + i + 0.75, '300', '{:04X}'.format(i)))
+    return str(path)
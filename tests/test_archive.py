@@ -0,0 +1,98 @@
+# coding: utf-8
+
+import os
+
+import archive
+import logrows
+from player2 import LogReader2
+
+from conftest import T0, candump_line, last_frames, log_rows, message_row
+
+
+def read_all(path, start=None, end=None):
+    reader = LogReader2(path, start, end_time=end)
+    try:
+        return [message_row(msg) for msg in reader]
+    finally:
+        reader.stop()
+
+
+def test_round_trip(candump_log, tmp_path):
+    rows = log_rows(candump_log)
+    for fmt in archive.FORMATS:
+        path = str(tmp_path / fmt)
+        count, paths = archive.import_log(path, [candump_log], fmt=fmt)
+        assert count == len(rows)
+        assert [os.path.relpath(p, path) for p in paths] == [os.path.join('2019', '09', '21', '10-flight.' + fmt)]
+        assert read_all(path) == rows
+        assert read_all(path, T0 + 2.5, T0 + 4) == [row for row in rows if T0 + 2.5 <= row[0] < T0 + 4]
+
+
+def test_partitions(tmp_path):
+    log = tmp_path / 'hours.log'
+    with open(log, 'w') as f:
+        for i in range(3 * 360):
+            f.write(candump_line(T0 + i * 10.0, '100', '{:04X}'.format(i)))
+            f.write(candump_line(T0 + i * 10.0 + 1, '200', '{:02X}'.format(i % 256)))
+    rows = log_rows(str(log))
+    for fmt in archive.FORMATS:
+        path = str(tmp_path / fmt)
+        count, paths = archive.import_log(path, [str(log)], fmt=fmt)
+        assert count == len(rows) and len(paths) == 3
+        catalog = archive.open_catalog(path)
+        try:
+            partitions = archive.find_partitions(catalog, T0 + 3500, T0 + 3700)
+            assert [p for p, _, _ in partitions] == [os.path.join('2019', '09', '21', h + '-hours.' + fmt)
+                                                       for h in ('10', '11')]
+        finally:
+            catalog.close()
+        assert read_all(path) == rows
+        reader = archive.ArchiveReader(path)
+        try:
+            for timestamp in (T0 + 0.5, T0 + 1.5, T0 + 3599, T0 + 3605, T0 + 3661.5, T0 + 10790):
+                state = [message_row(msg) for msg in reader.bus_state(timestamp)]
+                assert sorted(state) == last_frames(rows, timestamp)
+        finally:
+            reader.stop()
+
+
+def test_checkpoints_of_unordered_rows(jump_log, tmp_path):
+    rows = log_rows(jump_log)
+    for fmt in archive.FORMATS:
+        path = str(tmp_path / fmt)
+        archive.import_log(path, [jump_log], fmt=fmt)
+        reader = archive.ArchiveReader(path)
+        try:
+            for timestamp in (T0 + 50, T0 + 130, T0 + 250.6, T0 + 399, T0 + 450, T0 + 700):
+                state = [message_row(msg) for msg in reader.bus_state(timestamp)]
+                assert sorted(state) == last_frames(rows, timestamp)
+        finally:
+            reader.stop()
+
+
+def test_clock_jumping_back_into_a_written_hour(tmp_path, monkeypatch):
+    # batches of 100 rows, so the hours are closed while importing
+    batched = logrows.batched
+    monkeypatch.setattr(logrows, 'batched', lambda rows: batched(rows, 100))
+    log = tmp_path / 'jump.log'
+    with open(log, 'w') as f:
+        for i in range(3 * 360):
+            f.write(candump_line(T0 + i * 10.0, '100', '{:04X}'.format(i)))
+        for i in range(180, 540):
+            f.write(candump_line(T0 + i * 10.0 + 0.5, '200', '{:04X}'.format(i)))
+    rows = log_rows(str(log))
+    for fmt in archive.FORMATS:
+        path = str(tmp_path / fmt)
+        count, paths = archive.import_log(path, [str(log)], fmt=fmt)
+        assert count == len(rows)
+        assert len(set(paths)) == len(paths) == 4
+        assert all(os.path.exists(p) for p in paths)
+        # a partition has the rows in the order of the log
+        assert sorted(read_all(path)) == sorted(rows)
+        reader = archive.ArchiveReader(path)
+        try:
+            for timestamp in (T0 + 1900, T0 + 3605, T0 + 5000, T0 + 7300):
+                state = [message_row(msg) for msg in reader.bus_state(timestamp)]
+                assert sorted(state) == last_frames(rows, timestamp)
+        finally:
+            reader.stop()
@@ -0,0 +1,44 @@
+# coding: utf-8
+
+import pytest
+
+import blockstore
+import logfile2sqldb
+import logrows
+
+from conftest import T0, log_rows, message_row
+
+
+@pytest.mark.parametrize('codec', sorted(blockstore.CODECS))
+def test_round_trip(candump_log, tmp_path, codec):
+    rows = log_rows(candump_log)
+    path = str(tmp_path / 'flight.canz')
+    assert logfile2sqldb.write_blocks(path, logrows.batched(rows, 500), codec) == len(rows)
+    reader = blockstore.BlockReader(path)
+    try:
+        assert reader.codec == codec
+        assert len(reader) == len(rows)
+        assert [message_row(msg) for msg in reader] == rows
+    finally:
+        reader.stop()
+
+
+def test_read_range(candump_log, tmp_path):
+    rows = log_rows(candump_log)
+    path = str(tmp_path / 'flight.canz')
+    logfile2sqldb.write_blocks(path, [rows])
+    start, end = T0 + 3.5, T0 + 7.25
+    expected = [row for row in rows if start <= row[0] < end and row[1] == 0x100]
+    reader = blockstore.BlockReader(path, start, end, {0x100})
+    try:
+        assert [message_row(msg) for msg in reader] == expected
+    finally:
+        reader.stop()
+
+
+def test_abort_keeps_no_file(tmp_path):
+    path = tmp_path / 'aborted.canz'
+    writer = blockstore.BlockWriter(str(path))
+    writer.add([(T0, 0x100, False, False, False, 1, b'\x01')])
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,84 @@
+# coding: utf-8
+
+import threading
+import time
+
+import can
+
+import busoutput
+
+
+class SlowBus:
+    """
+    A bus whose send takes `delay` seconds, it records the messages sent.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+
+    def send(self, message, timeout=None):
+        time.sleep(self.delay)
+        self.sent.append(message)
+
+    def shutdown(self):
+        pass
+
+
+def messages(n):
+    return [can.Message(timestamp=i * 0.001, arbitration_id=0x100, data=[i % 256]) for i in range(n)]
+
+
+def start_output(bus, **options):
+    output = busoutput.BusOutput(bus, 'test', **options)
+    output.start()
+    return output
+
+
+def test_drop_when_full():
+    bus = SlowBus(0.01)
+    output = start_output(bus, maxsize=10)
+    output.offer(messages(100))
+    output.close(timeout=5.0)
+    assert output.dropped == 90
+    assert len(bus.sent) == 10
+
+
+def test_block_waits_for_room():
+    bus = SlowBus(0.0005)
+    output = start_output(bus, maxsize=10, policy=busoutput.BLOCK)
+    sent = messages(300)
+    output.offer(sent)
+    output.close(timeout=5.0)
+    assert output.dropped == 0
+    assert bus.sent == sent
+
+
+def test_block_for_the_fastest_rate():
+    bus = SlowBus(0.0005)
+    output = start_output(bus, maxsize=10)
+    output.offer(messages(300), block=True)
+    output.close(timeout=5.0)
+    assert output.dropped == 0 and len(bus.sent) == 300
+
+
+def test_block_timeout():
+    bus = SlowBus(0.05)
+    output = start_output(bus, maxsize=5, policy=busoutput.BLOCK, block_timeout=0.1)
+    start = time.monotonic()
+    output.offer(messages(100))
+    assert time.monotonic() - start < 1.0
+    assert output.dropped > 80
+    output.close(timeout=0.5)
+
+
+def test_clear_ends_the_wait():
+    bus = SlowBus(0.05)
+    output = start_output(bus, maxsize=5, policy=busoutput.BLOCK, block_timeout=10.0)
+    offer = threading.Thread(target=output.offer, args=(messages(12),))
+    offer.start()
+    time.sleep(0.1)
+    output.clear()
+    offer.join(1.0)
+    assert not offer.is_alive()
+    output.close(timeout=0.5)
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+import numpy as np
+from can.io.canutils import CanutilsLogReader
+
+import candump
+import logrows
+
+LINES = """\
+(1569060000.000000) can0 123#0102030405060708
+(1569060000.000100) can0 1F334455#DEADBEEF
+(1569060000.000200) can0 00000123#11
+(1569060000.000300) can0 123#R
+(1569060000.000400) can0 1F334455#R4
+(1569060000.000500) can0 20000080#0000000000000000
+(1569060000.000600) can0 20000004#0000000000000000
+(1569060000.000700) can0 123##1112233445566778899AABBCC
+(1569060000.000800) can0 7FF#
+
+(1569060000.000900) can1 456#CAFE R
+(1569060000.001000) can1 456#CAFE T
+(1569060000.001100) vcan12 001#8d00100100820100   
+(1569060000.001200) can0 0AB#0a0b0c
+"""
+
+
+def reference_rows(path):
+    with open(path) as f:
+        return [row[:6] + (bytes(row[6]),) for row in logrows.message_rows(CanutilsLogReader(f))]
+
+
+def test_file_rows_like_canutils_reader(tmp_path):
+    path = tmp_path / 'mixed.log'
+    path.write_text(LINES)
+    rows = [row[:6] + (bytes(row[6]),) for row in logrows.file_rows(str(path))]
+    assert rows == reference_rows(path)
+
+
+def test_file_rows_of_a_log(candump_log):
+    rows = [row[:6] + (bytes(row[6]),) for row in logrows.file_rows(candump_log)]
+    assert rows == reference_rows(candump_log)
+
+
+def test_read_blocks_across_chunks(candump_log):
+    blocks = list(candump.read_blocks(candump_log, chunk_size=1000))
+    assert len(blocks) > 1
+    assert [block.line0 for block in blocks[:2]] == [0, len(blocks[0].starts)]
+    frames = np.concatenate([block.frames for block in blocks])
+    assert (frames == candump.read_frames(candump_log)).all()
+    assert len(frames) == len(reference_rows(candump_log))
+
+
+def test_parse_reports_bad_lines():
+    block = candump.parse(b'(1.5) can0 123#0102\ngarbage\n(2.5) can0 124#R\n')
+    assert block.frames['arbitration_id'].tolist() == [0x123]
+    assert block.frames['dlc'].tolist() == [2]
+    assert block.lines.tolist() == [0]
+    assert block.bad.tolist() == [1, 2]
+    assert block.line(2) == b'(2.5) can0 124#R'
+
+
+def test_parse_line():
+    assert candump.parse_line('(1.5) can0 123#0102') == ('1.5', 'can0', '123', '0102')
+    assert candump.parse_line('(1.5) can0 123#010') is None
+    assert candump.parse_line('(1.5) can0 123#R') is None
@@ -0,0 +1,25 @@
+# coding: utf-8
+
+import struct
+
+import canaerospace
+from canreader import CanbusPos, CanlogPos
+
+
+def test_decoders_follow_the_signals():
+    for decoders in (CanlogPos.DECODERS, CanbusPos.DECODERS):
+        for can_id, (name, _) in decoders.items():
+            if can_id in canaerospace.SIGNALS:
+                assert canaerospace.SIGNALS[can_id].name == name
+
+
+def test_flap_is_a_uchar():
+    name, decode_data = CanlogPos.DECODERS[340]
+    assert name == 'flap'
+    assert decode_data(bytes([1, 10, 0, 7, 167, 0, 0, 0])) == 167
+
+
+def test_heading_in_degrees():
+    _, decode_data = CanlogPos.DECODERS[canaerospace.SIGNAL_IDS['th']]
+    assert decode_data(bytes(4) + struct.pack('>f', -90.0)) == 270.0
+    assert decode_data(bytes(6)) is None
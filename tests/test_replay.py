@@ -0,0 +1,11 @@
+# coding: utf-8
+
+import can
+
+import replay
+
+
+def test_fastest_batches_are_bounded():
+    messages = (can.Message(timestamp=i * 0.001, arbitration_id=0x100) for i in range(2500))
+    scheduler = replay.ReplayScheduler(messages, rate=replay.FASTEST)
+    assert [len(batch) for batch in scheduler] == [replay.FASTEST_BATCH, replay.FASTEST_BATCH, 500]
@@ -0,0 +1,43 @@
+# coding: utf-8
+
+import sqlite3
+
+import pytest
+
+import logfile2sqldb
+import sqlite2
+
+from conftest import T0, last_frames, log_rows, message_row
+
+
+def import_db(monkeypatch, infile, outfile, *options):
+    monkeypatch.setattr('sys.argv', ['logfile2sqldb.py', infile, outfile] + list(options))
+    logfile2sqldb.main()
+
+
+@pytest.mark.parametrize('schema', ['1', '2'])
+def test_bus_state_of_unordered_log(jump_log, tmp_path, monkeypatch, schema):
+    db = str(tmp_path / 'jump.db')
+    import_db(monkeypatch, jump_log, db, '--schema', schema, '--no-summary')
+    rows = log_rows(jump_log)
+    reader = sqlite2.SqliteReader2(db, 'messages')
+    try:
+        for timestamp in (T0 + 50, T0 + 130, T0 + 250.6, T0 + 399, T0 + 450, T0 + 700):
+            state = [message_row(msg) for msg in reader.bus_state(timestamp)]
+            assert sorted(state) == last_frames(rows, timestamp)
+    finally:
+        reader.stop()
+
+
+def test_checkpoint_builder_order(jump_log, tmp_path):
+    rows = log_rows(jump_log)
+    conn = sqlite3.connect(str(tmp_path / 'cp.db'))
+    try:
+        builder = sqlite2.CheckpointBuilder(conn)
+        builder.add(sorted(rows, key=lambda row: row[0]))
+        assert builder.ordered
+        builder = sqlite2.CheckpointBuilder(conn)
+        builder.add(rows)
+        assert not builder.ordered
+    finally:
+        conn.close()
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+import os
+from datetime import datetime
+
+import pytest
+from can import ASCReader
+
+import timeindex
+from player2 import LogReader2
+
+from conftest import T0, log_rows, message_row
+
+
+def test_build_and_load(candump_log):
+    index = timeindex.build(candump_log)
+    assert os.path.exists(timeindex.default_path(candump_log))
+    assert len(index) == 200
+    assert list(timeindex.load(candump_log).ts) == list(index.ts)
+    with open(candump_log, 'rb') as f:
+        f.seek(index.offset(T0 + 5.05))
+        assert f.readline().startswith(b'(1569060005.000000) ')
+
+
+def test_stale_index(candump_log):
+    timeindex.build(candump_log)
+    with open(candump_log, 'a') as f:
+        f.write('(1569060030.000000) can0 100#00\n')
+    assert timeindex.load(candump_log) is None
+
+
+@pytest.mark.parametrize('start', [T0, T0 + 0.0105, T0 + 7.3, T0 + 19.99, T0 + 25])
+def test_seek(candump_log, start):
+    expected = [row for row in log_rows(candump_log) if row[0] >= round(start, 6)]
+    reader = LogReader2(candump_log, start)
+    try:
+        assert isinstance(reader, timeindex.SeekReader)
+        assert [message_row(msg) for msg in reader] == expected
+    finally:
+        reader.stop()
+
+
+def asc_block(f, start, n, can_id):
+    f.write('Begin Triggerblock {}\n'.format(start.strftime('%a %b %d %I:%M:%S.%f')[:-3] +
+                                             start.strftime(' %p %Y')))
+    f.write('   0.000000 Start of measurement\n')
+    for i in range(n):
+        f.write('   {:.6f} 1  {:X}             Rx   d 2 {:02X} {:02X}\n'.format(i * 0.01, can_id, i // 256, i % 256))
+    f.write('End TriggerBlock\n')
+
+
+@pytest.fixture
+def asc_log(tmp_path):
+    """
+    An .asc file with two trigger blocks of 10 s, the second one starts an hour after the first.
+    """
+    path = tmp_path / 'flight.asc'
+    with open(path, 'w') as f:
+        f.write('date Sat Sep 21 12:00:00.000 pm 2019\n')
+        f.write('base hex  timestamps absolute\n')
+        f.write('internal events logged\n')
+        asc_block(f, datetime(2019, 9, 21, 12, 0, 0), 1000, 0x100)
+        asc_block(f, datetime(2019, 9, 21, 13, 0, 0), 1000, 0x200)
+    return str(path)
+
+
+def asc_rows(path, start):
+    reader = ASCReader(path, relative_timestamp=False)
+    try:
+        return [message_row(msg) for msg in reader if msg.timestamp >= start]
+    finally:
+        reader.stop()
+
+
+def test_asc_in_epoch_time(asc_log):
+    first = datetime(2019, 9, 21, 12, 0, 0).timestamp()
+    second = datetime(2019, 9, 21, 13, 0, 0).timestamp()
+    index = timeindex.build(asc_log)
+    assert index.ts[0] == first and second in index.ts
+    reader = LogReader2(asc_log)
+    try:
+        rows = [message_row(msg) for msg in reader]
+    finally:
+        reader.stop()
+    assert rows == asc_rows(asc_log, 0)
+    assert rows[0][0] == first and rows[1000][0] == second
+
+
+@pytest.mark.parametrize('offset', [0.0, 5.005, 9.995, 1800, 3600, 3600.5, 3609.99, 7200])
+def test_asc_seek(asc_log, offset):
+    start = datetime(2019, 9, 21, 12, 0, 0).timestamp() + offset
+    reader = LogReader2(asc_log, start)
+    try:
+        assert [message_row(msg) for msg in reader] == asc_rows(asc_log, start)
+    finally:
+        reader.stop()
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+import struct
+
+import can
+import pytest
+
+from transform import Pipeline
+
+
+def frame(can_id, value, fmt):
+    return can.Message(arbitration_id=can_id, data=bytes(4) + struct.pack(fmt, value).ljust(4, b'\0'))
+
+
+@pytest.mark.parametrize('type_name, fmt, value, factor, expected', [
+    ('USHORT', '>H', 0x7fff, 10, 0xffff),
+    ('USHORT', '>H', 100, -1, 0),
+    ('LONG', '>l', 2 ** 30, 4, 2 ** 31 - 1),
+    ('LONG', '>l', -2 ** 30, 4, -2 ** 31),
+    ('UCHAR', 'B', 200, 2, 255),
+    ('FLOAT', '>f', 3e38, 10, 3.4028234663852886e38),
+    ('USHORT', '>H', 1000, 1.5, 1500),
+])
+def test_scale_within_the_range_of_the_type(type_name, fmt, value, factor, expected):
+    pipeline = Pipeline([{'id': 315, 'action': 'scale', 'type': type_name, 'factor': factor}])
+    message, = pipeline([frame(315, value, fmt)])
+    assert struct.unpack_from(fmt, message.data, 4)[0] == expected
+
+
+def test_scale_of_nan():
+    pipeline = Pipeline([{'id': 315, 'action': 'scale', 'type': 'FLOAT', 'factor': 2}])
+    message, = pipeline([frame(315, float('nan'), '>f')])
+    value = struct.unpack_from('>f', message.data, 4)[0]
+    assert value != value
+
+
+def test_rules():
+    pipeline = Pipeline([{'id': 1515, 'action': 'set', 'type': 'USHORT', 'value': 4610},
+                         {'id': 1036, 'action': 'remap', 'to': 1100},
+                         {'id': 1506, 'action': 'rate_limit', 'max_rate': 4}], filter_out=[1200])
+    batch = [frame(1515, 0, '>H'), frame(1036, 1, '>l'), frame(1200, 0, '>l')]
+    batch += [can.Message(timestamp=i * 0.1, arbitration_id=1506) for i in range(10)]
+    result = pipeline(batch)
+    assert struct.unpack_from('>H', result[0].data, 4)[0] == 4610
+    assert result[1].arbitration_id == 1100
+    assert [m.timestamp for m in result[2:]] == pytest.approx([0.0, 0.3, 0.6, 0.9])
+
+
+@pytest.mark.parametrize('rules, filter_out', [
+    ([{'id': 315, 'action': 'explode'}], ()),
+    ([{'id': 315, 'action': 'scale', 'type': 'DOUBLE'}], ()),
+    ([{'id': 315, 'action': 'scale', 'factor': float('inf')}], ()),
+    ([{'id': 315, 'action': 'set', 'type': 'UCHAR', 'value': 300}], ()),
+    ([], 'x'),
+])
+def test_invalid_rules(rules, filter_out):
+    with pytest.raises(ValueError):
+        Pipeline(rules, filter_out)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Time index sidecar of text CAN logs (candump .log and .asc), for seeking without reading the log
+from the beginning.
+
+The sidecar ``<log-file>.tidx`` holds the timestamp and the byte offset of the first line of
+every :data:`INTERVAL` seconds of the log. The replay (:class:`cansender.CanSender`) builds it
+at startup in a thread of its own, other readers on the first seek; build it beforehand with
+``python timeindex.py <log-file>``. It is built again when the log changes. A seek is a binary
+search in the index and a ``seek`` in the log file, the log is then read with the reader of
+python-can from there.
+
+The timestamps of an .asc file are absolute (Epoch), from the date of the header and of every
+``Begin Triggerblock`` line as the ASCReader with ``relative_timestamp=False`` computes them, so
+they compare with the start times of the config file like the timestamps of the other formats.
+
+Other formats (e.g. .blf) have no index, they are read from the beginning and the messages
+before the start time are skipped.
+"""
+
+import argparse
+import bisect
+import io
+import itertools
+import logging
+import os
+import re
+import sys
+import time
+
+import numpy as np
+from can import ASCReader, CanutilsLogReader, LogReader
+
+import candump
+
+INTERVAL = 0.1
+
+SUFFIX = '.tidx'
+
+# formats with an index, suffix -> reader class of python-can
+READERS = {'.log': CanutilsLogReader, '.asc': ASCReader}
+
+# suffix -> options of the reader of python-can
+READER_OPTIONS = {'.asc': {'relative_timestamp': False}}
+
+# the lines of an .asc file as matched by the ASCReader: data line with its leading timestamp,
+# header lines and the start of a trigger block with its date
+_ASC_LINE = re.compile(rb'\s*(\d+\.\d+)\s+(\d+\s+(\w+\s+(Tx|Rx)|ErrorFrame)|CANFD)', re.ASCII | re.IGNORECASE)
+_ASC_DATE = re.compile(rb'\s*date\s+\w+\s+(.+)', re.IGNORECASE)
+_ASC_BASE = re.compile(rb'\s*base\s+(hex|dec)', re.IGNORECASE)
+_ASC_COMMENT = re.compile(rb'\s*//')
+_ASC_TRIGGER = re.compile(rb'\s*begin\s+triggerblock\s+\w+\s+(.+)', re.IGNORECASE)
+
+
+def default_path(filename):
+    return filename + SUFFIX
+
+
+def has_index(filename):
+    """
+    :return: True if `filename` is of a format which can be indexed
+    """
+    return os.path.splitext(filename)[1].lower() in READERS
+
+
+def reader_options(filename):
+    """
+    :return: the options of the reader of python-can for `filename`, see :data:`READER_OPTIONS`
+    """
+    return dict(READER_OPTIONS.get(os.path.splitext(filename)[1].lower(), {}))
+
+
+def _log_stamp(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+
+def _candump_entries(filename, interval):
+    base = 0
+    last = -1
+    for block in candump.read_blocks(filename):
+        if len(block.frames):
+            buckets = np.floor(block.frames['timestamp'] / interval).astype(np.int64)
+            high = np.maximum.accumulate(np.append(last, buckets))
+            new = np.flatnonzero(high[1:] > high[:-1])
+            last = high[-1]
+            yield block.frames['timestamp'][new], base + block.starts[block.lines[new]].astype(np.int64)
+        base += len(block.buf)
+
+
+def _asc_time(date):
+    # the date parser of the reader, so the index has the same times as the messages
+    return ASCReader._datetime_to_timestamp(date.decode('utf-8', 'replace').strip())
+
+
+def _asc_entries(filename, interval, triggers):
+    """
+    Index an .asc file like the ASCReader reads it: the header sets the start time, the line
+    ending the header is skipped, a trigger block sets a new start time.
+
+    :param list triggers: gets the byte offset of every ``Begin Triggerblock`` line
+    """
+    ts = []
+    offsets = []
+    next_ts = None
+    offset = 0
+    start_time = 0.0
+    header = True
+    with open(filename, 'rb') as f:
+        for line in f:
+            if header:
+                match = _ASC_DATE.match(line)
+                if match:
+                    start_time = _asc_time(match.group(1))
+                elif not (_ASC_BASE.match(line) or _ASC_COMMENT.match(line)):
+                    header = False
+            else:
+                match = _ASC_TRIGGER.match(line)
+                if match:
+                    start_time = _asc_time(match.group(1))
+                    triggers.append(offset)
+                else:
+                    match = _ASC_LINE.match(line)
+                    if match:
+                        timestamp = float(match.group(1)) + start_time
+                        if next_ts is None or timestamp >= next_ts:
+                            ts.append(timestamp)
+                            offsets.append(offset)
+                            next_ts = (timestamp // interval + 1) * interval
+            offset += len(line)
+    yield np.array(ts, np.float64), np.array(offsets, np.int64)
+
+
+def build(filename, path=None, interval=INTERVAL):
+    """
+    Index `filename` and write the sidecar.
+
+    :param str path: the sidecar, default ``<log-file>.tidx``
+    :param float interval: seconds of log between two index entries
+    :return: the index
+    :rtype: TimeIndex
+    """
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix not in READERS:
+        raise ValueError('no time index for {} files'.format(suffix))
+    size, mtime = _log_stamp(filename)
+    triggers = []
+    if suffix == '.log':
+        entries = _candump_entries(filename, interval)
+    else:
+        entries = _asc_entries(filename, interval, triggers)
+    ts = []
+    offsets = []
+    for block_ts, block_offsets in entries:
+        ts.append(block_ts)
+        offsets.append(block_offsets)
+    index = TimeIndex(np.concatenate(ts) if ts else np.zeros(0),
+                      np.concatenate(offsets) if offsets else np.zeros(0, np.int64),
+                      np.array(triggers, np.int64))
+    path = path or default_path(filename)
+    try:
+        with open(path, 'wb') as f:
+            np.savez(f, ts=index.ts, offsets=index.offsets, triggers=index.triggers, size=size, mtime=mtime,
+                     interval=interval)
+    except OSError as e:
+        logging.warning('Time index %s not written: %s', path, e)
+    return index
+
+
+def load(filename, path=None):
+    """
+    :return: the index of `filename` from its sidecar, None if missing or older than the log
+    :rtype: TimeIndex
+    """
+    try:
+        with np.load(path or default_path(filename)) as f:
+            if (f['size'], f['mtime']) != _log_stamp(filename):
+                return None
+            return TimeIndex(f['ts'], f['offsets'], f['triggers'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def open_index(filename, path=None):
+    """
+    :return: the index of `filename`, from the sidecar or built now
+    :rtype: TimeIndex
+    """
+    index = load(filename, path)
+    if index is None:
+        start = time.perf_counter()
+        index = build(filename, path)
+        logging.info('Indexed %s in %.1fs', filename, time.perf_counter() - start)
+    return index
+
+
+class TimeIndex:
+
+    def __init__(self, ts, offsets, triggers=None):
+        """
+        :param ts: increasing timestamps of the index entries
+        :param offsets: byte offset of the log line of every timestamp
+        :param triggers: byte offsets of the ``Begin Triggerblock`` lines of an .asc file
+        """
+        self.ts = ts
+        self.offsets = offsets
+        self.triggers = np.zeros(0, np.int64) if triggers is None else triggers
+        self._ts = ts.tolist()
+
+    def __len__(self):
+        return len(self._ts)
+
+    def offset(self, start_time):
+        """
+        :return: byte offset to read from for the messages from `start_time` on, the first
+                 entry not after `start_time`
+        """
+        i = bisect.bisect_right(self._ts, start_time) - 1
+        return int(self.offsets[max(i, 0)]) if self._ts else 0
+
+    def head(self):
+        """
+        :return: byte offset of the first indexed line, the lines before it are the header
+        """
+        return int(self.offsets[0]) if self._ts else 0
+
+    def trigger(self, offset):
+        """
+        :return: byte offset of the last ``Begin Triggerblock`` line between the header and
+                 `offset`, None if there is none
+        """
+        i = int(np.searchsorted(self.triggers, offset, 'right')) - 1
+        if i < 0 or self.triggers[i] < self.head():
+            return None
+        return int(self.triggers[i])
+
+
+def _text(f):
+    return io.TextIOWrapper(f, encoding='utf-8', errors='replace', newline=None)
+
+
+class _Resumed(io.TextIOBase):
+    """
+    Text file which returns the lines of `head` first and then the lines of `f` from its
+    current position, so a reader sees the header of the log before the lines after the seek.
+    """
+
+    def __init__(self, head, f):
+        super().__init__()
+        self._file = f
+        self._lines = itertools.chain(head, f)
+
+    def __next__(self):
+        return next(self._lines)
+
+    def readline(self, size=-1):
+        return next(self._lines, '')
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class SeekReader:
+    """
+    The messages of a log from `start_time` on, the log is read from the index entry before
+    `start_time` (or from the beginning if it has no index) and earlier messages are skipped.
+    """
+
+    def __init__(self, filename, start_time, **kwargs):
+        self.start_time = start_time
+        if has_index(filename):
+            index = open_index(filename)
+            # the offsets count bytes, the file is positioned in binary and decoded afterwards
+            f = open(filename, 'rb')
+            head = _text(io.BytesIO(f.read(index.head()))).readlines()
+            offset = index.offset(start_time)
+            trigger = index.trigger(offset)
+            if trigger is not None:
+                # the start time of the messages after the seek, an empty line first ends the
+                # header if the ASCReader still reads it
+                f.seek(trigger)
+                head += ['\n'] + _text(io.BytesIO(f.readline())).readlines()
+            f.seek(offset)
+            options = reader_options(filename)
+            options.update(kwargs)
+            self.reader = READERS[os.path.splitext(filename)[1].lower()](_Resumed(head, _text(f)), **options)
+        else:
+            self.reader = LogReader(filename, **kwargs)
+
+    def __iter__(self):
+        start_time = self.start_time
+        return itertools.dropwhile(lambda message: message.timestamp < start_time, self.reader)
+
+    def stop(self):
+        self.reader.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        "python timeindex.py",
+        description="Build the time index sidecar <log-file>.tidx of a candump .log or .asc file.")
+    parser.add_argument('logfile', metavar='log-file', type=str, help='The can log file.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.logfile):
+        print('No such file {}'.format(args.logfile), file=sys.stderr)
+        raise SystemExit(1)
+    start = time.perf_counter()
+    try:
+        index = build(args.logfile)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        raise SystemExit(1)
+    print('Wrote {} entries to {} in {:.1f}s'.format(len(index), default_path(args.logfile),
+                                                     time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
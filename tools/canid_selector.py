@@ -1,25 +1,56 @@
 import argparse
+import os
 import sys
 
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import candump  # noqa: E402
+
+
+def can_id(text):
+    """
+    argparse type of a CAN ID in hex format, e.g. 76C
+    """
+    try:
+        value = int(text, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid CAN ID {text!r}, expected hex format, e.g. 76C")
+    if not 0 <= value <= 0x3FFFFFFF:
+        raise argparse.ArgumentTypeError(f"CAN ID {text!r} out of range")
+    return value
+
+
+def line_id(field):
+    """
+    :return: the CAN ID of the ID#data field of a line, None if it is no hex number
+    """
+    try:
+        return int(field.split(b'#')[0], 16)
+    except ValueError:
+        return None
+
 
 def filter_can_log(input_file, output_file, can_ids):
     """
     Reads input_file and writes to output_file only lines where the CAN ID is in can_ids.
     """
-    # Normalize CAN IDs to uppercase for comparison
-    can_ids = set(cid.upper() for cid in can_ids)
+    # IDs are compared as numbers, so 76C and 076c are the same ID
+    can_ids = set(can_ids)
 
     try:
-        with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-            for line in infile:
+        wanted = np.array(sorted(can_ids), dtype=np.uint32)
+        with open(output_file, 'wb') as outfile:
+            for block in candump.read_blocks(input_file):
                 # Based on candump.log format: (timestamp) interface ID#data
                 # e.g., (1569048709.655053) can0 76C#0A0F0000696E6974
-                parts = line.split()
-                if len(parts) >= 3:
-                    # parts[2] should be ID#data
-                    id_part = parts[2].split('#')[0]
-                    if id_part.upper() in can_ids:
-                        outfile.write(line)
+                keep = [block.lines[np.isin(block.frames['arbitration_id'], wanted)]]
+                # lines the parser does not decode, e.g. remote frames 123#R
+                for i in block.bad:
+                    parts = block.line(i).split()
+                    if len(parts) >= 3 and line_id(parts[2]) in can_ids:
+                        keep.append([i])
+                outfile.write(block.select(np.concatenate(keep).astype(np.int64)))
     except FileNotFoundError:
         print(f"Error: File {input_file} not found.", file=sys.stderr)
         sys.exit(1)
@@ -32,22 +63,25 @@ def main():
     parser = argparse.ArgumentParser(description='Filter CAN log file by CAN IDs.')
     parser.add_argument('input', help='Input log filename')
     parser.add_argument('output', help='Output log filename')
-    parser.add_argument('ids', nargs='*', help='List of CAN IDs to keep (hex format, e.g. 76C 708)')
+    parser.add_argument('ids', nargs='*', type=can_id, help='List of CAN IDs to keep (hex format, e.g. 76C 708)')
     parser.add_argument('-canids', help='File containing list of CAN IDs to keep (one per line)')
 
     args = parser.parse_args()
 
     can_ids = set()
     if args.ids:
-        can_ids.update(cid.upper() for cid in args.ids)
+        can_ids.update(args.ids)
 
     if args.canids:
         try:
             with open(args.canids, 'r') as f:
-                for line in f:
+                for n, line in enumerate(f, 1):
                     cid = line.strip()
                     if cid:
-                        can_ids.add(cid.upper())
+                        try:
+                            can_ids.add(can_id(cid))
+                        except argparse.ArgumentTypeError as e:
+                            parser.error(f"{args.canids} line {n}: {e}")
         except FileNotFoundError:
             print(f"Error: CAN IDs file {args.canids} not found.", file=sys.stderr)
             sys.exit(1)
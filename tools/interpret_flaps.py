@@ -1,12 +1,13 @@
 import argparse
 import datetime
 import math
-import re
+import os
 import signal
 import struct
 import sys
 
-LINE_RE = re.compile(r"^\((?P<timestamp>[^)]+)\)\s+\S+\s+(?P<canid>[0-9A-Fa-f]+)#(?P<data>[0-9A-Fa-f]+)$")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import candump  # noqa: E402
 
 
 def half_to_float(bits):
@@ -49,18 +50,18 @@ def interpret_u16(value):
 
 
 def parse_line(line):
-    match = LINE_RE.match(line.strip())
-    if not match:
+    fields = candump.parse_line(line.strip())
+    if not fields:
         return None
 
-    payload = match.group("data")
+    timestamp, _, canid, payload = fields
     if len(payload) < 4:
         return None
 
     raw_u16 = int(payload[-4:], 16)
     return {
-        "timestamp": match.group("timestamp"),
-        "canid": match.group("canid").upper(),
+        "timestamp": timestamp,
+        "canid": canid.upper(),
         "data": payload.upper(),
         "u16": raw_u16,
     }
@@ -0,0 +1,183 @@
+# coding: utf-8
+
+"""
+Transformation of the replayed frames, declared in the config file as list ``canlog.transforms``::
+
+    "transforms": [
+       {"id": 1515, "action": "set", "type": "USHORT", "value": 4610},
+       {"id": 315, "action": "scale", "type": "FLOAT", "factor": 1.1},
+       {"id": 1036, "action": "remap", "to": 1100},
+       {"id": 1506, "action": "rate_limit", "max_rate": 4},
+       {"id": 1200, "action": "drop"}
+    ]
+
+Actions:
+
+* ``drop``: the frame is not sent
+* ``set``: write ``value`` as ``type`` (see :data:`canaerospace.TYPES`) at byte ``offset`` (default 4)
+* ``scale``: the ``type`` value at ``offset`` becomes value * ``factor`` + ``offset_value``,
+  limited to the range of ``type``
+* ``remap``: send with the CAN id ``to``
+* ``rate_limit``: at most ``max_rate`` frames per second of log time, the others are dropped
+
+The rules are compiled once into a dict CAN id -> steps, a frame of an id without rules costs
+one dict lookup. The steps of an id run in the order of the config.
+"""
+import math
+import struct
+
+from canaerospace import TYPES
+
+# the largest finite values of the float formats
+_FLOAT_MAX = {'f': 3.4028234663852886e38, 'd': 1.7976931348623157e308}
+
+ACTIONS = ('drop', 'set', 'scale', 'remap', 'rate_limit')
+
+# before the transforms were configurable the replay always patched this value, it is kept for
+# config files without canlog.transforms
+DEFAULT_TRANSFORMS = [
+    # ID 1515: dry_and_ballast_mass (Hg -> kg * 10)
+    {'id': 1515, 'action': 'set', 'type': 'USHORT', 'value': 4610},
+]
+
+
+def _field(rule):
+    try:
+        s = struct.Struct(TYPES[rule.get('type', 'FLOAT')][0])
+    except KeyError:
+        raise ValueError('unknown type {} in transform {}'.format(rule.get('type'), rule))
+    offset = int(rule.get('offset', 4))
+    if not 0 <= offset <= 8 - s.size:
+        raise ValueError('offset {} out of the payload in transform {}'.format(offset, rule))
+    return s, offset, s.format[-1] in 'fd'
+
+
+def _limits(s):
+    """
+    :return: the smallest and the largest value `s` can pack
+    """
+    code = s.format[-1]
+    if code in _FLOAT_MAX:
+        return -_FLOAT_MAX[code], _FLOAT_MAX[code]
+    bits = 8 * s.size
+    if code.islower():
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+
+def _drop(rule):
+    return lambda message: None
+
+
+def _set(rule):
+    s, offset, is_float = _field(rule)
+    value = rule['value']
+    packed = s.pack(value if is_float else int(value))
+    end = offset + s.size
+
+    def step(message):
+        data = bytearray(message.data).ljust(end, b'\0')
+        data[offset:end] = packed
+        message.data = data
+        message.dlc = len(data)
+        return message
+    return step
+
+
+def _scale(rule):
+    s, offset, is_float = _field(rule)
+    factor = float(rule.get('factor', 1.0))
+    add = float(rule.get('offset_value', 0.0))
+    if not math.isfinite(factor) or not math.isfinite(add):
+        raise ValueError('factor and offset_value must be finite in transform {}'.format(rule))
+    end = offset + s.size
+    low, high = _limits(s)
+
+    def step(message):
+        if len(message.data) < end:
+            return message
+        data = bytearray(message.data)
+        value = s.unpack_from(data, offset)[0]
+        if value == value:
+            # a NaN float stays as it is
+            value = min(max(value * factor + add, low), high)
+        s.pack_into(data, offset, value if is_float else int(round(value)))
+        message.data = data
+        return message
+    return step
+
+
+def _remap(rule):
+    to = int(rule['to'])
+
+    def step(message):
+        message.arbitration_id = to
+        return message
+    return step
+
+
+def _rate_limit(rule):
+    interval = 1.0 / float(rule['max_rate'])
+    last = [None]
+
+    def step(message):
+        ts = message.timestamp
+        if last[0] is not None and 0.0 <= ts - last[0] < interval:
+            return None
+        last[0] = ts
+        return message
+    return step
+
+
+_BUILDERS = {'drop': _drop, 'set': _set, 'scale': _scale, 'remap': _remap, 'rate_limit': _rate_limit}
+
+
+class Pipeline:
+
+    def __init__(self, rules=(), filter_out=()):
+        """
+        :param rules: list of dicts, see the module doc
+        :param filter_out: CAN ids to drop, like a ``drop`` rule
+        :raises ValueError: if a rule is invalid
+        """
+        steps = {}
+        try:
+            for can_id in filter_out:
+                steps.setdefault(int(can_id), []).append(_drop(None))
+        except (TypeError, ValueError) as e:
+            raise ValueError('filter_out must be a list of CAN ids, not {!r}: {}'.format(filter_out, e))
+        for rule in rules:
+            try:
+                can_id = int(rule['id'])
+                build = _BUILDERS[rule['action']]
+                steps.setdefault(can_id, []).append(build(rule))
+            except KeyError as e:
+                raise ValueError('missing or unknown {} in transform {}, actions are {}'.format(
+                    e, rule, ', '.join(ACTIONS)))
+            except (TypeError, ZeroDivisionError, struct.error) as e:
+                raise ValueError('invalid transform {}: {}'.format(rule, e))
+        self.steps = {can_id: tuple(chain) for can_id, chain in steps.items()}
+
+    def __bool__(self):
+        return bool(self.steps)
+
+    def __call__(self, batch):
+        """
+        :return: the transformed messages of `batch` without the dropped ones
+        """
+        steps = self.steps
+        if not steps:
+            return batch
+        result = []
+        for message in batch:
+            chain = steps.get(message.arbitration_id)
+            if chain:
+                for step in chain:
+                    message = step(message)
+                    if message is None:
+                        break
+                else:
+                    result.append(message)
+            else:
+                result.append(message)
+        return result
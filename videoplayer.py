@@ -1,3 +1,4 @@
+import bisect
 import time
 
 from kivy.uix.videoplayer import VideoPlayerAnnotation
@@ -19,6 +20,7 @@ from kivy.uix.scatter import Scatter
 from kivy.uix.widget import Widget
 
 from canreader import CanbusPos
+from replay import RATES, format_rate
 
 Config.set('graphics', 'width', '1000')
 Config.set('graphics', 'height', '800')
@@ -98,6 +100,7 @@ class MapWidget(Scatter):
 class VideoplayerApp(App):
     heading_angle = NumericProperty(0)
     utc_str = StringProperty('--:--:--')
+    rate_str = StringProperty('1x')
     # Absolute path to a safe thumbnail image, resolved via Kivy resources
     thumbnail_path = StringProperty('')
 
@@ -111,6 +114,10 @@ class VideoplayerApp(App):
         self.cur_position = 0
         self.cur_duration = None
         self.position_srv = position_srv
+        self.rate = cansender.rate if cansender else 1.0
+        self.rate_str = format_rate(self.rate)
+        # video position the video is seeked to by _follow_replay(), until it got there
+        self._follow_target = None
         # Resolve a valid thumbnail immediately so KV can bind to it
         # Prefer Kivy's built-in icon as it is guaranteed to exist with Kivy installations
         thumb = resource_find('data/logo/kivy-icon-128.png') or resource_find('data/logo/kivy-icon-512.png')
@@ -126,7 +133,14 @@ class VideoplayerApp(App):
             self.lon = 7.0
             self.th = 0.0
 
+            self._signals_version = None
+
             def clock_callback(dt):
+                # redraw only when the CAN thread stored new values
+                signals = self.position_srv.signals
+                if not signals.changed(self._signals_version):
+                    return
+                self._signals_version = signals.version
                 utc = self.position_srv.getUtc()
                 if utc:
                     self.utc_str = time.strftime('%H:%M:%S', time.localtime(utc))
@@ -142,6 +156,7 @@ class VideoplayerApp(App):
             Clock.schedule_interval(clock_callback, 0.25)
         else:
             self.mainwindow.ids.mapwidget.clear_widgets()
+        Clock.schedule_interval(self._follow_replay, 0.25)
         # Avoid Kivy Image trying to load the MP4 when the VideoPlayer is in 'stop' state
         # by providing a valid thumbnail image (KV sets it via app.thumbnail_path).
         # As an extra safety, set directly if KV binding didn't apply for any reason.
@@ -186,11 +201,37 @@ class VideoplayerApp(App):
         if self.cur_duration is None and videoplayer.duration > 1.0:
             self.cur_duration = videoplayer.duration
             self.root.draw_all_bookmarks(self.bookmarks)
-        if videoplayer.state == 'play' and abs(self.cur_position - position) > 2.0:
+        if self._follow_target is not None:
+            # the video is moved to the replay position, the replay must not be restarted
+            if abs(self._follow_target - position) < 2.0:
+                self._follow_target = None
+        elif videoplayer.state == 'play' and abs(self.cur_position - position) > 2.0:
             self.cansender.stop()
             self.cansender.resume(self.video_position2time(self.cur_position, self.syncpoints))
         self.cur_position = position
 
+    def btn_rate(self, videoplayer):
+        """
+        Switch to the next replay rate. At rates other than 1x the CAN replay is the clock,
+        the video is moved along to the replay position.
+        """
+        self.rate = RATES[(RATES.index(self.rate) + 1) % len(RATES)] if self.rate in RATES else 1.0
+        self.rate_str = format_rate(self.rate)
+        self.cansender.set_rate(self.rate)
+        self._follow_target = None
+
+    def _follow_replay(self, dt):
+        videoplayer = self.mainwindow.ids.video_player
+        if self.rate == 1.0 or videoplayer.state != 'play' or not videoplayer.duration:
+            return
+        ts = self.cansender.position()
+        if ts is None:
+            return
+        position = self.time2video_position(ts, self.syncpoints)
+        if abs(position - self.cur_position) > 0.5:
+            self._follow_target = position
+            videoplayer.seek(min(max(position / videoplayer.duration, 0.0), 1.0))
+
     def realtime(self, cur_position):
         seconds = self.video_position2time(cur_position, self.syncpoints)
         return time.strftime('%H:%M:%S', time.localtime(seconds))
@@ -244,6 +285,26 @@ class VideoplayerApp(App):
         utc_offset = datetime.fromtimestamp(t1) - datetime.utcfromtimestamp(t1)
         return (t1 - ((p1 - vpos) * c)) - utc_offset.seconds
 
+    def time2video_position(self, ts, syncpoints):
+        """
+        The inverse of :meth:`video_position2time`.
+
+        :return: the video position of the log time `ts`
+        """
+        positions = sorted(syncpoints)
+        times = []
+        for p in positions:
+            t1 = syncpoints[p]
+            utc_offset = datetime.fromtimestamp(t1) - datetime.utcfromtimestamp(t1)
+            times.append(t1 - utc_offset.seconds)
+        if ts < times[0] or len(times) == 1:
+            return positions[0] + (ts - times[0])
+        if ts >= times[-1]:
+            return positions[-1] + (ts - times[-1])
+        i = bisect.bisect_right(times, ts) - 1
+        c = (positions[i + 1] - positions[i]) / (times[i + 1] - times[i])
+        return positions[i] + (ts - times[i]) * c
+
     ## todo -- avoid duplicated code !!
     def inbetween_sp(self, syncpoints, val):
         val = int(round(val))